@@ -1,5 +1,7 @@
 import numpy as np
+import tempfile
 from scipy import linalg
+from pyscf import lib
 from pyscf.fci import cistring
 from pyscf.fci.direct_spin1 import _unpack_nelec
 from itertools import product
@@ -11,19 +13,73 @@ ADDRS_NELEC = np.array ([0], dtype=np.uint8)
 for i in range (MAX_NORB):
     ADDRS_NELEC = np.append (ADDRS_NELEC, ADDRS_NELEC+1)
 
-def hilbert2fock (ci, norb, nelec):
+def hilbert2fock (ci, norb, nelec, out=None):
+    ''' Embed the nelec-sector CI vector(s) ci in the Fock space of norb spatial orbitals. If
+    out is provided, ci is written into that Fock-space array (in place; any memory-mapped
+    array will do) and the elements of out outside the nelec sector are not touched. '''
     assert (norb <= MAX_NORB)
     nelec = _unpack_nelec (nelec)
     ndeta = cistring.num_strings (norb, nelec[0])
     ndetb = cistring.num_strings (norb, nelec[1])
     ci = np.asarray (ci).reshape (-1, ndeta, ndetb)
     nroots = ci.shape[0]
-    ci1 = np.zeros ((nroots, 2**norb, 2**norb), dtype=ci.dtype)
+    if out is None:
+        ci1 = np.zeros ((nroots, 2**norb, 2**norb), dtype=ci.dtype)
+    else:
+        ci1 = out.reshape (nroots, 2**norb, 2**norb)
+        assert (np.shares_memory (ci1, out)), 'out must be reshapable without a copy'
     strsa = cistring.addrs2str (norb, nelec[0], list(range(ndeta)))
     strsb = cistring.addrs2str (norb, nelec[1], list(range(ndetb)))
     ci1[:,strsa[:,None],strsb[:]] = ci[:,:,:]
+    if out is not None: return out
     return ci1
 
+def fock_zeros (norb, scratch=False, dtype=np.float64):
+    ''' Allocate a zero Fock-space vector of shape (2**norb, 2**norb)
+
+    Kwargs:
+        scratch : logical or str
+            If True, the vector is backed by an anonymous memory-mapped scratch file in
+            lib.param.TMPDIR (or in the directory given by scratch, if it is a string), so that
+            the operating system can page it out. Sectors of the vector which are never written
+            take no space in the file.
+    '''
+    assert (norb <= MAX_NORB)
+    shape = (2**norb, 2**norb)
+    if not scratch: return np.zeros (shape, dtype=dtype)
+    tmpdir = scratch if isinstance (scratch, str) else lib.param.TMPDIR
+    with tempfile.TemporaryFile (dir=tmpdir) as f:
+        return np.memmap (f, dtype=dtype, mode='w+', shape=shape)
+
+def fock_sector_weights (ci, norb, blksize=None):
+    ''' Squared norm of each (neleca, nelecb) number sector of the Fock-space vector(s) ci,
+    summed over vectors. ci is read a block of alpha strings at a time, so that it can be a
+    memory-mapped array.
+
+    Returns:
+        w : ndarray of shape (norb+1, norb+1)
+            w[neleca,nelecb] is the weight of the (neleca,nelecb) sector
+    '''
+    ndet = 2**norb
+    ci = ci.reshape (-1, ndet)
+    if blksize is None: blksize = max (1, int (32e6 // (8*ndet)))
+    nelec_str = ADDRS_NELEC[:ndet]
+    onehot = np.zeros ((ndet, norb+1))
+    onehot[np.arange (ndet),nelec_str] = 1.0
+    w = np.zeros ((norb+1, norb+1))
+    for r0 in range (0, ci.shape[0], blksize):
+        r1 = min (ci.shape[0], r0+blksize)
+        blk = np.asarray (ci[r0:r1])
+        wb = np.dot ((blk.conj () * blk).real, onehot)
+        w += np.dot (onehot[np.arange (r0,r1) % ndet].T, wb)
+    return w
+
+def fock_sectors (ci, norb):
+    ''' List the (neleca, nelecb) number sectors in which the Fock-space vector(s) ci have any
+    weight '''
+    w = fock_sector_weights (ci, norb)
+    return [(int (na), int (nb)) for na, nb in np.argwhere (w > 0)]
+
 def fock2hilbert (ci, norb, nelec):
     assert (norb <= MAX_NORB)
     nelec = _unpack_nelec (nelec)
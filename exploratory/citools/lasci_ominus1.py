@@ -87,7 +87,7 @@ def kernel (fci, h1, h2, norb, nelec, norb_f=None, ci0_f=None,
 
 def make_rdm1 (fci, fcivec, norb, nelec, **kwargs):
     dm1 = np.zeros ((norb, norb))
-    for nelec in product (range (norb+1), repeat=2):
+    for nelec in fockspace.fock_sectors (fcivec, norb):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
         d = direct_spin1.make_rdm1 (ci, norb, nelec, **kwargs)
         dm1 += d
@@ -96,7 +96,7 @@ def make_rdm1 (fci, fcivec, norb, nelec, **kwargs):
 def make_rdm1s (fci, fcivec, norb, nelec, **kwargs):
     dm1a = np.zeros ((norb,norb))
     dm1b = np.zeros ((norb,norb))
-    for nelec in product (range (norb+1), repeat=2):
+    for nelec in fockspace.fock_sectors (fcivec, norb):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
         da, db = direct_spin1.make_rdm1s (ci, norb, nelec, **kwargs)
         dm1a += da
@@ -106,7 +106,7 @@ def make_rdm1s (fci, fcivec, norb, nelec, **kwargs):
 def make_rdm12 (fci, fcivec, norb, nelec, **kwargs):
     dm1 = np.zeros ((norb,norb))
     dm2 = np.zeros ((norb,norb,norb,norb))
-    for nelec in product (range (norb+1), repeat=2):
+    for nelec in fockspace.fock_sectors (fcivec, norb):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
         d1, d2 = direct_spin1.make_rdm12 (ci, norb, nelec, **kwargs)
         dm1 += d1
@@ -116,7 +116,7 @@ def make_rdm12 (fci, fcivec, norb, nelec, **kwargs):
 def make_rdm12s (fci, fcivec, norb, nelec, **kwargs):
     dm1 = np.zeros ((2,norb,norb))
     dm2 = np.zeros ((3,norb,norb,norb,norb))
-    for nelec in product (range (norb+1), repeat=2):
+    for nelec in fockspace.fock_sectors (fcivec, norb):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
         d1, d2 = direct_spin1.make_rdm12s (ci, norb, nelec, **kwargs)
         dm1 += np.stack (d1, axis=0)
@@ -170,7 +170,7 @@ def _guess_nelec_f (fci, norb, nelec, norb_f, h1, h2):
 
 def spin_square (fci, fcivec, norb, nelec):
     ss = 0.0
-    for ne in product (range (norb+1), repeat=2):
+    for ne in fockspace.fock_sectors (fcivec, norb):
         c = fockspace.fock2hilbert (fcivec, norb, ne)
         ssc = spin_op.contract_ss (c, norb, ne)
         ss += c.conj ().ravel ().dot (ssc.ravel ())
@@ -188,7 +188,7 @@ def contract_ss (fci, ci, norb, nelec):
 
 def transform_ci_for_orbital_rotation (fci, ci, norb, nelec, umat):
     fcivec = np.zeros_like (ci)
-    for ne in product (range (norb+1), repeat=2):
+    for ne in fockspace.fock_sectors (ci, norb):
         c = np.squeeze (fockspace.fock2hilbert (ci, norb, ne))
         c = fci_addons.transform_ci_for_orbital_rotation (c, norb, ne, umat)
         fcivec += np.squeeze (fockspace.hilbert2fock (c, norb, ne))
@@ -332,20 +332,37 @@ class LASUCCTrialState (object):
         h = self.constr_h (xconstr, h)
         c_f = self.rotate_ci0 (xci)
         c = self.dp_ci (c_f)
-        uc = self.uop (c)
+        uc = self.uop (self.fock_copy (c), inplace=True)
         huc = self.contract_h2 (h, uc)
-        uhuc = self.uop (huc, transpose=True)
+        uhuc = self.uop (self.fock_copy (huc), transpose=True, inplace=True)
         return c, uc, huc, uhuc, c_f
 
+    def fock_zeros (self, norb=None):
+        ''' Allocate a zero Fock-space vector, in a memory-mapped scratch file if
+        self.fcisolver.fock_scratch is set '''
+        if norb is None: norb = self.norb
+        scratch = getattr (self.fcisolver, 'fock_scratch', False)
+        return fockspace.fock_zeros (norb, scratch=scratch)
+
+    def fock_copy (self, ci):
+        ''' Copy a Fock-space vector into a new vector allocated by self.fock_zeros '''
+        if not getattr (self.fcisolver, 'fock_scratch', False): return ci.copy ()
+        norb = int (round (math.log2 (ci.size) / 2))
+        ci1 = self.fock_zeros (norb).reshape (ci.shape)
+        ci1[:] = ci[:]
+        return ci1
+
     def contract_h2 (self, h, ci, norb=None):
+        ''' Evaluate H|ci>, sector by sector over the number sectors in which ci has any
+        weight; H conserves both neleca and nelecb, so all other sectors of H|ci> are zero '''
         if norb is None: norb = self.norb
-        hci = h[0] * ci
-        for neleca, nelecb in product (range (norb+1), repeat=2):
-            nelec = (neleca, nelecb)
+        hci = self.fock_zeros (norb).reshape (ci.shape)
+        for nelec in fockspace.fock_sectors (ci, norb):
             h2eff = self.fcisolver.absorb_h1e (h[1], h[2], norb, nelec, 0.5)
             ci_h = np.squeeze (fockspace.fock2hilbert (ci, norb, nelec))
-            hc = direct_spin1.contract_2e (h2eff, ci_h, norb, nelec)
-            hci += np.squeeze (fockspace.hilbert2fock (hc, norb, nelec))
+            hc = direct_spin1.contract_2e (h2eff, ci_h, norb, nelec).reshape (ci_h.shape)
+            hc += h[0] * ci_h
+            fockspace.hilbert2fock (hc, norb, nelec, out=hci)
         return hci
 
     def dp_ci (self, ci_f):
@@ -404,18 +421,18 @@ class LASUCCTrialState (object):
         return vec
 
     def get_jac_constr (self, ci):
-        dm1 = self.fcisolver.make_rdm12 (ci, self.norb, 0)[0]
-        return np.array ([np.trace (dm1) - self.nelec])
+        # <ci|N|ci> from the weights of the number sectors; no density matrices needed
+        w = fockspace.fock_sector_weights (ci, self.norb)
+        n = np.arange (self.norb+1)
+        return np.array ([((n[:,None] + n[None,:]) * w).sum () - self.nelec])
 
     def get_jac_t1 (self, x, h, c=None, huc=None, uhuc=None):
-        g = []
         xconstr, xcc, xci_f = self.unpack (x)
         self.uop.set_uniq_amps_(xcc)
         if (c is None) or (uhuc is None):
             c, _, _, uhuc = self.hc_x (x, h)[:4]
-        for duc, uhuc_i in zip (self.uop.gen_deriv1 (c, _full=False), self.uop.gen_partial (uhuc)):
-            g.append (2*duc.ravel ().dot (uhuc_i.ravel ()))
-        g = self.uop.product_rule_pack (g)
+        g = self.uop.product_rule_pack (self.uop.get_grad (self.fock_copy (c),
+            self.fock_copy (uhuc), overwrite=True))
         return np.asarray (g)
     
     def get_grad_t1(self, x, h, c=None, huc=None, uhuc=None, epsilon=0.0):
@@ -466,8 +483,8 @@ class LASUCCTrialState (object):
         gen_indices = []
         a_idxs_lst = []
         i_idxs_lst = []
-        for i, (duc, uhuc_i) in enumerate(zip(self.uop.gen_deriv1(c, _full=False), self.uop.gen_partial(uhuc))):
-            gradient = 2 * duc.ravel().dot(uhuc_i.ravel())
+        grad = self.uop.get_grad(self.fock_copy(c), self.fock_copy(uhuc), overwrite=True)
+        for i, gradient in enumerate(grad):
             all_g.append((gradient, i))
             
             # Allow all gradients if epsilon is 0, else use the abs gradient condition
@@ -532,8 +549,8 @@ class LASUCCTrialState (object):
         a_idxs_lst = []
         i_idxs_lst = []
         # print("self.uop.init_a_idxs[i]",self.uop.init_a_idxs)
-        for i, (duc, uhuc_i) in enumerate(zip(self.uop.gen_deriv1(c, _full=False), self.uop.gen_partial(uhuc))):
-            gradient = 2 * duc.ravel().dot(uhuc_i.ravel())
+        grad = self.uop.get_grad(self.fock_copy(c), self.fock_copy(uhuc), overwrite=True)
+        for i, gradient in enumerate(grad):
             all_g.append((gradient, i))
 
             # Allow all gradients if epsilon is 0, else use the abs gradient condition
@@ -685,6 +702,10 @@ class LASUCCTrialState (object):
     get_dense_heff = addons.get_dense_heff
 
 class FCISolver (direct_spin1.FCISolver):
+    # If True (or the path of a directory), the dense Fock-space vectors of the trial state
+    # (U|c>, HU|c>, U'HU|c> and the gradient workspace) live in memory-mapped scratch files
+    # in lib.param.TMPDIR (or that directory) instead of RAM
+    fock_scratch = False
     kernel = kernel
     approx_kernel = kernel
     make_rdm1 = make_rdm1
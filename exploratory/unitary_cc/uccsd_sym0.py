@@ -61,6 +61,103 @@ def _op1u_(norb, aidx, iidx, amp, psi, transpose=False, deriv=0):
         ctypes.c_uint (ni))
     return psi
 
+def _pack_idxs (idxs):
+    ''' Concatenate a list of index lists into one uint8 array, with uint64 offsets so that
+        the nth list is idxs_packed[offs[n]:offs[n+1]] '''
+    idxs = [np.asarray (idx, dtype=np.uint8).ravel () for idx in idxs]
+    offs = np.zeros (len (idxs)+1, dtype=np.uint64)
+    offs[1:] = np.cumsum ([idx.size for idx in idxs])
+    if len (idxs): idxs = np.concatenate (idxs)
+    return np.ascontiguousarray (idxs, dtype=np.uint8), offs
+
+def _opNu_(norb, a_idxs, i_idxs, amps, psi, transpose=False):
+    ''' Evaluates U|Psi> = ...U2.U1.U0|Psi>, where each Un is as in _op1u_, in a single
+        call to the compiled library
+
+        Args:
+            norb : integer
+                number of orbitals in the fock space
+            a_idxs : list of len (ngen) of lists
+                lists +cr,-an operators of each generator
+            i_idxs : list of len (ngen) of lists
+                lists +an,-cr operators of each generator
+            amps : ndarray of len (ngen)
+                amplitudes of the generators
+            psi : ndarray of len (2**norb)
+                spinless fock-space CI array; modified in-place
+
+        Kwargs:
+            transpose : logical
+                Setting to True applies U' = U0'.U1'.U2'... instead
+
+        Returns:
+            psi : ndarray of len (2**norb)
+                arg "psi" after operation
+    '''
+    aidx, aoff = _pack_idxs (a_idxs)
+    iidx, ioff = _pack_idxs (i_idxs)
+    amps = np.ascontiguousarray (amps, dtype=np.float64)
+    assert (psi.flags.c_contiguous and psi.dtype == np.float64)
+    libfsucc.FSUCCcontractNu (aidx.ctypes.data_as (ctypes.c_void_p),
+        iidx.ctypes.data_as (ctypes.c_void_p),
+        aoff.ctypes.data_as (ctypes.c_void_p),
+        ioff.ctypes.data_as (ctypes.c_void_p),
+        amps.ctypes.data_as (ctypes.c_void_p),
+        psi.ctypes.data_as (ctypes.c_void_p),
+        ctypes.c_uint (norb),
+        ctypes.c_uint (len (amps)),
+        ctypes.c_int (int (transpose)))
+    return psi
+
+def _gradNu_(norb, a_idxs, i_idxs, amps, psi, uhupsi, overwrite=False):
+    ''' Evaluates the derivatives 2 <Psi|U'H dU/dun|Psi> of all generator amplitudes un in a
+        single sweep over the generators in the compiled library
+
+        Args:
+            norb : integer
+                number of orbitals in the fock space
+            a_idxs : list of len (ngen) of lists
+                lists +cr,-an operators of each generator
+            i_idxs : list of len (ngen) of lists
+                lists +an,-cr operators of each generator
+            amps : ndarray of len (ngen)
+                amplitudes of the generators
+            psi : ndarray of len (2**norb)
+                spinless fock-space CI array |Psi>
+            uhupsi : ndarray of len (2**norb)
+                spinless fock-space CI array U'HU|Psi>
+
+        Kwargs:
+            overwrite : logical
+                If True, psi and uhupsi are used as workspace, and contain U|Psi> and HU|Psi>
+                on return. Otherwise, they are copied.
+
+        Returns:
+            grad : ndarray of len (ngen)
+                derivatives wrt each generator amplitude
+    '''
+    aidx, aoff = _pack_idxs (a_idxs)
+    iidx, ioff = _pack_idxs (i_idxs)
+    amps = np.ascontiguousarray (amps, dtype=np.float64)
+    if overwrite:
+        for vec in (psi, uhupsi):
+            assert (vec.flags.c_contiguous and vec.dtype == np.float64)
+    else:
+        psi = np.array (psi, dtype=np.float64, order='C')
+        uhupsi = np.array (uhupsi, dtype=np.float64, order='C')
+    grad = np.zeros (len (amps), dtype=np.float64)
+    libfsucc.FSUCCgradNu (aidx.ctypes.data_as (ctypes.c_void_p),
+        iidx.ctypes.data_as (ctypes.c_void_p),
+        aoff.ctypes.data_as (ctypes.c_void_p),
+        ioff.ctypes.data_as (ctypes.c_void_p),
+        amps.ctypes.data_as (ctypes.c_void_p),
+        psi.ctypes.data_as (ctypes.c_void_p),
+        uhupsi.ctypes.data_as (ctypes.c_void_p),
+        grad.ctypes.data_as (ctypes.c_void_p),
+        ctypes.c_uint (norb),
+        ctypes.c_uint (len (amps)))
+    return grad
+
 def _op1h_spinsym (norb, herm, psi):
     ''' Evaluate H|Psi>, where H is a general spin-symmetric Hermitian
         operator. I'm too lazy to put this function in its own file.
@@ -281,10 +378,38 @@ class FSUCCOperator (object):
             errstr = 'duplicate generators detected'
             assert (len (pq_sorted) == ngen), errstr
 
+    def get_grad (self, psi, uhupsi, overwrite=False):
+        ''' Get the derivatives of <Psi|U'HU|Psi> wrt all generator amplitudes in a single
+        sweep over the generators. Equivalent to
+
+        [2*du.dot (uhu) for du, uhu in zip (self.gen_deriv1 (psi, _full=False),
+                                             self.gen_partial (uhupsi))]
+
+        Args:
+            psi : ndarray of shape (2**norb)
+                wfn |Psi>
+            uhupsi : ndarray of shape (2**norb)
+                U'HU|Psi>
+
+        Kwargs:
+            overwrite : logical
+                If True, psi and uhupsi are modified in place (to U|Psi> and HU|Psi>) instead
+                of copied
+
+        Returns:
+            grad : ndarray of shape (ngen)
+                Derivatives wrt each generator amplitude; pass to product_rule_pack to
+                get the derivatives wrt the unique amplitudes
+        '''
+        if overwrite: psi, uhupsi = psi.reshape (-1), uhupsi.reshape (-1)
+        else: psi, uhupsi = psi.ravel (), uhupsi.ravel ()
+        return _gradNu_(self.norb, self.a_idxs, self.i_idxs, self.amps, psi, uhupsi,
+                        overwrite=overwrite)
+
     def __call__(self, psi, transpose=False, inplace=False):
         upsi = psi.view () if inplace else psi.copy ()
-        for ix, aidx, iidx, amp in self.gen_fac (reverse=transpose):
-            _op1u_(self.norb, aidx, iidx, amp, upsi, transpose=transpose, deriv=0)
+        _opNu_(self.norb, self.a_idxs, self.i_idxs, self.amps, upsi.reshape (-1),
+               transpose=transpose)
         return upsi
 
     def get_uniq_amps (self):
@@ -429,10 +554,7 @@ class UCCS (lib.StreamObject):
             hupsi = hop (upsi)
             e_tot = upsi.conj ().dot (hupsi)
             uhupsi = uop (hupsi, transpose=True)
-            jac = []
-            for du, uhu in zip (uop.gen_deriv1 (psi0, _full=False), uop.gen_partial (uhupsi)):
-                jac.append (2*du.conj ().dot (uhu)) 
-            jac = uop.product_rule_pack (jac)
+            jac = uop.product_rule_pack (uop.get_grad (psi0, uhupsi))
             return e_tot, np.asarray (jac)
         return mo_coeff, obj_fun, x0
 
@@ -4,6 +4,7 @@ from scipy import linalg, optimize
 from mrh.lib.helper import load_library
 from itertools import combinations
 from pyscf import lib, ao2mo
+from mrh.exploratory.unitary_cc import uccsd_sym0
 
 libfsucc = load_library ('libfsucc')
 
@@ -302,11 +303,8 @@ class FSUCCOperator (object):
             errstr = 'duplicate generators detected'
             assert (len (pq_sorted) == ngen), errstr
 
-    def __call__(self, psi, transpose=False, inplace=False):
-        upsi = psi.view () if inplace else psi.copy ()
-        for ix, aidx, iidx, amp in self.gen_fac (reverse=transpose):
-            _op1u_(self.norb, aidx, iidx, amp, upsi, transpose=transpose, deriv=0)
-        return upsi
+    get_grad = uccsd_sym0.FSUCCOperator.get_grad
+    __call__ = uccsd_sym0.FSUCCOperator.__call__
 
     def get_uniq_amps (self):
         ''' subclass me to apply s**2 or irrep symmetries '''
@@ -438,10 +436,7 @@ class UCCS (lib.StreamObject):
             hupsi = hop (upsi)
             e_tot = upsi.conj ().dot (hupsi)
             uhupsi = uop (hupsi, transpose=True)
-            jac = []
-            for du, uhu in zip (uop.gen_deriv1 (psi0, _full=False), uop.gen_partial (uhupsi)):
-                jac.append (2*du.conj ().dot (uhu)) 
-            jac = uop.product_rule_pack (jac)
+            jac = uop.product_rule_pack (uop.get_grad (psi0, uhupsi))
             return e_tot, np.asarray (jac)
         return mo_coeff, obj_fun, x0
 
@@ -23,9 +23,14 @@
    Cf. Eqs (1)-(12) of JCTC 17 841 2021
    (DOI:10.1021/acs.jctc.0c01052) 
 
-   No spin, no symmetry, no derivatives, not even any looping over amplitudes.
-   Do all of that in the Python caller because none of it can easily be
-   multithreaded.
+   No spin, no symmetry. The determinant space is partitioned among OpenMP
+   threads. Functions that apply many operators in sequence (FSUCCcontractNu,
+   FSUCCgradNu, FSUCCfullhop, FSUCCcontractS2) open a single parallel region
+   and share the work of each operator among its threads with
+   FSUCCcontract1_omp. No element of any output vector is ever updated by more
+   than one thread per operator, and the reductions in FSUCCgradNu are summed
+   over fixed-size blocks in a fixed order, so results are independent of the
+   number of threads.
 
    TODO: double-check that this actually works for number-symmetry-breaking
    generators (it should work for 1P or 1H operators, but I haven't checked 
@@ -53,6 +58,112 @@ void FSUCCmixdetg (int sgn, double * amp, double * psi, double * hpsi,
     hpsi[det_ai] += sgn * (*amp) * psi[det_ia]; 
 }
 
+static inline void FSUCCdetsai (uint64_t det, uint64_t det_i, uint64_t det_a,
+    unsigned int norb, uint64_t * det_ia, uint64_t * det_ai)
+{
+    /* Given a string of spectator spinorbitals "det", find the two full determinant strings
+       coupled by the operators a0'a1'...i1i0 and i0'i1'...a1a0 */
+    // To find the full det string I have to insert i, a in ascending order
+    uint64_t det_00 = det;
+    unsigned int p;
+    for (p = 0; p < norb; p++){
+        if ((det_i|det_a) & (1<<p)){
+            det_00 = (((det_00 >> p) << (p+1)) // move left bits 1 left
+                     | (det_00 & ((1<<p)-1))); // keep right bits
+        } 
+    } // det_00: spectator spinorbitals; all i, a bits unset
+    *det_ia = det_00 | det_i;
+    *det_ai = det_00 | det_a;
+}
+
+static inline int FSUCCsgnai (uint64_t det_ia, uint64_t det_ai, uint8_t * aidx, uint8_t * iidx,
+    unsigned int norb, unsigned int na, unsigned int ni)
+{
+    /* Sign of the matrix element <det_ai|a0'a1'...i1i0|det_ia> */
+    // The sign for the whole excitation is the product of the sign incurred
+    // by doing this to det_ia:
+    // ...i2'...i1'...i0'|0> -> i0'i1'i2'...|0>
+    // and doing this to det_ai:
+    // ...a2'...a1'...a0'|0> -> a0'a1'a2'...|0>.
+    // To implement this without assuming normal-ordered generators
+    // (i.e., i0 < i1 < i2 or a0 < a1 < a2)
+    // we need to pop creation operators from the string in the order that
+    // we move them to the front. Repurpose det_00 for this.
+    const int int_one = 1;
+    unsigned int p, q, sgnbit;
+    uint64_t det_00;
+    sgnbit = 0; // careful to only modify the first bit of this
+    det_00 = det_ia;
+    for (p = 0; p < ni; p++){
+        for (q = iidx[p]+1; q < norb; q++){
+            sgnbit ^= (det_00 & (1<<q))>>q; // c1'c2' = -c2'c1' sign toggle
+        }
+        det_00 ^= (1<<iidx[p]); // pop i[p]
+    }
+    det_00 = det_ai;
+    for (p = 0; p < na; p++){
+        for (q = aidx[p]+1; q < norb; q++){
+            sgnbit ^= (det_00 & (1<<q))>>q; // c1'c2' = -c2'c1' sign toggle
+        }
+        det_00 ^= (1<<aidx[p]); // push a[p]
+    }
+    return int_one - 2*((int) sgnbit);
+}
+
+static uint64_t FSUCCnspectator (uint8_t * aidx, uint8_t * iidx, unsigned int norb,
+    unsigned int na, unsigned int ni, uint64_t * det_i, uint64_t * det_a)
+{
+    /* Number of strings of spectator spinorbitals of the operator a0'a1'...i1i0, and the strings
+       of its annihilated (det_i) and created (det_a) spinorbitals. Returns 0 if the operator is
+       nilpotent. */
+    int r;
+    *det_i = 0; // i is occupied
+    for (r = 0; r < ni; r++){ 
+        if ((*det_i) & (1<<iidx[r])){ return 0; } // nilpotent escape
+        *det_i |= (1<<iidx[r]); 
+    }
+    *det_a = 0; // a is occupied
+    for (r = 0; r < na; r++){ 
+        if ((*det_a) & (1<<aidx[r])){ return 0; } // nilpotent escape
+        *det_a |= (1<<aidx[r]);
+    }
+    // all other spinorbitals in det_i, det_a unoccupied
+    uint64_t ndet = (1<<norb); // 2**norb
+    for (r = 0; r < norb; r++){ if (((*det_i)|(*det_a)) & (1<<r)){
+        ndet >>= 1; // pop 1 spinorbital per unique i,a
+        // we only sum over the spectator-spinorbital determinants
+    }}
+    return ndet;
+}
+
+static void FSUCCcontract1_omp (uint8_t * aidx, uint8_t * iidx, double * amp,
+    double * psi, double * opsi, FSUCCmixer mixer, 
+    unsigned int norb, unsigned int na, unsigned int ni)
+{
+    /* Body of FSUCCcontract1 as an orphaned OpenMP worksharing loop over the spectator
+       determinants. Call it from every thread of an enclosing parallel region (or from serial
+       code) so that consecutive operators can be applied without opening a new team of
+       threads for each one. Every element of opsi is written by exactly one thread, and the
+       implicit barrier at the end of the loop orders consecutive calls, so the result does not
+       depend on the number of threads. */
+
+    uint64_t det_i, det_a, det, det_ia, det_ai;
+    int sgn;
+    const uint64_t ndet = FSUCCnspectator (aidx, iidx, norb, na, ni, &det_i, &det_a);
+    if (ndet == 0){ return; } // nilpotent escape (same for all threads)
+
+#pragma omp for schedule(static)
+
+    for (det = 0; det < ndet; det++){
+        // "det" here is the string of spectator spinorbitals
+        FSUCCdetsai (det, det_i, det_a, norb, &det_ia, &det_ai);
+        if ((psi[det_ia] == 0.0) && (psi[det_ai] == 0.0)){ continue; }
+        sgn = FSUCCsgnai (det_ia, det_ai, aidx, iidx, norb, na, ni);
+        mixer (sgn, amp, psi, opsi, det_ia, det_ai);
+    }
+
+}
+
 void FSUCCcontract1 (uint8_t * aidx, uint8_t * iidx, double * amp,
     double * psi, double * opsi, FSUCCmixer mixer, 
     unsigned int norb, unsigned int na, unsigned int ni)
@@ -79,81 +190,12 @@ void FSUCCcontract1 (uint8_t * aidx, uint8_t * iidx, double * amp,
                 a unitary mixer but ~should not~ with a hermitian mixer 
     */
 
-    const int int_one = 1;
-    // const double ct = cos (tamp); // (ct -st) (ia) -> (ia)
-    // const double st = sin (tamp); // (st  ct) (ai) -> (ai)
-    int r;
-    uint64_t det_i = 0; // i is occupied
-    for (r = 0; r < ni; r++){ 
-        if (det_i & (1<<iidx[r])){ return; } // nilpotent escape
-        det_i |= (1<<iidx[r]); 
-    }
-    uint64_t det_a = 0; // a is occupied
-    for (r = 0; r < na; r++){ 
-        if (det_a & (1<<aidx[r])){ return; } // nilpotent escape
-        det_a |= (1<<aidx[r]);
-    }
-    // all other spinorbitals in det_i, det_a unoccupied
-    uint64_t ndet = (1<<norb); // 2**norb
-    for (r = 0; r < norb; r++){ if ((det_i|det_a) & (1<<r)){
-        ndet >>= 1; // pop 1 spinorbital per unique i,a
-        // we only sum over the spectator-spinorbital determinants
-    }}
 
 #pragma omp parallel default(shared)
 {
-
-    uint64_t det, det_00, det_ia, det_ai;
-    unsigned int p, q, sgnbit;
-    int sgn;
-    double cia, cai;
-
-#pragma omp for schedule(static)
-
-    for (det = 0; det < ndet; det++){
-        // "det" here is the string of spectator spinorbitals
-        // To find the full det string I have to insert i, a in ascending order
-        det_00 = det;
-        for (p = 0; p < norb; p++){
-            if ((det_i|det_a) & (1<<p)){
-                det_00 = (((det_00 >> p) << (p+1)) // move left bits 1 left
-                         | (det_00 & ((1<<p)-1))); // keep right bits
-            } 
-        } // det_00: spectator spinorbitals; all i, a bits unset
-        det_ia = det_00 | det_i;
-        det_ai = det_00 | det_a;
-        if ((psi[det_ia] == 0.0) && (psi[det_ai] == 0.0)){ continue; }
-        // The sign for the whole excitation is the product of the sign incurred
-        // by doing this to det_ia:
-        // ...i2'...i1'...i0'|0> -> i0'i1'i2'...|0>
-        // and doing this to det_ai:
-        // ...a2'...a1'...a0'|0> -> a0'a1'a2'...|0>.
-        // To implement this without assuming normal-ordered generators
-        // (i.e., i0 < i1 < i2 or a0 < a1 < a2)
-        // we need to pop creation operators from the string in the order that
-        // we move them to the front. Repurpose det_00 for this.
-        sgnbit = 0; // careful to only modify the first bit of this
-        det_00 = det_ia;
-        for (p = 0; p < ni; p++){
-            for (q = iidx[p]+1; q < norb; q++){
-                sgnbit ^= (det_00 & (1<<q))>>q; // c1'c2' = -c2'c1' sign toggle
-            }
-            det_00 ^= (1<<iidx[p]); // pop i[p]
-        }
-        det_00 = det_ai;
-        for (p = 0; p < na; p++){
-            for (q = aidx[p]+1; q < norb; q++){
-                sgnbit ^= (det_00 & (1<<q))>>q; // c1'c2' = -c2'c1' sign toggle
-            }
-            det_00 ^= (1<<aidx[p]); // push a[p]
-        }
-        sgn = int_one - 2*((int) sgnbit);
-        mixer (sgn, amp, psi, opsi, det_ia, det_ai);
-    }
-
+    FSUCCcontract1_omp (aidx, iidx, amp, psi, opsi, mixer, norb, na, ni);
 }
 
-
 }
 
 void FSUCCcontract1u (uint8_t * aidx, uint8_t * iidx, double tamp,
@@ -202,6 +244,128 @@ void FSUCCcontract1g (uint8_t * aidx, uint8_t * iidx, double gamp,
     FSUCCcontract1 (aidx, iidx, &gamp, psi, hpsi, mixer, norb, na, ni);
 }
 
+void FSUCCcontractNu (uint8_t * aidx, uint8_t * iidx, uint64_t * aoff, uint64_t * ioff,
+    double * tamps, double * psi, unsigned int norb, unsigned int ngen, int transpose)
+{
+    /* Evaluate U|Psi> = ...U2.U1.U0|Psi>, where
+       Un = e^(tamps[n] [a0'a1'...i1i0 - i0'i1'...a1a0]), in a single call
+
+       Input:
+            aidx : array of shape (aoff[ngen]); concatenated aidx of all generators
+            iidx : array of shape (ioff[ngen]); concatenated iidx of all generators
+            aoff : array of shape (ngen+1); aidx of generator n is aidx[aoff[n]:aoff[n+1]]
+            ioff : array of shape (ngen+1); iidx of generator n is iidx[ioff[n]:ioff[n+1]]
+            tamps : array of shape (ngen); amplitudes or angles
+            transpose : if nonzero, evaluate U'|Psi> = U0'.U1'.U2'...|Psi> instead
+
+       Input/Output:
+            psi : array of shape (2**norb); contains wfn
+                Modified in place. Make a copy in the caller
+                if you don't want to modify the input
+    */
+    FSUCCmixer mixer = &FSUCCmixdetu;
+#pragma omp parallel default(shared)
+{
+    int igen, n;
+    double amp[2];
+    for (igen = 0; igen < ngen; igen++){
+        n = transpose ? (ngen-1-igen) : igen;
+        amp[0] = cos (tamps[n]);
+        amp[1] = transpose ? -sin (tamps[n]) : sin (tamps[n]);
+        FSUCCcontract1_omp (aidx+aoff[n], iidx+ioff[n], amp, psi, psi, mixer,
+                            norb, aoff[n+1]-aoff[n], ioff[n+1]-ioff[n]);
+    }
+}
+}
+
+#define FSUCC_GRAD_BLKSIZE 4096
+void FSUCCgradNu (uint8_t * aidx, uint8_t * iidx, uint64_t * aoff, uint64_t * ioff,
+    double * tamps, double * psi, double * uhupsi, double * grad,
+    unsigned int norb, unsigned int ngen)
+{
+    /* Evaluate the gradient of <Psi|U'HU|Psi> wrt all amplitudes in one sweep over the
+       generators, where U = ...U2.U1.U0 and Un = e^(tamps[n] Gn) with
+       Gn = a0'a1'...i1i0 - i0'i1'...a1a0:
+
+       grad[n] = 2 <Un...U0 U'HU Psi|Gn|Un...U0 Psi>
+
+       Input:
+            aidx, iidx, aoff, ioff, tamps : as in FSUCCcontractNu
+
+       Input/Output:
+            psi : array of shape (2**norb); on entry, |Psi>; on exit, U|Psi>
+            uhupsi : array of shape (2**norb); on entry, U'HU|Psi>; on exit, HU|Psi>
+
+       Output:
+            grad : array of shape (ngen)
+
+       Both vectors are transformed by each Un in the same pass over the determinants that
+       accumulates grad[n]. The partial sums are accumulated over blocks of determinants of
+       fixed size and then added up in order, so that the result does not depend on the
+       number of threads.
+    */
+    const uint64_t nblk_max = ((((uint64_t) 1)<<norb) + FSUCC_GRAD_BLKSIZE - 1) / FSUCC_GRAD_BLKSIZE;
+    double * gblk = malloc (nblk_max * sizeof (double));
+
+#pragma omp parallel default(shared)
+{
+    uint64_t det_i, det_a, ndet, nblk, iblk, jblk;
+    uint64_t det, det_ia, det_ai, det0, det1;
+    uint8_t * a_n;
+    uint8_t * i_n;
+    unsigned int na, ni;
+    double cosn, sinn, gn, psi_ia, psi_ai, mu_ia, mu_ai, snsin, acc;
+    int n, sgn;
+    for (n = 0; n < ngen; n++){
+        // Every thread evaluates the same per-generator constants
+        a_n = aidx + aoff[n];
+        i_n = iidx + ioff[n];
+        na = aoff[n+1] - aoff[n];
+        ni = ioff[n+1] - ioff[n];
+        ndet = FSUCCnspectator (a_n, i_n, norb, na, ni, &det_i, &det_a);
+        if (ndet == 0){ // nilpotent escape
+#pragma omp single
+            grad[n] = 0.0;
+            continue;
+        }
+        nblk = (ndet + FSUCC_GRAD_BLKSIZE - 1) / FSUCC_GRAD_BLKSIZE;
+        cosn = cos (tamps[n]);
+        sinn = sin (tamps[n]);
+#pragma omp for schedule(static)
+        for (jblk = 0; jblk < nblk; jblk++){
+            det0 = jblk * FSUCC_GRAD_BLKSIZE;
+            det1 = MIN (ndet, det0 + FSUCC_GRAD_BLKSIZE);
+            acc = 0.0;
+            for (det = det0; det < det1; det++){
+                FSUCCdetsai (det, det_i, det_a, norb, &det_ia, &det_ai);
+                psi_ia = psi[det_ia];
+                psi_ai = psi[det_ai];
+                mu_ia = uhupsi[det_ia];
+                mu_ai = uhupsi[det_ai];
+                if ((psi_ia == 0.0) && (psi_ai == 0.0) && (mu_ia == 0.0) && (mu_ai == 0.0)){
+                    continue;
+                }
+                sgn = FSUCCsgnai (det_ia, det_ai, a_n, i_n, norb, na, ni);
+                snsin = sgn * sinn;
+                psi[det_ia] = (cosn*psi_ia) - (snsin*psi_ai);
+                psi[det_ai] = (snsin*psi_ia) + (cosn*psi_ai);
+                uhupsi[det_ia] = (cosn*mu_ia) - (snsin*mu_ai);
+                uhupsi[det_ai] = (snsin*mu_ia) + (cosn*mu_ai);
+                acc += sgn * ((uhupsi[det_ai]*psi[det_ia]) - (uhupsi[det_ia]*psi[det_ai]));
+            }
+            gblk[jblk] = acc;
+        } // implicit barrier: gblk complete
+#pragma omp single
+{
+        gn = 0.0;
+        for (iblk = 0; iblk < nblk; iblk++){ gn += gblk[iblk]; }
+        grad[n] = 2*gn;
+} // implicit barrier: gblk free to be overwritten
+    }
+}
+    free (gblk);
+}
+
 void FSUCCprojai (uint8_t * aidx, uint8_t * iidx, double * psi, 
     unsigned int norb, unsigned int na, unsigned int ni)
 {
@@ -241,8 +405,8 @@ void FSUCCprojai (uint8_t * aidx, uint8_t * iidx, double * psi,
 }
 
 // Declare a recursive driver for FSUCCfullhop
-void _fullhop_(double*, double*, double*, uint8_t*, uint8_t*,
-    unsigned int, unsigned int, unsigned int);
+void _fullhop_(double*, double*, uint8_t*, uint8_t*, uint8_t*, uint8_t*,
+    uint64_t*, unsigned int, unsigned int, unsigned int);
 void FSUCCfullhop (double * hop, double * psi, double * hpsi,
     unsigned int norb, unsigned int nelec)
 {
@@ -257,16 +421,39 @@ void FSUCCfullhop (double * hop, double * psi, double * hpsi,
             
        Output:
             hpsi : array of shape 2**(2*norb); output wfn
+
+       The spinorbital terms of H are enumerated first and then applied one after another
+       within a single parallel region, each term partitioning the determinants among the
+       threads. Each element of hpsi therefore accumulates its terms in the same order
+       regardless of the number of threads.
     */
+    const unsigned int npair = norb*(norb+1)/2;
+    const uint64_t nterm_max = (uint64_t) pow (4*npair, nelec);
     uint8_t * pidx = malloc (nelec * sizeof (uint8_t));
     uint8_t * qidx = malloc (nelec * sizeof (uint8_t));
+    uint8_t * pidx_terms = malloc (nterm_max * nelec * sizeof (uint8_t));
+    uint8_t * qidx_terms = malloc (nterm_max * nelec * sizeof (uint8_t));
+    double * hop_terms = malloc (nterm_max * sizeof (double));
+    uint64_t nterm = 0;
     // Enter recursion over dimensions/electrons
-    _fullhop_(hop, psi, hpsi, pidx, qidx, norb, nelec, 0);
+    _fullhop_(hop, hop_terms, pidx, qidx, pidx_terms, qidx_terms, &nterm, norb, nelec, 0);
+    FSUCCmixer mixer = &FSUCCmixdetg;
+#pragma omp parallel default(shared)
+{
+    uint64_t iterm;
+    for (iterm = 0; iterm < nterm; iterm++){
+        FSUCCcontract1_omp (pidx_terms+(iterm*nelec), qidx_terms+(iterm*nelec),
+            hop_terms+iterm, psi, hpsi, mixer, 2*norb, nelec, nelec);
+    }
+}
     free (pidx);
     free (qidx);
+    free (pidx_terms);
+    free (qidx_terms);
+    free (hop_terms);
 }
-void _fullhop_(double * hop, double * psi, double * hpsi,
-    uint8_t * pidx, uint8_t * qidx, unsigned int norb,
+void _fullhop_(double * hop, double * hop_terms, uint8_t * pidx, uint8_t * qidx,
+    uint8_t * pidx_terms, uint8_t * qidx_terms, uint64_t * nterm, unsigned int norb,
     unsigned int nelec, unsigned int ielec)
 {
 
@@ -287,11 +474,13 @@ void _fullhop_(double * hop, double * psi, double * hpsi,
                 pidx[ielec] = pq[0+iperm] + (spin*norb);
                 qidx[ielec] = pq[1-iperm] + (spin*norb);
                 if (ielec+1<nelec){ // recurse to next-minor dimension
-                    _fullhop_(hop+(pq_idx*opstep), psi, hpsi, pidx, qidx, norb,
-                        nelec, ielec+1);
-                } else { // execute
-                    FSUCCcontract1g (pidx, qidx, hop[pq_idx], psi, hpsi, 2*norb,
-                        nelec, nelec);
+                    _fullhop_(hop+(pq_idx*opstep), hop_terms, pidx, qidx, pidx_terms,
+                        qidx_terms, nterm, norb, nelec, ielec+1);
+                } else if (hop[pq_idx] != 0.0) { // record term for execution
+                    memcpy (pidx_terms+((*nterm)*nelec), pidx, nelec * sizeof (uint8_t));
+                    memcpy (qidx_terms+((*nterm)*nelec), qidx, nelec * sizeof (uint8_t));
+                    hop_terms[*nterm] = hop[pq_idx];
+                    (*nterm)++;
                 }
             }
         }
@@ -301,8 +490,6 @@ void _fullhop_(double * hop, double * psi, double * hpsi,
 void FSUCCcontractS2 (double * psi, double * s2psi, unsigned int norb)
 {
     /* Evaluate S^2|Psi> */
-    uint8_t p, q;
-    uint8_t pqqp[4];
     uint64_t ndet = (1<<(2*norb)); // 2**(2*norb)
 
 #pragma omp parallel default(shared)
@@ -324,15 +511,20 @@ void FSUCCcontractS2 (double * psi, double * s2psi, unsigned int norb)
         sz = (na-nb) * 0.5; 
         s2psi[idet] = ((sz*sz) + 0.5*(na+nb)) * psi[idet];
     }
-}    
+// implicit barrier: diagonal part of s2psi complete
 
+    uint8_t p, q;
+    uint8_t pqqp[4];
+    const double mone = -1.0;
+    FSUCCmixer mixer = &FSUCCmixdetg;
     for (p = 0; p < norb; p++){ for (q = 0; q < norb; q++){
         pqqp[0] = p + norb; // spin-up cr
         pqqp[1] = q;        // spin-down cr
         pqqp[2] = q + norb; // spin-up an
         pqqp[3] = p;        // spin-down an
-        FSUCCcontract1g (pqqp, pqqp+2, -1.0, psi, s2psi, 2*norb, 2, 2);
+        FSUCCcontract1_omp (pqqp, pqqp+2, (double *) &mone, psi, s2psi, mixer, 2*norb, 2, 2);
     }}
+}    
     
 }
 
@@ -0,0 +1,53 @@
+import numpy as np
+
+def compress_cderi (cderi, tol=1e-10, blksize=None):
+    '''Compress the auxiliary index of a set of three-center integrals in a small orbital basis.
+
+    The two-electron integrals (ij|kl) = sum_P L_Pij L_Pkl only span at most npair = n(n+1)/2
+    auxiliary functions, so a pivoted Cholesky decomposition of the npair x npair matrix (ij|kl),
+    stopped when the largest remaining diagonal element falls below tol, yields an equivalent set
+    of at most npair three-center integrals. The decomposition is abandoned as soon as it reaches
+    naux vectors, so an incompressible cderi costs O(npair**2 naux) rather than O(npair**3).
+
+    Args:
+        cderi : ndarray or h5py dataset of shape (naux, npair)
+            Three-center integrals with packed lower-triangular orbital-pair index
+
+    Kwargs:
+        tol : float
+            Stop the decomposition once no diagonal element of (ij|kl) - sum_P L_Pij L_Pkl
+            exceeds this. The error of any two-electron integral computed from the output is then
+            bounded by tol.
+        blksize : integer
+            Number of rows of cderi to read at a time
+
+    Returns:
+        cderi : ndarray of shape (naux1, npair)
+            Compressed three-center integrals, naux1 <= min (naux, npair). If the compression
+            would not reduce the auxiliary dimension, the input is returned unmodified.
+    '''
+    naux, npair = cderi.shape
+    if blksize is None: blksize = max (1, int (32e6 // (8*max (1,npair))))
+    eri = np.zeros ((npair, npair), dtype=cderi.dtype)
+    for b0 in range (0, naux, blksize):
+        b1 = min (naux, b0+blksize)
+        blk = np.asarray (cderi[b0:b1])
+        eri += np.dot (blk.conj ().T, blk)
+    cderi1 = _pivoted_cholesky (eri, tol, naux)
+    if cderi1 is None: return cderi
+    return cderi1
+
+def _pivoted_cholesky (eri, tol, maxrank):
+    '''Rows L of eri = L^H L, truncated once the largest residual diagonal element is below tol,
+    or None if that would take maxrank or more rows'''
+    npair = eri.shape[0]
+    diag = eri.diagonal ().real.copy ()
+    l = np.zeros ((min (maxrank, npair), npair), dtype=eri.dtype)
+    for k in range (l.shape[0]):
+        p = np.argmax (diag)
+        if diag[p] <= tol: return l[:k]
+        row = eri[p] - np.dot (l[:k,p].conj (), l[:k])
+        l[k] = row / np.sqrt (diag[p])
+        diag -= (l[k].conj () * l[k]).real
+    if np.amax (diag) <= tol and l.shape[0] < maxrank: return l
+    return None
@@ -2,7 +2,7 @@ import numpy as np
 from functools import reduce
 from pyscf import gto, scf, dft, lo, lib, mcscf
 from pyscf.csf_fci import csf_solver
-from mrh.my_pyscf.dmet._dmet import _DMET 
+from mrh.my_pyscf.dmet._dmet import _DMET, _MultiDMET
 
 # Author: Bhavnesh Jangid <jangidbhavnesh@uchicago.edu>
 
@@ -67,6 +67,47 @@ def _get_dmet_fragment(mf, lo_method='meta_lowdin', bath_tol=1e-6, density_fit=T
     return get_fragment_mf(mf, lo_method, bath_tol, density_fit, atmlst, atmlabel, verbose, **kwargs)
 
 runDMET = _get_dmet_fragment
+
+def get_fragments_mf(mf, atmlsts, lo_method='meta_lowdin', bath_tol=1e-6, density_fit=True,
+                     nthreads=1, atmlabels=None, verbose=None, **kwargs):
+    '''
+    Get the DMET Mean Field objects for several fragments at once, sharing the
+    localization and the transformation of the DF integrals
+    Args:
+        mf : SCF object
+            SCF object for the molecule
+        atmlsts : list of lists
+            List of atom indices for each fragment
+        lo_method : str
+            Localization method
+        bath_tol : float
+            Bath tolerance
+        nthreads : int
+            Number of embedded mean-field calculations run at the same time
+        atmlabels : list of lists
+            List of atom labels for each fragment
+        verbose : int
+            Print level
+    Returns:
+        dmet_mfs : list of SCF objects
+            DMET mean-field object for each fragment
+        mydmets : list of _DMET objects
+            Contain ao2eo, ao2co etc. for each fragment
+    '''
+    if isinstance(mf, dft.rks.KohnShamDFT) or isinstance(mf, scf.uhf.UHF):
+        mf = mf.to_rhf()
+    elif hasattr(mf, 'kpts'):
+        raise NotImplementedError("Use pDMET code")
+
+    mymultidmet = _MultiDMET(mf, atmlsts, lo_method=lo_method, bath_tol=bath_tol,
+                             density_fit=density_fit, nthreads=nthreads,
+                             atmlabels=atmlabels, verbose=verbose, **kwargs)
+    dmet_mfs = mymultidmet.kernel()
+    for mydmet, dmet_mf in zip(mymultidmet.frags, dmet_mfs):
+        _energy_contribution(mydmet, dmet_mf, mf.verbose)
+    return dmet_mfs, mymultidmet.frags
+
+runMultiDMET = get_fragments_mf
 if __name__ == '__main__':
     mol = gto.Mole(basis='6-31G', spin=1, charge=0, verbose=4, max_memory = 10000)
     mol.atom='''
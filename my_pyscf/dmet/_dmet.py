@@ -1,5 +1,6 @@
 import numpy as np
 import scipy
+from concurrent.futures import ThreadPoolExecutor
 from pyscf import gto, ao2mo, lib, scf
 from mrh.my_pyscf.dmet.localization import Localization
 from mrh.my_pyscf.dmet.fragmentation import Fragmentation
@@ -71,7 +72,8 @@ class _DMET:
     '''
     Density Matrix Embedding Theory
     '''
-    def __init__(self, mf, lo_method='meta_lowdin', bath_tol=1e-6, atmlst=None, density_fit=True, **kwargs):
+    def __init__(self, mf, lo_method='meta_lowdin', bath_tol=1e-6, atmlst=None, density_fit=True,
+                 aux_tol=None, **kwargs):
         _keys = ['loc_rdm1','mask_frag','mask_env','ao2lo','ao2eo',
                  'ao2co','lo2eo','lo2co','imp_nelec','core_nelec',]
         '''
@@ -86,6 +88,10 @@ class _DMET:
                 List of atom indices
             density_fit: boolean
                 DF option for the embedded part
+            aux_tol: float
+                If given, compress the aux basis of the embedded DF integrals by a
+                pivoted Cholesky decomposition of the embedded ERIs, stopped once the
+                largest residual diagonal element falls below aux_tol
             verbose : int
                 Print level
             nao: int
@@ -121,6 +127,7 @@ class _DMET:
         self.atmlst = atmlst
         self.bath_tol = bath_tol
         self.density_fit = density_fit
+        self.aux_tol = aux_tol
        
     def do_localization_(self, **kwargs):
         '''
@@ -327,6 +334,7 @@ class _DMET:
         log.info('Fragment type = %s', 'atom list' )
         log.info('Lo_method = %s', self.lo_method)
         log.info('Bath_tol = %s', self.bath_tol)
+        log.info('Aux_tol = %s', self.aux_tol)
         log.info('Number of frag orb = %s', sum(self.mask_frag))
         log.info('Number of env orb = %s',  sum(self.mask_env))
         log.info('Number of imp orb = %s',  self.ao2eo.shape[1])
@@ -377,9 +385,20 @@ class _DMET:
         
         return veff
 
-    def _get_dmet_mf(self):
+    def _build_dmet_mf(self, eri=None, fock_ao=None):
         '''
-        Get the DMET mean-field object
+        Build the DMET mean-field object without running it.
+        All of the full-system work is done here.
+        Args:
+            eri : np.array
+                Embedded CDERI (or 8-fold ERIs) if already transformed
+            fock_ao : np.array
+                Fock matrix of the full system in AO basis, if already computed
+        Returns:
+            emb_mf : SCF object
+                DMET mean-field object
+            dm_guess : np.array
+                Initial guess for emb_mf
         '''
         mf = self.mf
         neo = self.ao2eo.shape[1]
@@ -390,12 +409,14 @@ class _DMET:
 
         basistransf = BasisTransform(mf, ao2eo, ao2co)
 
-        if hasattr(mf, 'with_df') and mf.with_df is not None and self.density_fit:
-            eri = basistransf._get_cderi_transformed(ao2eo)
+        if eri is not None:
+            pass
+        elif hasattr(mf, 'with_df') and mf.with_df is not None and self.density_fit:
+            eri = basistransf._get_cderi_transformed(ao2eo, aux_tol=self.aux_tol)
         else:
             eri = ao2mo.restore(8, basistransf._get_eri_transformed(ao2eo=ao2eo), neo)
         
-        fock = basistransf._get_fock_transformed()
+        fock = basistransf._get_fock_transformed(fock=fock_ao)
        
         dm = mf.make_rdm1()
 
@@ -431,6 +452,13 @@ class _DMET:
         emb_mf.conv_tol = 1e-10
         emb_mf.max_cycle = 100
         emb_mf.energy_nuc = lambda *args: core_energy
+        return emb_mf, dm_guess
+
+    def _get_dmet_mf(self, eri=None, fock_ao=None):
+        '''
+        Get the DMET mean-field object
+        '''
+        emb_mf, dm_guess = self._build_dmet_mf(eri=eri, fock_ao=fock_ao)
         emb_mf.kernel(dm_guess)
 
         assert emb_mf.converged, 'DMET mean-field did not converge'
@@ -605,3 +633,123 @@ class _DMET:
     def kernel(self):
         dmet_mf = self.runDMET()
         return dmet_mf
+
+
+class _MultiDMET:
+    '''
+    DMET for several fragments of the same molecule. The localization, the
+    full-system Fock matrix and the pass over the DF integrals are shared
+    by all fragments.
+    '''
+    def __init__(self, mf, atmlsts, lo_method='meta_lowdin', bath_tol=1e-6, density_fit=True,
+                 aux_tol=None, nthreads=1, atmlabels=None, verbose=None, **kwargs):
+        '''
+        Args:
+            mf : SCF object
+                SCF object for the molecule
+            atmlsts : list of lists
+                List of atom indices for each fragment
+            lo_method : str
+                Localization method
+            bath_tol : float
+                Bath tolerance
+            density_fit: boolean
+                DF option for the embedded part
+            aux_tol: float
+                See _DMET
+            nthreads: int
+                Number of embedded mean-field calculations run at the same time
+            atmlabels : list of lists
+                List of atom labels for each fragment
+            verbose : int
+                Print level
+            kwargs:
+                Passed on to each _DMET
+            frags: list of _DMET
+                One _DMET instance per fragment, sharing ao2lo and loc_rdm1
+        '''
+        self.mol = mf.mol
+        self.mf = mf
+        self.atmlsts = atmlsts
+        self.lo_method = lo_method
+        self.bath_tol = bath_tol
+        self.density_fit = density_fit
+        self.aux_tol = aux_tol
+        self.nthreads = nthreads
+        if atmlabels is None:
+            atmlabels = [None for atmlst in atmlsts]
+        self.frags = [_DMET(mf, lo_method=lo_method, bath_tol=bath_tol, atmlst=atmlst,
+                            density_fit=density_fit, aux_tol=aux_tol, atmlabel=atmlabel,
+                            verbose=verbose, **kwargs)
+                      for atmlst, atmlabel in zip(atmlsts, atmlabels)]
+
+    def do_localization_(self):
+        '''
+        Localize the entire orbital space once and share it with all fragments.
+        '''
+        loc = Localization(self.mf, lo_method=self.lo_method)
+        ao2lo = loc.get_localized_orbitals()
+        loc_rdm1 = loc.localized_rdm1(ao2lo)
+        for frag in self.frags:
+            frag.ao2lo = ao2lo
+            frag.loc_rdm1 = loc_rdm1
+        return self
+
+    def generate_impurity_subspaces_(self):
+        '''
+        Schmidt decomposition for every fragment from the shared loc_rdm1.
+        '''
+        for frag in self.frags:
+            frag.do_fragmentation_()
+            frag.generate_impurity_subspace_()
+            frag.get_imp_nelecs()
+            frag.get_core_elecs()
+            frag.dump_flags()
+        return self
+
+    def _get_eris(self):
+        '''
+        Embedded integrals for all fragments. With DF, all fragments are
+        transformed in a single loop over the full-system CDERI integrals.
+        '''
+        mf = self.mf
+        if hasattr(mf, 'with_df') and mf.with_df is not None and self.density_fit:
+            basistransf = BasisTransform(mf, None, None)
+            mos = [frag.ao2eo for frag in self.frags]
+            return basistransf._get_cderi_transformed_batch(mos, aux_tol=self.aux_tol)
+        return [None for frag in self.frags]
+
+    def _get_dmet_mfs(self):
+        '''
+        Build all the DMET mean-field objects in serial, then run them
+        on a pool of nthreads Python threads.
+        '''
+        fock_ao = self.mf.get_fock()
+        eris = self._get_eris()
+        emb_mfs = [frag._build_dmet_mf(eri=eri, fock_ao=fock_ao)
+                   for frag, eri in zip(self.frags, eris)]
+        nthreads = min(self.nthreads, len(emb_mfs))
+        def run(emb_mf, dm_guess):
+            emb_mf.kernel(dm_guess)
+            assert emb_mf.converged, 'DMET mean-field did not converge'
+            return emb_mf
+        if nthreads > 1:
+            omp_nthreads = max(1, lib.num_threads() // nthreads)
+            def run_threaded(args):
+                with lib.with_omp_threads(omp_nthreads):
+                    return run(*args)
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                dmet_mfs = list(executor.map(run_threaded, emb_mfs))
+        else:
+            dmet_mfs = [run(*args) for args in emb_mfs]
+        return dmet_mfs
+
+    def kernel(self):
+        '''
+        Returns:
+            dmet_mfs : list of SCF objects
+                DMET mean-field object for each fragment
+        '''
+        self.do_localization_()
+        self.generate_impurity_subspaces_()
+        return self._get_dmet_mfs()
@@ -1,6 +1,7 @@
 import numpy as np
 from functools import reduce
 from pyscf import ao2mo
+from mrh.my_pyscf.df.compress import compress_cderi
 
 # Author: Bhavnesh Jangid <jangidbhavnesh@uchicago.edu>
 
@@ -43,12 +44,14 @@ class BasisTransform:
         operator = reduce(np.dot, (basis.T, operator, basis))
         return operator
 
-    def _get_fock_transformed(self, ao2eo=None):
+    def _get_fock_transformed(self, ao2eo=None, fock=None):
         '''
         Fock matrix transformation
         Args:
             ao2eo : np.array nao * neo
                 Transformation matrix from AO to EO
+            fock : np.array nao * nao
+                Fock matrix of the full system in AO basis, if already computed
         Returns:
             fock : np.array neo * neo
                 Transformed Fock matrix in AO basis
@@ -56,7 +59,8 @@ class BasisTransform:
         if ao2eo is None:
             ao2eo = self.ao2eo
         
-        fock = self.mf.get_fock()
+        if fock is None:
+            fock = self.mf.get_fock()
 
         get_basis_transform = BasisTransform._get_basis_transformed
 
@@ -70,28 +74,52 @@ class BasisTransform:
         
         return fock_frag
 
-    def _get_cderi_transformed(self, mo):
+    def _get_cderi_transformed(self, mo, aux_tol=None):
         """
         Transforms CDERI integrals from AO to MO basis.
         Lpq---> Lij 
         Args:
            mo: np.array (nao*neo)
+           aux_tol: float
+                If given, compress the aux index of Lij by a pivoted Cholesky
+                decomposition of (ij|kl), stopped once the largest residual diagonal
+                element falls below aux_tol. This leaves at most neo*(neo+1)/2 aux
+                functions. See mrh.my_pyscf.df.compress.compress_cderi.
         Returns:
             Transformed CDERI integrals (Lij).
         """
-        nmo = mo.shape[-1]
+        return self._get_cderi_transformed_batch([mo,], aux_tol=aux_tol)[0]
+
+    def _get_cderi_transformed_batch(self, mos, aux_tol=None):
+        """
+        Transforms CDERI integrals from AO to several MO bases, reading
+        each block of the AO CDERI integrals only once.
+        Args:
+           mos: list of np.array (nao*neo)
+           aux_tol: float
+                See _get_cderi_transformed
+        Returns:
+            List of transformed CDERI integrals (Lij), one per mo.
+        """
         mf = self.mf
-        
-        Lij = np.empty((mf.with_df.get_naoaux(), nmo * (nmo + 1) // 2), dtype=mo.dtype)
-        
-        ijmosym, mij_pair, moij, ijslice = ao2mo.incore._conc_mos(mo, mo, compact=True)
+        naux = mf.with_df.get_naoaux()
+
+        Lijs = []
+        mosyms = []
+        for mo in mos:
+            nmo = mo.shape[-1]
+            Lijs.append(np.empty((naux, nmo * (nmo + 1) // 2), dtype=mo.dtype))
+            mosyms.append(ao2mo.incore._conc_mos(mo, mo, compact=True))
         b0 = 0
         for eri1 in mf.with_df.loop():
             b1 = b0 + eri1.shape[0]
-            eri2 = Lij[b0:b1]
-            eri2 = ao2mo._ao2mo.nr_e2(eri1, moij, ijslice, aosym='s2', mosym=ijmosym, out=eri2)
+            for Lij, (ijmosym, mij_pair, moij, ijslice) in zip(Lijs, mosyms):
+                eri2 = Lij[b0:b1]
+                eri2 = ao2mo._ao2mo.nr_e2(eri1, moij, ijslice, aosym='s2', mosym=ijmosym, out=eri2)
             b0 = b1
-        return Lij
+        if aux_tol:
+            Lijs = [compress_cderi(Lij, tol=aux_tol) for Lij in Lijs]
+        return Lijs
 
     def _get_eri_transformed(self, ao2eo=None):
         '''
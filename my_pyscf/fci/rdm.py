@@ -648,3 +648,113 @@ def trans_hhdm (cibra, ciket, norb, nelec, spin=0, link_index=None):
 
 
 
+
+def _gen_t1_batch (civecs, norb, link_index, spin):
+    ''' Apply all single-excitation operators E_pq = p'q of one spin to a batch of CI vectors.
+
+    Args:
+        civecs: ndarray of shape (nvecs,ndeta,ndetb)
+            CI vectors
+        norb: integer
+            Number of spatial orbitals
+        link_index: "linkstr" type ndarray
+            linkstr array of the strings of the given spin
+        spin: integer
+            0 = alpha, 1 = beta
+
+    Returns:
+        t1: ndarray of shape (nvecs,norb,norb,ndeta,ndetb)
+            t1[i,p,q] = E_pq|civecs[i]>
+    '''
+    if spin: civecs = civecs.transpose (0,2,1)
+    nvecs, nstr, nother = civecs.shape
+    t1 = np.zeros ((nvecs, norb, norb, nstr, nother), dtype=civecs.dtype)
+    a, i, str1, sgn = link_index[:,:,0], link_index[:,:,1], link_index[:,:,2], link_index[:,:,3]
+    str0 = np.broadcast_to (np.arange (nstr)[:,None], a.shape)
+    # For fixed (a,i), str0 -> str1 is one-to-one, so there are no repeated indices here
+    t1[:,a,i,str1,:] = sgn[None,:,:,None] * civecs[:,str0,:]
+    if spin: t1 = t1.transpose (0,1,2,4,3)
+    return t1
+
+def trans_rdm12s_batch (cibra, ciket, norb, nelec, link_index=None, do2=True, max_memory=None):
+    ''' Evaluate the spin-separated one- and two-body transition density matrices between every
+    pair of CI vectors in two batches at once. The single-excitation intermediates E_pq|ci> are
+    generated once per vector, rather than once per pair of vectors, and contracted by matrix
+    multiplication. The bra and ket vectors are processed in blocks so that the intermediates use
+    no more than about max_memory MB. If the bra and ket intermediates do not fit in memory
+    together, the bra intermediates are regenerated for each block of kets.
+
+    Args:
+        cibra: ndarray of shape (nbra,ndeta,ndetb)
+            Batch of bra CI vectors
+        ciket: ndarray of shape (nket,ndeta,ndetb)
+            Batch of ket CI vectors
+        norb: integer
+            Number of spatial orbitals
+        nelec: integer or sequence of length 2
+            Number of electrons
+
+    Kwargs:
+        link_index: tuple of length 2 of "linkstr" type ndarray
+            See pyscf.fci.gen_linkstr_index for the shape of "linkstr".
+        do2: logical
+            If False, only the one-body transition density matrices are computed
+        max_memory: float
+            Memory budget in MB for the intermediates; defaults to pyscf.lib.param.MAX_MEMORY
+
+    Returns:
+        tdm1s: ndarray of shape (nbra,nket,2,norb,norb)
+            tdm1s[i,j,s,p,q] = <cibra[i]|p's q_s|ciket[j]>
+        tdm2s: ndarray of shape (nbra,nket,4,norb,norb,norb,norb) or None
+            Spin blocks (aa, ab, ba, bb) in the same index convention as the return value of
+            pyscf.fci.direct_spin1.trans_rdm12s; None if do2 is False
+    '''
+    if max_memory is None: max_memory = param.MAX_MEMORY
+    link_indexa, link_indexb = _unpack (norb, nelec, link_index)
+    nbra, nket = cibra.shape[0], ciket.shape[0]
+    ndet = cibra[0].size
+    dtype = np.result_type (cibra.dtype, ciket.dtype)
+    cibra = cibra.reshape (nbra, -1, link_indexb.shape[0])
+    ciket = ciket.reshape (nket, -1, link_indexb.shape[0])
+    tdm1s = np.zeros ((nbra,nket,2,norb,norb), dtype=dtype)
+    tdm2s = None
+    if do2: tdm2s = np.zeros ((nbra,nket,4,norb,norb,norb,norb), dtype=dtype)
+    n2 = norb*norb
+    # Each vector carries two (norb,norb,ndet) intermediates
+    blksize = max (1, int (max_memory * 1e6 / (2 * n2 * ndet * np.dtype (dtype).itemsize)))
+    if not do2:
+        brablk, ketblk = nbra, blksize
+    elif nbra + nket <= blksize:
+        brablk, ketblk = nbra, nket
+    else:
+        brablk = max (1, min (nbra, blksize // 2))
+        ketblk = max (1, blksize - brablk)
+    def get_t1bra (b0, b1):
+        # <bra|E_qp' ... = (E_pq|bra>)^+ : swap the orbital indices of the bra intermediates
+        t1bra = [_gen_t1_batch (cibra[b0:b1], norb, l, s)
+                 for s, l in enumerate ((link_indexa, link_indexb))]
+        return [t.transpose (0,2,1,3,4).reshape ((b1-b0)*n2,ndet).conj () for t in t1bra]
+    t1bra = None
+    if do2 and brablk == nbra: t1bra = get_t1bra (0, nbra)
+    bra = cibra.reshape (nbra, ndet).conj ()
+    eye = np.eye (norb)
+    for k0 in range (0, nket, ketblk):
+        k1 = min (nket, k0+ketblk)
+        nk = k1 - k0
+        t1ket = [_gen_t1_batch (ciket[k0:k1], norb, l, s).reshape (nk*n2,ndet)
+                 for s, l in enumerate ((link_indexa, link_indexb))]
+        for s in range (2):
+            tdm1s[:,k0:k1,s] = np.dot (bra, t1ket[s].T).reshape (nbra,nk,norb,norb)
+        if not do2: continue
+        for b0 in range (0, nbra, brablk):
+            b1 = min (nbra, b0+brablk)
+            nb = b1 - b0
+            t1bra_blk = t1bra if t1bra is not None else get_t1bra (b0, b1)
+            for ix, (s, t) in enumerate (((0,0),(0,1),(1,0),(1,1))):
+                g = np.dot (t1bra_blk[s], t1ket[t].T).reshape (nb,norb,norb,nk,norb,norb)
+                tdm2s[b0:b1,k0:k1,ix] = g.transpose (0,3,1,2,4,5)
+            t1bra_blk = None
+        # p'r's q = p'q r's - delta_qr p's
+        for s, ix in ((0,0), (1,3)):
+            tdm2s[:,k0:k1,ix] -= np.multiply.outer (tdm1s[:,k0:k1,s], eye).transpose (0,1,2,4,5,3)
+    return tdm1s, tdm2s
@@ -1,9 +1,17 @@
+import os
+import h5py
 import numpy as np
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from pyscf import lib
 from pyscf.grad import rhf as rhf_grad
 from pyscf.lib import param, logger
 
 STEPSIZE_DEFAULT=0.001
 SCANNER_VERBOSE_DEFAULT=4
+NPROC_DEFAULT=1
+COORDS_ATOL=1e-10
 
 # MRH 05/04/2020: I don't know why I have to present the molecule instead
 # of just the coordinates, but somehow I can't get the units right any other
@@ -12,22 +20,99 @@ SCANNER_VERBOSE_DEFAULT=4
 def _make_mol (mol, coords):
     return [[mol.atom_symbol (i), coords[i,:]] for i in range (mol.natm)]
 
-def _numgrad_1df (mol, scanner, coords, iatm, icoord, delta=0.002):
-    coords[iatm,icoord] += delta
-    ep = scanner (_make_mol (mol, coords))
-    ep_states = np.array (getattr (scanner, 'e_states', [ep]))
-    coords[iatm,icoord] -= 2*delta
-    em = scanner (_make_mol (mol, coords))
-    em_states = np.array (getattr (scanner, 'e_states', [em]))
-    coords[iatm,icoord] += delta
-    de_states = (ep_states - em_states) / (2*delta)*param.BOHR
-    return (ep-em) / (2*delta)*param.BOHR, de_states
+def _disable_chkfiles (obj):
+    '''Keep scanners running concurrently in different processes from writing to the same
+    chkfile'''
+    if obj is None: return
+    if getattr (obj, 'chkfile', None): obj.chkfile = None
+    for key in ('_scf', '_las'):
+        _disable_chkfiles (getattr (obj, key, None))
 
+def _displace (coords, disp, delta):
+    iatm, icoord, sign = disp
+    coords = coords.copy ()
+    coords[iatm,icoord] += sign*delta
+    return coords
+
+def _fork_displaced_energy (conn, mol, scanner, coords, delta, disp):
+    '''Target of a forked worker process: send the energy at one displaced geometry through conn.
+    The worker runs single-threaded, because the OpenMP runtime inherited from the parent hangs
+    on entering a parallel region with more than one thread in a forked child.'''
+    try:
+        _disable_chkfiles (scanner)
+        with lib.with_omp_threads (1):
+            e = scanner (_make_mol (mol, _displace (coords, disp, delta)))
+        e_states = np.array (getattr (scanner, 'e_states', [e]))
+        conn.send ((disp, e, e_states, None))
+    except Exception:
+        conn.send ((disp, None, None, traceback.format_exc ()))
+    finally:
+        conn.close ()
+
+def _disp_key (disp):
+    iatm, icoord, sign = disp
+    return '{}_{}_{}'.format (iatm, icoord, 'p' if sign > 0 else 'm')
+
+def load_displaced_energies (chkfile, coords, delta):
+    '''Read the energies at displaced geometries already computed by an interrupted
+    calculation. Records are discarded unless the reference geometry and the step size match.'''
+    energies = {}
+    if not chkfile or not os.path.isfile (chkfile): return energies
+    with h5py.File (chkfile, 'r') as fh5:
+        if 'numgrad' not in fh5: return energies
+        grp = fh5['numgrad']
+        if grp.attrs['stepsize'] != delta: return energies
+        if not np.allclose (grp.attrs['coords'], coords, rtol=0, atol=COORDS_ATOL):
+            return energies
+        for key, rec in grp.items ():
+            iatm, icoord, sign = key.split ('_')
+            disp = (int (iatm), int (icoord), 1 if sign == 'p' else -1)
+            energies[disp] = (rec['e'][()], rec['e_states'][()])
+    return energies
+
+def dump_displaced_energy (chkfile, coords, delta, disp, e, e_states):
+    '''Save the energy at one displaced geometry'''
+    if not chkfile: return
+    with h5py.File (chkfile, 'a') as fh5:
+        grp = fh5.get ('numgrad', None)
+        if grp is not None and (grp.attrs['stepsize'] != delta
+                                or not np.allclose (grp.attrs['coords'], coords, rtol=0,
+                                                    atol=COORDS_ATOL)):
+            del fh5['numgrad']
+            grp = None
+        if grp is None:
+            grp = fh5.create_group ('numgrad')
+            grp.attrs['stepsize'] = delta
+            grp.attrs['coords'] = coords
+        key = _disp_key (disp)
+        if key in grp: del grp[key]
+        rec = grp.create_group (key)
+        rec['e'] = e
+        rec['e_states'] = e_states
 
 class Gradients (rhf_grad.GradientsMixin):
+    '''Gradients by central finite differences of the energy of a method's scanner
 
-    def __init__(self, method, stepsize=STEPSIZE_DEFAULT, scanner_verbose=SCANNER_VERBOSE_DEFAULT):
+    Attributes:
+        stepsize : float
+            Displacement of each coordinate in Angstrom
+        nproc : int
+            Number of processes among which the displaced-geometry energies are divided. If
+            greater than 1, single-threaded worker processes are forked from the current
+            process, so nproc should be close to lib.num_threads (), and each displaced geometry
+            starts from the reference wave function. Otherwise, the displacements are computed
+            one after another, each starting from the previous one.
+        chkfile : str
+            If set, the energy of each displaced geometry is saved here as soon as it is
+            computed, and energies already present for the same reference geometry and step size
+            are not recomputed.
+    '''
+
+    def __init__(self, method, stepsize=STEPSIZE_DEFAULT, scanner_verbose=SCANNER_VERBOSE_DEFAULT,
+                 nproc=NPROC_DEFAULT, chkfile=None):
         self.stepsize = stepsize
+        self.nproc = nproc
+        self.chkfile = chkfile
         self.scanner = None 
         # MRH 05/04/2020: there must be a better way to do this
         if hasattr (self.scanner, '_scf'):
@@ -36,28 +121,86 @@ class Gradients (rhf_grad.GradientsMixin):
         self.scanner = self.base.as_scanner ()
         self.scanner.verbose = scanner_verbose
 
-    def _numgrad_1df (self, iatm, icoord):
-        return _numgrad_1df (self.mol, self.scanner, self.mol.atom_coords () * param.BOHR,
-            iatm, icoord, delta=self.stepsize)
-
-    def kernel (self, atmlst=None, stepsize=None, state=None):
+    def kernel (self, atmlst=None, stepsize=None, state=None, nproc=None):
         if atmlst is None:
             atmlst = self.atmlst
         if stepsize is None:
             stepsize = self.stepsize
         else:
             self.stepsize = stepsize
+        if nproc is None:
+            nproc = self.nproc
         if atmlst is None:
             atmlst = list (range (self.mol.natm))
         
         coords = self.mol.atom_coords () * param.BOHR
-        de = [[self._numgrad_1df (i, j) for j in range (3)] for i in atmlst]
-        self.scanner (_make_mol (self.mol, coords)) # Reset!
+        disps = [(i, j, sign) for i in atmlst for j in range (3) for sign in (1, -1)]
+        energies = load_displaced_energies (self.chkfile, coords, stepsize)
+        todo = [disp for disp in disps if disp not in energies]
+        if len (energies):
+            logger.info (self, '%d of %d displaced-geometry energies loaded from %s',
+                         len (disps) - len (todo), len (disps), self.chkfile)
+        if nproc > 1 and len (todo) > 1:
+            energies.update (self._get_displaced_energies_fork (coords, stepsize, todo, nproc))
+        elif len (todo):
+            for disp in todo:
+                e = self.scanner (_make_mol (self.mol, _displace (coords, disp, stepsize)))
+                e_states = np.array (getattr (self.scanner, 'e_states', [e]))
+                energies[disp] = (e, e_states)
+                dump_displaced_energy (self.chkfile, coords, stepsize, disp, e, e_states)
+            self.scanner (_make_mol (self.mol, coords)) # Reset!
+        de = [[[(energies[(i,j,1)][k] - energies[(i,j,-1)][k]) / (2*stepsize)*param.BOHR
+                for k in range (2)] for j in range (3)] for i in atmlst]
         self.de = np.asarray ([[i for i,j in k] for k in de])
         self.de_states = np.asarray ([[j for i,j in k] for k in de]).transpose (2,0,1)
         if state is not None: self.de = self.de_states[state]
         return self.de
 
+    def _get_displaced_energies_fork (self, coords, stepsize, todo, nproc):
+        '''Compute the energies at the displaced geometries in todo in up to nproc processes at a
+        time. Each displacement is computed by a new process forked from this one, so that it
+        inherits (instead of pickling) self.scanner and starts from the reference wave function.
+        The workers are single-threaded (see _fork_displaced_energy).'''
+        nproc = min (nproc, len (todo))
+        logger.info (self, 'Computing %d displaced-geometry energies in %d processes',
+                     len (todo), nproc)
+        ctx = multiprocessing.get_context ('fork')
+        todo = list (todo)
+        running = {}
+        energies = {}
+        try:
+            while len (todo) or len (running):
+                while len (todo) and len (running) < nproc:
+                    recv_conn, send_conn = ctx.Pipe (duplex=False)
+                    proc = ctx.Process (target=_fork_displaced_energy,
+                                        args=(send_conn, self.mol, self.scanner, coords,
+                                              stepsize, todo.pop (0)))
+                    proc.start ()
+                    send_conn.close ()
+                    running[recv_conn] = proc
+                for conn in multiprocessing.connection.wait (list (running.keys ())):
+                    proc = running.pop (conn)
+                    try:
+                        disp, e, e_states, err = conn.recv ()
+                    except EOFError:
+                        raise RuntimeError ('Numeric gradient worker process died (exit code '
+                                            '{})'.format (proc.exitcode))
+                    finally:
+                        conn.close ()
+                        proc.join ()
+                    if err is not None:
+                        raise RuntimeError ('Numeric gradient worker process failed at '
+                                            'displacement {}:\n{}'.format (disp, err))
+                    energies[disp] = (e, e_states)
+                    # Checkpoint in this thread, so that no process is forked while the file is open
+                    dump_displaced_energy (self.chkfile, coords, stepsize, disp, e, e_states)
+        finally:
+            for conn, proc in running.items ():
+                proc.terminate ()
+                proc.join ()
+                conn.close ()
+        return energies
+
     def grad_elec (self, atmlst=None, stepsize=None):
         # This is just computed backwards from full gradients
         if atmlst is None:
@@ -1,4 +1,5 @@
 import sys
+import hashlib
 import numpy as np
 import functools
 import itertools
@@ -12,7 +13,7 @@ from mrh.my_pyscf.lassi.op_o1.utilities import fermion_spin_shuffle
 LINDEP_THRESH = getattr (__config__, 'lassi_lindep_thresh', 1.0e-5)
 
 def get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=None, smult_fr=None, smult_si=None,
-                    disc_fr=None):
+                    disc_fr=None, cache=None):
     '''Unitary matrix for an orthonormal product-state basis from a set of CI vectors.
 
     Args:
@@ -35,6 +36,10 @@ def get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=None, smult_fr=None, smu
         _get_ovlp: callable with kwarg rootidx
             Produce the overlap matrix between model states in a set of rootspaces,
             identified by ndarray or list "rootidx"
+        cache: instance of OrthCache
+            Orthogonalization matrices of previously-encountered manifolds. Manifolds whose
+            CI vectors are found in the cache are not re-orthogonalized, and newly-orthogonalized
+            manifolds are added to it.
 
     Returns:
         raw2orth: LinearOperator of shape (north, nraw)
@@ -85,14 +90,21 @@ def get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=None, smult_fr=None, smu
             nprod = np.asarray ([(offs1[m]-offs0[m]).sum () for m in m_blocks])
             assert (np.all (nprod==nprod[0]))
             nprod = nprod[0]
-            ovlp = _get_ovlp (rootidx=m_blocks[0])
-            ovlp[np.diag_indices_from (ovlp)] -= 1.0
-            err_from_diag = np.amax (np.abs (ovlp))
-            if err_from_diag > 1e-8:
-                ovlp[np.diag_indices_from (ovlp)] += 1.0
-                xmat = canonical_orth_(ovlp, thr=LINDEP_THRESH)
+            key = None
+            if cache is not None:
+                key = get_manifold_key (ci_fr, norb_f, nelec_frs, m_blocks[0])
+            if cache is not None and key in cache:
+                xmat = cache[key]
             else:
-                xmat = None
+                ovlp = _get_ovlp (rootidx=m_blocks[0])
+                ovlp[np.diag_indices_from (ovlp)] -= 1.0
+                err_from_diag = np.amax (np.abs (ovlp))
+                if err_from_diag > 1e-8:
+                    ovlp[np.diag_indices_from (ovlp)] += 1.0
+                    xmat = canonical_orth_(ovlp, thr=LINDEP_THRESH)
+                else:
+                    xmat = None
+                if key is not None: cache[key] = xmat
             new_manifold = get_rootspace_manifold (norb_f, lroots_fr, nprods_r, n_str, s_str,
                                                    m_strs, m_blocks, xmat, smult_si=smult_si)
             if is1st:
@@ -112,6 +124,52 @@ def get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=None, smult_fr=None, smu
     else:
         return SpinCoupledOrthBasis ((north,nraw), dtype, nprods_r, manifolds)
 
+def get_manifold_key (ci_fr, norb_f, nelec_frs, rootidx):
+    '''Fingerprint of the fragment CI vectors of a set of rootspaces, which determine the overlap
+    matrix and therefore the orthogonalization of a manifold'''
+    fprint = hashlib.sha1 (repr ((LINDEP_THRESH, list (norb_f))).encode ())
+    for ci_r, nelec_rs in zip (ci_fr, nelec_frs):
+        for iroot in rootidx:
+            ci = np.ascontiguousarray (ci_r[iroot])
+            fprint.update (repr ((tuple (nelec_rs[iroot]), ci.shape, ci.dtype.str)).encode ())
+            fprint.update (ci.data)
+    return fprint.hexdigest ()
+
+class OrthCache (dict):
+    '''Orthogonalization matrices (or None, for manifolds which are already orthonormal) keyed by
+    the fingerprints of get_manifold_key. Entries which have not been looked up since the last
+    call to prune_ are discarded by prune_.'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.used = set ()
+
+    def __contains__(self, key):
+        self.used.add (key)
+        return super().__contains__(key)
+
+    def __setitem__(self, key, val):
+        self.used.add (key)
+        super().__setitem__(key, val)
+
+    def prune_(self):
+        for key in set (self.keys ()) - self.used:
+            del self[key]
+        self.used = set ()
+        return self
+
+    def get_nbytes (self):
+        return sum ([0 if x is None else x.nbytes for x in self.values ()])
+
+    def dump (self, h5grp):
+        for key, xmat in self.items ():
+            h5grp[key] = np.zeros ((0,0)) if xmat is None else xmat
+
+    def load_ (self, h5grp):
+        for key, xmat in h5grp.items ():
+            xmat = xmat[()]
+            super().__setitem__(key, None if xmat.size == 0 else xmat)
+        return self
+
 def get_nbytes (obj):
     def _get (x):
         if isinstance (x, np.ndarray):
@@ -304,6 +362,11 @@ def _get_spin_split_manifolds_idx (ci_fr, norb_f, nelec_frs, smult_fr, lroots_fr
 class OrthBasisBase (sparse_linalg.LinearOperator):
     get_nbytes = get_nbytes
 
+    # _matvec and _rmatvec act on the first axis and broadcast over the rest
+    def _matmat (self, x): return self._matvec (x)
+
+    def _rmatmat (self, x): return self._rmatvec (x)
+
     def split_oblocks_by_manifolds (self, blocks):
         blocks_shape = np.asarray (blocks).shape
         return blocks, np.zeros (blocks_shape, dtype=int)
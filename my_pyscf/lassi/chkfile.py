@@ -1,3 +1,5 @@
+import os
+import h5py
 from mrh.my_pyscf.mcscf import chkfile as las_chkfile
 
 KEYS_CONFIG_LASSI = las_chkfile.KEYS_CONFIG_LASSCF + ['nfrags', 'break_symmetry', 'soc', 'opt']
@@ -9,9 +11,11 @@ def load_lsi_(lsi, chkfile=None, method_key='lsi',
               keys_saconstr=KEYS_SACONSTR_LASSI,
               keys_results=KEYS_RESULTS_LASSI):
     lsi._las.load_chk (chkfile=chkfile)
-    return las_chkfile.load_las_(lsi, chkfile=chkfile, method_key=method_key,
-                                 keys_config=keys_config,
-                                 keys_saconstr=keys_saconstr, keys_results=keys_results)
+    lsi = las_chkfile.load_las_(lsi, chkfile=chkfile, method_key=method_key,
+                                keys_config=keys_config,
+                                keys_saconstr=keys_saconstr, keys_results=keys_results)
+    load_orth_cache_(lsi, chkfile=chkfile, method_key=method_key)
+    return lsi
 
 def dump_lsi (lsi, chkfile=None, method_key='lsi', mo_coeff=None, ci=None,
               overwrite_mol=True, keys_config=KEYS_CONFIG_LASSI,
@@ -19,9 +23,68 @@ def dump_lsi (lsi, chkfile=None, method_key='lsi', mo_coeff=None, ci=None,
               keys_results=KEYS_RESULTS_LASSI,
               **kwargs):
     lsi._las.dump_chk (chkfile=chkfile)
-    return las_chkfile.dump_las (lsi, chkfile=chkfile, method_key=method_key, mo_coeff=mo_coeff,
-                                 ci=ci, overwrite_mol=overwrite_mol, keys_config=keys_config,
-                                 keys_saconstr=keys_saconstr, keys_results=keys_results, **kwargs)
+    lsi = las_chkfile.dump_las (lsi, chkfile=chkfile, method_key=method_key, mo_coeff=mo_coeff,
+                                ci=ci, overwrite_mol=overwrite_mol, keys_config=keys_config,
+                                keys_saconstr=keys_saconstr, keys_results=keys_results, **kwargs)
+    dump_orth_cache (lsi, chkfile=chkfile, method_key=method_key)
+    return lsi
+
+def load_orth_cache_(lsi, chkfile=None, method_key='lsi'):
+    '''Load the orthogonalization matrices of rootspace manifolds into lsi.sisolver.orth_cache,
+    so that they need not be recomputed by a restarted calculation'''
+    if chkfile is None: chkfile = lsi.chkfile
+    orth_cache = getattr (lsi.sisolver, 'orth_cache', None)
+    if orth_cache is None: return lsi
+    with h5py.File (chkfile, 'r') as fh5:
+        if method_key + '/orth_cache' in fh5:
+            orth_cache.load_(fh5[method_key + '/orth_cache'])
+    return lsi
+
+def dump_orth_cache (lsi, chkfile=None, method_key='lsi'):
+    '''Save lsi.sisolver.orth_cache, the orthogonalization matrices of rootspace manifolds'''
+    if chkfile is None: chkfile = lsi.chkfile
+    if not chkfile: return lsi
+    orth_cache = getattr (lsi.sisolver, 'orth_cache', None)
+    if not orth_cache: return lsi
+    with h5py.File (chkfile, 'a') as fh5:
+        _dump_orth_cache (fh5, orth_cache, method_key)
+    return lsi
+
+def _dump_orth_cache (fh5, orth_cache, method_key):
+    if method_key + '/orth_cache' in fh5:
+        del (fh5[method_key + '/orth_cache'])
+    orth_cache.dump (fh5.create_group (method_key + '/orth_cache'))
+
+def load_sisolver_chk (sisolver, key, chkfile=None, method_key='lsi'):
+    '''Load the orthogonalization matrices of rootspace manifolds into sisolver.orth_cache, and
+    return the intermediates of an interrupted iterative diagonalization of the symmetry block
+    identified by key (see sisolver.get_block_key) as a dict'''
+    if chkfile is None: chkfile = sisolver.chkfile
+    data = {}
+    if not chkfile or not os.path.isfile (chkfile): return data
+    orth_cache = getattr (sisolver, 'orth_cache', None)
+    with h5py.File (chkfile, 'r') as fh5:
+        if orth_cache is not None and method_key + '/orth_cache' in fh5:
+            orth_cache.load_(fh5[method_key + '/orth_cache'])
+        if method_key + '/sisolver/' + key in fh5:
+            data = {k: v[()] for k, v in fh5[method_key + '/sisolver/' + key].items ()}
+    return data
+
+def dump_sisolver_chk (sisolver, key, chkfile=None, method_key='lsi', orth_cache=False,
+                       **kwargs):
+    '''Save intermediates (kwargs) of the iterative diagonalization of the symmetry block
+    identified by key, overwriting any previous values. If orth_cache is True, also save
+    sisolver.orth_cache.'''
+    if chkfile is None: chkfile = sisolver.chkfile
+    if not chkfile: return sisolver
+    with h5py.File (chkfile, 'a') as fh5:
+        if orth_cache and getattr (sisolver, 'orth_cache', None):
+            _dump_orth_cache (fh5, sisolver.orth_cache, method_key)
+        grp = fh5.require_group (method_key + '/sisolver/' + key)
+        for k, v in kwargs.items ():
+            if k in grp: del (grp[k])
+            grp[k] = v
+    return sisolver
 
                                   
 
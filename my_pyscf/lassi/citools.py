@@ -207,9 +207,12 @@ def _fake_gen_contract_op_si_hdiag (matrix_builder, las, h1, h2, ci_fr, nelec_fr
     def contract_ovlp (x):
         return ovlp @ x
 
-    h_op = CallbackLinearOperator (ham, ham.shape, dtype=ham.dtype, matvec=contract_ham_si)
-    s2_op = CallbackLinearOperator (s2, s2.shape, dtype=s2.dtype, matvec=contract_s2)
-    ovlp_op = CallbackLinearOperator (ovlp, ovlp.shape, dtype=ovlp.dtype, matvec=contract_ovlp)
+    h_op = CallbackLinearOperator (ham, ham.shape, dtype=ham.dtype, matvec=contract_ham_si,
+                                   matmat=contract_ham_si)
+    s2_op = CallbackLinearOperator (s2, s2.shape, dtype=s2.dtype, matvec=contract_s2,
+                                    matmat=contract_s2)
+    ovlp_op = CallbackLinearOperator (ovlp, ovlp.shape, dtype=ovlp.dtype, matvec=contract_ovlp,
+                                      matmat=contract_ovlp)
     hdiag = np.diagonal (ham)
     return h_op, s2_op, ovlp_op, hdiag, _get_ovlp
 
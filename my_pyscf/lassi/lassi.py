@@ -326,6 +326,10 @@ def lassi (las, mo_coeff=None, ci=None, veff_c=None, h2eff_sub=None, orbsym=None
         s2_roots.extend (list (s2_blk))
         rootsym.extend ([sym,]*c.shape[1])
 
+    if getattr (sisolver, 'orth_cache', None) is not None:
+        # Discard manifolds whose CI vectors were not encountered in this calculation
+        sisolver.orth_cache.prune_()
+
     # The matrix blocks were evaluated in idx_allprods order
     # Therefore, I need to ~invert~ idx_allprods to get the proper order
     idx_allprods = np.argsort (idx_allprods)
@@ -745,6 +749,104 @@ def root_make_rdm12s (las, ci, si, state=0, orbsym=None, soc=None, break_symmetr
                               break_symmetry=break_symmetry, spaces=spaces, opt=opt,
                               **kwargs)
 
+def roots_make_rdm1s_otpd (las, ci, si, mo_grid, orbsym=None, break_symmetry=None, spaces=None,
+                           opt=1, **kwargs):
+    '''Evaluate 1-electron reduced density matrices of LASSI states and the 2-electron part of
+    their on-top pair densities on a grid, without storing the 2-electron reduced density matrices
+
+        Args:
+            las: LASCI object
+            ci: list of list of ci vectors
+            si: tagged ndarray of shape (nroots,nroots)
+               Linear combination vectors defining LASSI states.
+            mo_grid: ndarray of shape (nderiv,ngrids,ncas)
+               Values [and first derivatives] of the active orbitals on the grid
+
+        Kwargs:
+            orbsym: None or list of orbital symmetries spanning the whole orbital space
+            break_symmetry: logical
+                Whether to allow coupling between states of different point-group irreps
+                Overrides tag of si if provided by caller.
+            spaces : list of instances of :class:`SingleLASRootspace`
+                Contain symmetry information; defaults to data from las
+            opt: Optimization level, i.e.,  take outer product of
+                0: CI vectors
+                1: TDMs
+
+        Returns:
+            rdm1s: ndarray of shape (nroots,2,ncas,ncas)
+            otpd2: ndarray of shape (nroots,nderiv,ngrids)
+                1/2 dm2[p,q,r,s] phi_p phi_q phi_r phi_s [and its first derivatives], where dm2
+                is the spin-summed 2-RDM of each LASSI state
+    '''
+    if orbsym is None: 
+        orbsym = getattr (las.mo_coeff, 'orbsym', None)
+        if orbsym is None and callable (getattr (las, 'label_symmetry_', None)):
+            orbsym = las.label_symmetry_(las.mo_coeff).orbsym
+        if orbsym is not None:
+            orbsym = orbsym[las.ncore:las.ncore+las.ncas]
+    if getattr (si, 'soc', getattr (las, 'soc', False)):
+        raise NotImplementedError ("On-top pair density with spin-orbit coupling")
+    if break_symmetry is None:
+        break_symmetry = getattr (si, 'break_symmetry', getattr (las, 'break_symmetry', False))
+    if opt == 0 and op_o0.memcheck (las, ci, soc=False) == False:
+        raise RuntimeError ('Insufficient memory to use o0 LASSI algorithm')
+
+    nroots = si.shape[1]
+    rdm1s = [None for i in range (nroots)]
+    otpd2 = [None for i in range (nroots)]
+
+    # Loop over symmetry blocks
+    statesym = las_symm_tuple (las, spaces=spaces, break_spin=False,
+                               break_symmetry=break_symmetry, verbose=0)[0]
+    lroots = get_lroots (ci)
+    rootsym = guess_rootsym (si, statesym, lroots)
+    for las1, sym, indcs, indxd in iterate_subspace_blocks(las,ci,statesym,subset=set(rootsym),spaces=spaces):
+        idx_ci, idx_prod = indcs
+        ci_blk, nelec_blk, smult_blk, disc_blk = indxd
+        idx_si = np.all (np.array (rootsym) == sym, axis=1)
+        wfnsym = None if break_symmetry else sym[-1]
+        si_blk = si[np.ix_(idx_prod,idx_si)]
+        t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
+        if opt == 0:
+            d1s, d2s = op_o0.roots_trans_rdm12s (las1, ci_blk, nelec_blk, si_blk, si_blk,
+                                                 orbsym=orbsym, wfnsym=wfnsym, **kwargs)
+            max_memory = getattr (las, 'max_memory', las.mol.max_memory)
+            pi2 = op_o1.dm2_on_grid (d2s.sum ((1,4)), mo_grid, max_memory=max_memory)
+        else:
+            d1s, pi2 = op_o1.roots_make_rdm1s_otpd (las1, ci_blk, nelec_blk, si_blk, mo_grid,
+                                                    smult_fr=smult_blk, **kwargs)
+        t0 = lib.logger.timer (las, 'LASSI rdm1s_otpd rootsym {}'.format (sym), *t0)
+        idx_int = np.where (idx_si)[0]
+        for (i,a) in enumerate (idx_int):
+            rdm1s[a] = d1s[i]
+            otpd2[a] = pi2[i]
+    rdm1s = np.stack (rdm1s, axis=0)
+    otpd2 = np.stack (otpd2, axis=0)
+    return rdm1s, otpd2
+
+def root_make_rdm1s_otpd (las, ci, si, mo_grid, state=0, break_symmetry=None, **kwargs):
+    '''Evaluate the 1-electron reduced density matrices and the 2-electron part of the on-top
+    pair density on a grid of one or several LASSI states. See roots_make_rdm1s_otpd.
+
+        Kwargs:
+            state: integer or sequence of integers
+                Identify the specific LASSI eigenstate(s) for which the densities are
+                to be computed.
+
+        Returns:
+            rdm1s: ndarray of shape (2,ncas,ncas)
+            otpd2: ndarray of shape (nderiv,ngrids)
+    '''
+    states = np.atleast_1d (state)
+    if break_symmetry is None:
+        break_symmetry = getattr (si, 'break_symmetry', getattr (las, 'break_symmetry', False))
+    rdm1s, otpd2 = roots_make_rdm1s_otpd (las, ci, si[:,states], mo_grid,
+                                          break_symmetry=break_symmetry, **kwargs)
+    if len (states) == 1:
+        rdm1s, otpd2 = rdm1s[0], otpd2[0]
+    return rdm1s, otpd2
+
 def energy_tot (lsi, mo_coeff=None, ci=None, si=None, soc=0, opt=None):
     if mo_coeff is None: mo_coeff = lsi.mo_coeff
     if ci is None: ci = lsi.ci
@@ -819,7 +921,8 @@ class LASSI(lib.StreamObject):
 
     def kernel(self, mo_coeff=None, ci=None, veff_c=None, h2eff_sub=None, orbsym=None, soc=None,\
                break_symmetry=None, opt=None, davidson_only=None, level_shift_si=None,
-               nroots_si=None, pspace_size_si=None, smult_si=None, privref_si=None, **kwargs):
+               nroots_si=None, pspace_size_si=None, smult_si=None, privref_si=None,
+               chkfile_si=None, restart_si=None, **kwargs):
         if soc is None: soc = self.soc
         if break_symmetry is None: break_symmetry = self.break_symmetry
         if opt is None: opt = self.opt
@@ -834,6 +937,10 @@ class LASSI(lib.StreamObject):
             self.sisolver.smult = smult_si
         if privref_si is not None:
             self.sisolver.privref_si = privref_si
+        if chkfile_si is not None:
+            self.sisolver.chkfile = chkfile_si
+        if restart_si is not None:
+            self.sisolver.restart = restart_si
         log = lib.logger.new_logger (self, self.verbose)
         t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
         if not self.converged:
@@ -926,13 +1033,15 @@ class LASSI(lib.StreamObject):
             if state is None: state=0
             if si.ndim==1: si=si[:,None]
         if state is None:
-            dm1s, dm2s = roots_make_rdm12s (self, ci, si, spaces=spaces, opt=opt)
+            dm1s, dm2s = roots_make_rdm12s (self, ci, si, spaces=spaces, opt=opt,
+                                            ints_cache=self.sisolver.ints_cache)
             if weights is not None:
                 dm1s = lib.einsum ('r,rspq->spq', weights, dm1s)
                 dm2s = lib.einsum ('r,rspqtxy->spqtxy', weights, dm2s)
             return dm1s, dm2s
         else:
-            return root_make_rdm12s (self, ci, si, state=state, spaces=spaces, opt=opt)
+            return root_make_rdm12s (self, ci, si, state=state, spaces=spaces, opt=opt,
+                                     ints_cache=self.sisolver.ints_cache)
 
     def make_casdm12 (self, ci=None, si=None, state=None, weights=None, spaces=None, opt=None,
                       **kwargs):
@@ -1126,7 +1235,8 @@ class LASSI(lib.StreamObject):
             _get_ovlp = op[opt].gen_contract_op_si_hdiag (
                 self, h1, h2, ci, nelec_frs, smult_fr=smult_fr, soc=soc
             )[4]
-        return basis.get_orth_basis (ci, self.ncas_sub, nelec_frs, _get_ovlp=_get_ovlp)
+        return basis.get_orth_basis (ci, self.ncas_sub, nelec_frs, _get_ovlp=_get_ovlp,
+                                     cache=self.sisolver.orth_cache)
 
     def get_casscf_eris (self, mo_coeff=None):
         if mo_coeff is None: mo_coeff=self.mo_coeff
@@ -12,6 +12,7 @@ from mrh.my_pyscf.lassi.citools import _get_unique_roots_with_spin
 from mrh.my_pyscf.lassi.op_o1.utilities import *
 from mrh.my_pyscf.fci.rdm import trans_rdm1ha_des, trans_rdm1hb_des #make_rdm1_spin1
 from mrh.my_pyscf.fci.rdm import trans_rdm13ha_des, trans_rdm13hb_des #is make_rdm12_spin1
+from mrh.my_pyscf.fci.rdm import trans_rdm12s_batch
 from mrh.my_pyscf.fci.rdm import trans_sfddm1, trans_hhdm ##trans_sfddm1 is make_rdm12_spin1, trans_hhdm is make_rdm12_spin1
 from mrh.my_pyscf.fci import rdm_smult
 from mrh.my_pyscf.fci.direct_halfelectron import contract_1he, absorb_h1he, contract_3he
@@ -21,9 +22,11 @@ from mrh.my_pyscf.fci.pair_op import contract_pair_op
 from pyscf import __config__
 import functools
 import copy
+from concurrent.futures import ThreadPoolExecutor
 
 SCREEN_THRESH = getattr (__config__, 'lassi_frag_screen_thresh', 1e-10)
 DO_SCREEN_LINEQUIV = getattr (__config__, 'lassi_frag_do_screen_linequiv', True)
+TDM_NTHREADS = getattr (__config__, 'lassi_frag_tdm_nthreads', 1)
 
 class FragTDMInt (object):
     ''' Fragment-local LAS state transition density matrix intermediate
@@ -92,6 +95,9 @@ class FragTDMInt (object):
             screen_linequiv : logical
                 Whether to compress data by aggressively identifying linearly equivalent
                 rootspaces and storing the relevant unitary matrices.
+            tdm_nthreads : integer
+                Number of Python threads among which to divide the independent (bra, ket)
+                transition density matrix computations
             verbose : integer
                 Logger verbosity level
 
@@ -128,7 +134,7 @@ class FragTDMInt (object):
                  rootaddr, fragaddr, idx_frag, mask_ints, smult_r=None,
                  dtype=np.float64, discriminator=None,
                  pt_order=None, do_pt_order=None, screen_linequiv=DO_SCREEN_LINEQUIV,
-                 verbose=None):
+                 tdm_nthreads=TDM_NTHREADS, verbose=None):
         # TODO: if it actually helps, cache the "linkstr" arrays
         if verbose is None: verbose = las.verbose
         if smult_r is None: smult_r = [None for n in nelec_rs]
@@ -139,6 +145,7 @@ class FragTDMInt (object):
         self.norb = norb
         self.nroots = nroots
         self.dtype = dtype
+        self.max_memory = getattr (las, 'max_memory', las.mol.max_memory)
         self.nelec_r = [tuple (n) for n in nelec_rs]
         self.spins_r = nelec_rs[:,0] - nelec_rs[:,1]
         self.smult_r = smult_r
@@ -150,6 +157,10 @@ class FragTDMInt (object):
         self.idx_frag = idx_frag
         self.mask_ints = mask_ints
         self.discriminator = discriminator
+        self.screen_linequiv = screen_linequiv
+        self.tdm_nthreads = tdm_nthreads
+        self._mask_ints_in = mask_ints
+        self.nblks_made = self.nblks_reused = 0
 
 
         if pt_order is None: pt_order = np.zeros (nroots, dtype=int)
@@ -547,16 +558,73 @@ class FragTDMInt (object):
         return t0
 
     def update_ci_(self, iroot, ci):
+        ''' Replace the CI vectors of some unique rootspaces and recompute only those
+        intermediates that involve them. Every unique rootspace in the same spin manifold as an
+        updated rootspace is also recomputed; the caller is responsible for updating all members
+        of a spin manifold consistently.
+
+        Args:
+            iroot : sequence of integers
+                Indices of the rootspaces to update
+            ci : sequence of ndarrays
+                New CI vectors for the rootspaces in iroot
+        '''
         for i, civec in zip (iroot, ci):
             assert (self.root_unique[i]), 'Cannot update non-unique CI vectors'
             self.ci[i] = civec.reshape (-1, self.ndeta_r[i], self.ndetb_r[i])
-        t0 = self._make_dms_(screen=iroot)
+        spman_dirty = set (self.spman[self.uroot_idx[i]] for i in iroot)
+        screen = [i for i in self.uroot_addr if self.spman[self.uroot_idx[i]] in spman_dirty]
+        t0 = self._make_dms_(screen=screen)
         self.log.timer ('Update density matrices of fragment intermediate', *t0)
-    
+
+    def get_dirty_roots (self, ci, nelec_rs, smult_r=None, mask_ints=None, discriminator=None,
+                         pt_order=None, do_pt_order=None, screen_linequiv=DO_SCREEN_LINEQUIV):
+        ''' Compare a new set of CI vectors for this fragment (and the other arguments of the
+        constructor) to those from which this intermediate was built, and identify the unique
+        rootspaces whose CI vectors have changed.
+
+        Returns:
+            dirty : list of integers or None
+                Indices of the rootspaces whose intermediates must be recomputed via update_ci_.
+                None if this intermediate cannot be updated in place, in which case it must be
+                rebuilt from scratch. This is the case if anything other than the CI vectors of
+                unique rootspaces without linearly-equivalent images has changed.
+        '''
+        if smult_r is None: smult_r = [None for n in nelec_rs]
+        if pt_order is None: pt_order = np.zeros (self.nroots, dtype=int)
+        if len (ci) != self.nroots: return None
+        if screen_linequiv != self.screen_linequiv: return None
+        if [tuple (n) for n in nelec_rs] != self.nelec_r: return None
+        if list (smult_r) != list (self.smult_r): return None
+        if not np.array_equal (pt_order, self.pt_order): return None
+        if (do_pt_order is None) != (self.do_pt_order is None): return None
+        if (do_pt_order is not None) and (list (do_pt_order) != list (self.do_pt_order)):
+            return None
+        if (mask_ints is None) != (self._mask_ints_in is None): return None
+        if (mask_ints is not None) and not np.array_equal (mask_ints, self._mask_ints_in):
+            return None
+        if (discriminator is None) != (self.discriminator is None): return None
+        if (discriminator is not None) and (list (discriminator) != list (self.discriminator)):
+            return None
+        dirty = []
+        for i, (c0, c1) in enumerate (zip (self.ci, ci)):
+            if c1 is c0: continue
+            c1 = np.asarray (c1)
+            if c1.size != c0.size: return None
+            if np.array_equal (c1.ravel (), c0.ravel ()): continue
+            # Linearly-equivalent images share the data of their unique rootspace
+            if not self.root_unique[i]: return None
+            if np.count_nonzero (self.unique_root==i) > 1: return None
+            dirty.append (i)
+        # Members of a spin manifold must all change together
+        spman_dirty = set (self.spman[self.uroot_idx[i]] for i in dirty)
+        for i in self.uroot_addr:
+            if (self.spman[self.uroot_idx[i]] in spman_dirty) and (i not in dirty):
+                return None
+        return dirty
+
 
     def _trans_rdm12s_loop(self, bravecs, ketvecs, norb, nelec, linkstr):
-        tdm1s = np.zeros ((bravecs.shape[0],ketvecs.shape[0],2,norb,norb), dtype=self.dtype)
-        tdm2s = np.zeros ((bravecs.shape[0],ketvecs.shape[0],4,norb,norb,norb,norb),dtype=self.dtype)
         from pyscf.lib import param
         try: mgpu_fci = param.mgpu_fci
         except: mgpu_fci = False
@@ -581,13 +649,13 @@ class FragTDMInt (object):
         #    exit()
         if mgpu_fci:
           from gpu4mrh.fci import rdm_loops
+          tdm1s = np.zeros ((bravecs.shape[0],ketvecs.shape[0],2,norb,norb), dtype=self.dtype)
+          tdm2s = np.zeros ((bravecs.shape[0],ketvecs.shape[0],4,norb,norb,norb,norb),dtype=self.dtype)
           tdm1s, tdm2s = rdm_loops.trans_rdm12s(tdm1s, tdm2s, bravecs, ketvecs, norb, nelec, linkstr=linkstr)
         else:
-          for i, j in product (range (bravecs.shape[0]), range (ketvecs.shape[0])):
-            d1s, d2s = trans_rdm12s (bravecs[i], ketvecs[j], norb, nelec,link_index=linkstr)
-            # Transpose based on docstring of direct_spin1.trans_rdm12s
-            tdm1s[i,j] = np.stack (d1s, axis=0).transpose (0, 2, 1)
-            tdm2s[i,j] = np.stack (d2s, axis=0) 
+          max_memory = max (400, self.max_memory - lib.current_memory ()[0])
+          tdm1s, tdm2s = trans_rdm12s_batch (bravecs, ketvecs, norb, nelec, link_index=linkstr,
+                                             max_memory=max_memory)
         return tdm1s, tdm2s
 
     def _trans_rdm13h_loop(self, bravecs, ketvecs, norb, nelec_ket, spin, linkstr):
@@ -693,12 +761,19 @@ class FragTDMInt (object):
         spman_inter_uniq = self.spman_inter_uniq
         lroots = [c.shape[0] for c in ci]
         nroots, norb, nuroots = self.nroots, self.norb, self.nuroots
+        nblks = [0, 0]
+        def unmasked_int (i, j):
+            # Count the blocks skipped only because they do not involve a screened rootspace
+            if not self.unmasked_int (i, j): return False
+            u = self.unmasked_int (i, j, screen)
+            nblks[int (not u)] += 1
+            return u
         t1 = self.log.timer_debug1 ('_make_dms_ setup', *t1)
         # Overlap matrix
         offs = np.cumsum (lroots)
         for i, j in combinations (np.where (idx_uniq)[0], 2):
             if self.nelec_r[i] != self.nelec_r[j]: continue
-            if not self.unmasked_int (i,j,screen): continue
+            if not unmasked_int (i,j): continue
             k, l = self.uroot_idx[i], self.uroot_idx[j]
             if not (spman_inter_uniq[k,l] or spman_inter_uniq[l,k]): continue
             ci_i = ci[i].reshape (lroots[i], -1)
@@ -706,7 +781,7 @@ class FragTDMInt (object):
             self.mats['ovlp'][k][l] = np.dot (ci_i.conj (), ci_j.T)
             self.mats['ovlp'][l][k] = self.mats['ovlp'][k][l].conj ().T
         for i in np.where (idx_uniq)[0]:
-            if not self.unmasked_int (i,i,screen): continue
+            if not unmasked_int (i,i): continue
             ci_i = ci[i].reshape (lroots[i], -1)
             j = self.uroot_idx[i]
             self.mats['ovlp'][j][j] = np.dot (ci_i.conj (), ci_i.T)
@@ -733,12 +808,10 @@ class FragTDMInt (object):
             if do2:
                 tdm1s, tdm2s = self._trans_rdm12s_loop(bravecs, ketvecs, norb, nelec, linkstr)
             else:
-                tdm1s = np.zeros ((bravecs.shape[0],ketvecs.shape[0],2,norb,norb), dtype=self.dtype)
-                for i, j in product (range (bravecs.shape[0]), range (ketvecs.shape[0])):
-                    d1s = trans_rdm1s (bravecs[i], ketvecs[j], norb, nelec,
-                                       link_index=linkstr)
-                    # Transpose based on docstring of direct_spin1.trans_rdm12s
-                    tdm1s[i,j] = np.stack (d1s, axis=0).transpose (0, 2, 1)
+                max_memory = max (400, self.max_memory - lib.current_memory ()[0])
+                tdm1s, tdm2s = trans_rdm12s_batch (bravecs, ketvecs, norb, nelec,
+                                                   link_index=linkstr, do2=False,
+                                                   max_memory=max_memory)
             return tdm1s, tdm2s
         def trans_rdm1s_loop (bra_r, ket_r):
             return trans_rdm12s_loop (bra_r, ket_r, do2=False)[0]
@@ -787,6 +860,28 @@ class FragTDMInt (object):
             hhdm = self._trans_hhdm_loop(bravecs, ketvecs, norb, nelec_ket, spin, linkstr)
             return hhdm
 
+        # Each task computes and stores the intermediates of one unique (bra, ket) pair
+        def spectator_task (k, l):
+            #fragment is not interacting
+            dm1s, dm2s = trans_rdm12s_loop (k, l, do2=True)
+            self.set_dm1 (k, l, dm1s)
+            self.set_dm2 (k, l, dm2s)
+        def h_task (bra, ket, spin):
+            # <j|a_p|i>, <j|b_p|i>
+            h, phh = trans_rdm13h_loop (bra, ket, spin=spin)
+            self.set_h (bra, ket, spin, h)
+            # <j|a'_q a_r a_p|i>, <j|b'_q b_r a_p|i> - how to tell if consistent sign rule?
+            err = np.abs (phh[:,:,spin] + phh[:,:,spin].transpose (0,1,4,3,2))
+            assert (np.amax (err) < 1e-8), '{}'.format (np.amax (err)) 
+            # ^ Passing this assert proves that I have the correct index
+            # and argument ordering for the call and return of trans_rdm12s
+            self.set_phh (bra, ket, spin, phh)
+        def sm_task (bra, ket):
+            self.set_sm (bra, ket, trans_sfddm_loop (bra, ket))
+        def hh_task (bra, ket, spin):
+            self.set_hh (bra, ket, spin, trans_hhdm_loop (bra, ket, spin=spin))
+        tasks = []
+
         # Spectator fragment contribution
         spectator_index = np.all (hopping_index == 0, axis=0)
         spectator_index[np.triu_indices (nuroots, k=1)] = False
@@ -794,13 +889,9 @@ class FragTDMInt (object):
         for i, j in spectator_index:
             if not spman_inter_uniq[i,j]: continue
             k, l = self.uroot_addr[i], self.uroot_addr[j]
-            if not self.unmasked_int (k,l,screen): continue
-            #fragment is not interacting
-            dm1s, dm2s = trans_rdm12s_loop (k, l, do2=True)
-            self.set_dm1 (k, l, dm1s)
-            self.set_dm2 (k, l, dm2s)
+            if not unmasked_int (k,l): continue
+            tasks.append (('trans_rdm12s_loop', functools.partial (spectator_task, k, l)))
  
-        t1 = self.log.timer_debug1 ('_make_dms_ trans_rdm12s_loop ', *t1)
         hidx_ket_a = np.where (np.any (hopping_index[0] < 0, axis=0))[0]
         hidx_ket_b = np.where (np.any (hopping_index[1] < 0, axis=0))[0]
 
@@ -809,55 +900,75 @@ class FragTDMInt (object):
             for b in np.where (hopping_index[0,:,k] < 0)[0]:
                 if not spman_inter_uniq[b,k]: continue
                 bra, ket = self.uroot_addr[b], self.uroot_addr[k]
-                if not self.unmasked_int (bra,ket,screen): continue
+                if not unmasked_int (bra,ket): continue
                 # <j|a_p|i>
                 if np.all (hopping_index[:,b,k] == [-1,0]):
-                    h, phh = trans_rdm13h_loop (bra, ket, spin=0)
-                    self.set_h (bra, ket, 0, h)
-                    # <j|a'_q a_r a_p|i>, <j|b'_q b_r a_p|i> - how to tell if consistent sign rule?
-                    err = np.abs (phh[:,:,0] + phh[:,:,0].transpose (0,1,4,3,2))
-                    assert (np.amax (err) < 1e-8), '{}'.format (np.amax (err)) 
-                    # ^ Passing this assert proves that I have the correct index
-                    # and argument ordering for the call and return of trans_rdm12s
-                    self.set_phh (bra, ket, 0, phh)
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_rdm13h_loop ', *t1)
+                    task = ('trans_rdm13h_loop', functools.partial (h_task, bra, ket, 0))
                 # <j|b'_q a_p|i> = <j|s-|i>
                 elif np.all (hopping_index[:,b,k] == [-1,1]):
-                    self.set_sm (bra, ket, trans_sfddm_loop (bra, ket))
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_sfddm_loop ', *t1)
+                    task = ('trans_sfddm_loop', functools.partial (sm_task, bra, ket))
                 # <j|b_q a_p|i>
                 elif np.all (hopping_index[:,b,k] == [-1,-1]):
-                    self.set_hh (bra, ket, 1, trans_hhdm_loop (bra, ket, spin=1))
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_hhdm_loop ', *t1)
+                    task = ('trans_hhdm_loop', functools.partial (hh_task, bra, ket, 1))
                 # <j|a_q a_p|i>
                 elif np.all (hopping_index[:,b,k] == [-2,0]):
-                    self.set_hh (bra, ket, 0, trans_hhdm_loop (bra, ket, spin=0))
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_hhdm_loop ', *t1)
+                    task = ('trans_hhdm_loop', functools.partial (hh_task, bra, ket, 0))
+                else:
+                    continue
+                tasks.append (task)
                 
         # b_p|i>
         for k in hidx_ket_b:
             for b in np.where (hopping_index[1,:,k] < 0)[0]:
                 if not spman_inter_uniq[b,k]: continue
                 bra, ket = self.uroot_addr[b], self.uroot_addr[k]
-                if not self.unmasked_int (bra,ket,screen): continue
+                if not unmasked_int (bra,ket): continue
                 # <j|b_p|i>
                 if np.all (hopping_index[:,b,k] == [0,-1]):
-                    h, phh = trans_rdm13h_loop (bra, ket, spin=1)
-                    self.set_h (bra, ket, 1, h)
-                    # <j|a'_q a_r b_p|i>, <j|b'_q b_r b_p|i> - how to tell if consistent sign rule?
-                    err = np.abs (phh[:,:,1] + phh[:,:,1].transpose (0,1,4,3,2))
-                    assert (np.amax (err) < 1e-8), '{}'.format (np.amax (err))
-                    # ^ Passing this assert proves that I have the correct index
-                    # and argument ordering for the call and return of trans_rdm12s
-                    self.set_phh (bra, ket, 1, phh)
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_rdm13h_loop ', *t1)
+                    task = ('trans_rdm13h_loop', functools.partial (h_task, bra, ket, 1))
                 # <j|b_q b_p|i>
                 elif np.all (hopping_index[:,b,k] == [0,-2]):
-                    self.set_hh (bra, ket, 2, trans_hhdm_loop (bra, ket, spin=2))
-                    t1 = self.log.timer_debug1 ('_make_dms_ trans_hhdm_loop ', *t1)
-        
+                    task = ('trans_hhdm_loop', functools.partial (hh_task, bra, ket, 2))
+                else:
+                    continue
+                tasks.append (task)
+
+        self._run_tdm_tasks_(tasks)
+
+        self.nblks_made, self.nblks_reused = nblks
+        self.log.debug ('Fragment %d density matrices: %d blocks computed, %d blocks reused',
+                        self.idx_frag, self.nblks_made, self.nblks_reused)
         return t0
 
+    def _run_tdm_tasks_(self, tasks):
+        ''' Execute a list of (label, callable) transition density matrix tasks, dividing them
+        among self.tdm_nthreads Python threads if requested, and log the number of tasks and the
+        total wall time for each label '''
+        from pyscf.lib import param
+        nworkers = min (self.tdm_nthreads, len (tasks))
+        if getattr (param, 'mgpu_fci', False): nworkers = 1
+        def timed (task):
+            label, fn = task
+            w0 = lib.logger.perf_counter ()
+            fn ()
+            return label, lib.logger.perf_counter () - w0
+        if nworkers < 2:
+            results = [timed (task) for task in tasks]
+        else:
+            omp_nthreads = max (1, lib.num_threads () // nworkers)
+            def work (task):
+                with lib.with_omp_threads (omp_nthreads):
+                    return timed (task)
+            with ThreadPoolExecutor (max_workers=nworkers) as executor:
+                results = list (executor.map (work, tasks))
+        profile = {}
+        for label, dw in results:
+            ntasks, wall = profile.get (label, (0, 0.0))
+            profile[label] = (ntasks+1, wall+dw)
+        for label, (ntasks, wall) in profile.items ():
+            self.log.debug1 ('_make_dms_ %s: %d tasks, wall time %9.2f sec on %d threads',
+                             label, ntasks, wall, max (1, nworkers))
+
     def symmetrize_pt1_(self, ptmap):
         ''' Symmetrize transition density matrices of first order in perturbation theory '''
         # TODO: memory-efficient version of this (get rid of outer product)
@@ -1284,9 +1395,18 @@ class HamTerm:
         return np.amax (np.abs (ci)) < 1e-15
 
 
+class IntsCache (dict):
+    '''Fragment-local intermediates from previous calls to make_ints, keyed by intermediate class
+    and by the numbers of electrons in each fragment in each rootspace. The CI vectors must not be
+    modified in place while they are cached.'''
+
+    def get_key (self, nelec_frs, _FragTDMInt_class):
+        nelec_frs = np.ascontiguousarray (nelec_frs)
+        return (_FragTDMInt_class, nelec_frs.shape, nelec_frs.tobytes ())
+
 def make_ints (las, ci, nelec_frs, smult_fr=None, screen_linequiv=DO_SCREEN_LINEQUIV, nlas=None,
                _FragTDMInt_class=FragTDMInt, mask_ints=None, discriminator=None, disc_fr=None,
-               pt_order=None, do_pt_order=None, verbose=None):
+               pt_order=None, do_pt_order=None, ints0=None, cache=None, verbose=None):
     ''' Build fragment-local intermediates (`FragTDMInt`) for LASSI o1
 
     Args:
@@ -1311,6 +1431,13 @@ def make_ints (las, ci, nelec_frs, smult_fr=None, screen_linequiv=DO_SCREEN_LINE
             Additional information to descriminate between otherwise-equivalent rootspaces,
             but applicable to individual fragments rather than globally (e.g., 3 is the same
             as 5 but only for fragment 1, not fragment 2)
+        ints0 : list of length nfrags of instances of :class:`FragTDMInt`
+            Intermediates from a previous call (e.g., a previous iteration). Where possible,
+            these are updated in place and returned, recomputing only the blocks involving
+            rootspaces whose CI vectors have changed.
+        cache : instance of :class:`IntsCache`
+            If provided, ints0 defaults to the intermediates stored here for the same
+            rootspaces, and the returned intermediates are stored here for the next call.
         verbose : integer
             Verbosity level of intermediate logger
 
@@ -1334,8 +1461,34 @@ def make_ints (las, ci, nelec_frs, smult_fr=None, screen_linequiv=DO_SCREEN_LINE
     rootaddr, fragaddr = get_rootaddr_fragaddr (lroots)
     ints = []
 
+    if cache is not None:
+        cache_key = cache.get_key (nelec_frs, _FragTDMInt_class)
+        if ints0 is None: ints0 = cache.get (cache_key, None)
+    if ints0 is None or len (ints0) != nfrags: ints0 = [None for ifrag in range (nfrags)]
+    nblks_made = nblks_reused = 0
+
     for ifrag in range (nfrags):
         m0 = lib.current_memory ()[0]
+        tdmint = ints0[ifrag]
+        dirty = None
+        if ((tdmint is not None) and (type (tdmint) is _FragTDMInt_class)
+                and (tdmint.norb == nlas[ifrag])):
+            dirty = tdmint.get_dirty_roots (ci[ifrag], nelec_frs[ifrag], smult_r=smult_fr[ifrag],
+                                            mask_ints=mask_ints,
+                                            discriminator=list(zip(discriminator,disc_fr[ifrag])),
+                                            pt_order=pt_order, do_pt_order=do_pt_order,
+                                            screen_linequiv=screen_linequiv)
+        if dirty is not None:
+            if len (dirty):
+                tdmint.update_ci_(dirty, [ci[ifrag][i] for i in dirty])
+            else:
+                tdmint.nblks_made, tdmint.nblks_reused = 0, tdmint.nblks_made+tdmint.nblks_reused
+            log.debug ('LAS-state TDM12s fragment %d intermediate updated: %d dirty rootspaces',
+                       ifrag, len (dirty))
+            nblks_made += tdmint.nblks_made
+            nblks_reused += tdmint.nblks_reused
+            ints.append (tdmint)
+            continue
         tdmint = _FragTDMInt_class (las, ci[ifrag],
                                     nlas[ifrag], nroots, nelec_frs[ifrag], rootaddr,
                                     fragaddr[ifrag], ifrag, mask_ints,
@@ -1351,7 +1504,11 @@ def make_ints (las, ci, nelec_frs, smult_fr=None, screen_linequiv=DO_SCREEN_LINE
             ifrag), *tdmint.time_crunch)
         log.debug ('UNIQUE ROOTSPACES OF FRAG %d: %d/%d', ifrag,
                           np.count_nonzero (tdmint.root_unique), nroots)
+        nblks_made += tdmint.nblks_made
         ints.append (tdmint)
+    log.debug ('LAS-state TDM12s intermediates: %d blocks computed, %d blocks reused',
+               nblks_made, nblks_reused)
+    if cache is not None: cache[cache_key] = ints
     return ints, lroots
 
 
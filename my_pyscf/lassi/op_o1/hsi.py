@@ -12,11 +12,14 @@ from mrh.my_pyscf.lassi.op_o1.utilities import *
 from mrh.util.my_scipy import CallbackLinearOperator
 import functools, itertools
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 from pyscf import __config__
 import sys
 
 PROFVERBOSE = getattr (__config__, 'lassi_hsi_profverbose', None)
 SCREEN_THRESH = getattr (__config__, 'lassi_hsi_screen_thresh', 1e-12)
+GROUP_NTHREADS = getattr (__config__, 'lassi_hsi_group_nthreads', 1)
+OUTCORE_FALLBACK = getattr (__config__, 'lassi_hsi_outcore_fallback', True)
 
 class HamS2OvlpOperators (HamS2Ovlp):
     __doc__ = HamS2Ovlp.__doc__ + '''
@@ -26,14 +29,29 @@ class HamS2OvlpOperators (HamS2Ovlp):
     Additional methods:
         get_ham_op, get_s2_op, get_ovlp_op
             Take no arguments and return LinearOperators of shape (nstates,nstates) which apply the
-            respective operator to a SI trial vector.
+            respective operator to a SI trial vector. Blocks of trial vectors passed to the
+            LinearOperators' matmat methods are applied all at once, visiting each cached
+            operator group once per block.
         get_hdiag
             Take no arguments and return and ndarray of shape (nstates,) which contains the
             Hamiltonian diagonal
+
+    Additional kwargs:
+        group_nthreads : integer
+            Number of Python threads among which the operator groups are divided in the
+            matrix-vector product. Each thread accumulates into a private output buffer, and the
+            buffers are summed at the end. The OpenMP threads are divided evenly among the
+            Python threads.
+
+    If the operator cache does not fit in max_memory and __config__.lassi_hsi_outcore_fallback
+    is True (default), the operator arrays are stored in a temporary HDF5 file in
+    lib.param.TMPDIR, sorted by nonspectator fragments, and read back one operator group at a
+    time when they are used. Otherwise, a MemoryError is raised.
     '''
     def __init__(self, ints, nlas, lroots, h1, h2, mask_bra_space=None,
                  mask_ket_space=None, pt_order=None, do_pt_order=None, log=None,
-                 max_memory=param.MAX_MEMORY, screen_thresh=SCREEN_THRESH, dtype=np.float64):
+                 max_memory=param.MAX_MEMORY, screen_thresh=SCREEN_THRESH, dtype=np.float64,
+                 group_nthreads=GROUP_NTHREADS):
         t0 = (logger.process_clock (), logger.perf_counter ())
         HamS2Ovlp.__init__(self, ints, nlas, lroots, h1, h2,
                            mask_bra_space=mask_bra_space, mask_ket_space=mask_ket_space,
@@ -41,6 +59,10 @@ class HamS2OvlpOperators (HamS2Ovlp):
                            log=log, max_memory=max_memory, dtype=dtype)
         self.log = logger.new_logger (self.log, verbose=PROFVERBOSE)
         self.screen_thresh = screen_thresh
+        self.group_nthreads = group_nthreads
+        self.outcore_fallback = OUTCORE_FALLBACK
+        self.opcache_h5 = None
+        self._opcache_nops = 0
         self.x = self.si = np.zeros (self.nstates, self.dtype)
         self.ox = np.zeros (self.nstates, self.dtype)
         self.ox1 = np.zeros (self.nstates, self.dtype)
@@ -69,7 +91,10 @@ class HamS2OvlpOperators (HamS2Ovlp):
             rm, m0, self.max_memory)
         self.log.debug (memstr)
         if (m0 + rm) > self.max_memory:
-            raise MemoryError (memstr)
+            if not self.outcore_fallback:
+                raise MemoryError (memstr)
+            self.log.note ('%s; storing operator cache on disk', memstr)
+            self.opcache_h5 = lib.H5TmpFile ()
 
     def checkmem_1oppart (self, exc, fn):
         rm = 0
@@ -112,6 +137,7 @@ class HamS2OvlpOperators (HamS2Ovlp):
             self._crunch_oppart_(exc, fn)
         self.optermgroups_s = self._index_ovlppart (self.optermgroups_s)
         self.optermgroups_h = self._index_ovlppart (self.optermgroups_h)
+        if self.opcache_h5 is not None: self._sort_opcache_()
         self.log.debug (self.sprint_cache_profile ())
         self.log.timer ('HamS2OvlpOperators operator cacheing', *t0)
         if self.log.verbose >= logger.DEBUG:
@@ -126,25 +152,9 @@ class HamS2OvlpOperators (HamS2Ovlp):
     def get_dot_product_sizes (self, groups):
         sizes = [{} for i in range (4)]
         for inv, group in groups.items ():
-            sinv = list (set (inv))
-            nfrags = len (sinv)
-            for op in group.ops:
-                K, L = op.get_formal_shape ()
-                M = sizes[nfrags-1].get ((K,L), 0)
-                Mt = sizes[nfrags-1].get ((L,K), 0)
-                for key in op.spincase_keys:
-                    brakets, bras, braHs = self.get_nonuniq_exc_square (key)
-                    for bra in bras:
-                        urootstr = self.urootstr[:,bra].copy ()
-                        urootstr[sinv] = 1
-                        M += np.prod (urootstr)
-                    for bra in braHs:
-                        urootstr = self.urootstr[:,bra].copy ()
-                        urootstr[sinv] = 1
-                        Mt += np.prod (urootstr)
-                sizes[nfrags-1][(K,L)] = M
-                if Mt > 0:
-                    sizes[nfrags-1][(L,K)] = Mt
+            nfrags = len (set (inv))
+            for (K, L), M in self.get_group_dot_product_sizes (inv, group).items ():
+                sizes[nfrags-1][(K,L)] = sizes[nfrags-1].get ((K,L), 0) + M
         for i in range (4):
             d = sizes[i]
             sizes[i] = np.zeros ((len(d),3), dtype=int)
@@ -152,6 +162,74 @@ class HamS2OvlpOperators (HamS2Ovlp):
                 sizes[i][j,:] = [K, L, M]
         return sizes
 
+    def get_group_dot_product_sizes (self, inv, group):
+        '''Shapes of the matrix-matrix products carried out by one operator group in the
+        matrix-vector product
+
+        Args:
+            inv : tuple of int
+                Nonspectator fragments of the group
+            group : instance of :class:`OpTermGroup`
+
+        Returns:
+            sizes : dict
+                Keys are (K,L) operator shapes, and values are the total number of vector
+                columns M to which operators of that shape are applied, per trial vector
+        '''
+        sinv = list (set (inv))
+        sizes = {}
+        for op in group.ops:
+            K, L = op.get_formal_shape ()
+            M = sizes.get ((K,L), 0)
+            Mt = sizes.get ((L,K), 0)
+            for key in op.spincase_keys:
+                brakets, bras, braHs = self.get_nonuniq_exc_square (key)
+                for bra in bras:
+                    urootstr = self.urootstr[:,bra].copy ()
+                    urootstr[sinv] = 1
+                    M += np.prod (urootstr)
+                for bra in braHs:
+                    urootstr = self.urootstr[:,bra].copy ()
+                    urootstr[sinv] = 1
+                    Mt += np.prod (urootstr)
+            sizes[(K,L)] = M
+            if Mt > 0:
+                sizes[(L,K)] = Mt
+        return sizes
+
+    def get_group_cost (self, inv, group):
+        '''Estimated number of multiply-adds performed by one operator group per trial vector
+        in the matrix-vector product'''
+        sizes = self.get_group_dot_product_sizes (inv, group)
+        return sum ([float (K)*float (L)*float (M) for (K, L), M in sizes.items ()])
+
+    def split_groups (self, groups, nchunks):
+        '''Divide operator groups into chunks of approximately equal estimated cost, using the
+        longest-processing-time-first greedy algorithm
+
+        Args:
+            groups : dict
+                Keys are tuples of nonspectator fragments and values are instances of
+                :class:`OpTermGroup`
+            nchunks : integer
+                Number of chunks
+
+        Returns:
+            chunks : list of length nchunks of lists of tuples
+                Keys of groups assigned to each chunk
+            costs : ndarray of shape (nchunks,)
+                Total estimated cost of each chunk
+        '''
+        keys = list (groups.keys ())
+        costs = np.asarray ([self.get_group_cost (inv, groups[inv]) for inv in keys])
+        chunks = [[] for i in range (nchunks)]
+        chunk_costs = np.zeros (nchunks)
+        for i in np.argsort (-costs, kind='stable'):
+            j = np.argmin (chunk_costs)
+            chunks[j].append (keys[i])
+            chunk_costs[j] += costs[i]
+        return chunks, chunk_costs
+
     def opterm_std_shape (self, bra, ket, op, inv, sinv):
         t0, w0 = logger.process_clock (), logger.perf_counter ()
         if isinstance (op, (np.ndarray, opterm.OpTerm)):
@@ -183,7 +261,7 @@ class HamS2OvlpOperators (HamS2Ovlp):
                 val = self.optermgroups_h.get (key, opterm.OpTermGroup (key))
                 for mybra, myket in self.spman[tuple((bra,ket))+tuple(row)]:
                     op.spincase_keys.append (tuple ((mybra, myket)) + tuple (row))
-                val.append (op)
+                val.append (self._dump_op (op))
                 self.optermgroups_h[key] = val
             if has_s:
                 op = self.opterm_std_shape (bra, ket, data[1], inv, sinv)
@@ -191,10 +269,34 @@ class HamS2OvlpOperators (HamS2Ovlp):
                     val = self.optermgroups_s.get (key, opterm.OpTermGroup (key))
                     for mybra, myket in self.spman[tuple((bra,ket))+tuple(row)]:
                         op.spincase_keys.append (tuple ((mybra, myket)) + tuple (row))
-                    val.append (op)
+                    val.append (self._dump_op (op))
                     self.optermgroups_s[key] = val
             
 
+    def _dump_op (self, op):
+        '''Move the array of a newly-cached operator to disk if the cache is out-of-core'''
+        if self.opcache_h5 is None: return op
+        name = str (self._opcache_nops)
+        self._opcache_nops += 1
+        return opterm.dump_opterm (op, self.opcache_h5, name)
+
+    def _sort_opcache_(self):
+        '''Rewrite the on-disk operator cache so that the arrays of each operator group are
+        contiguous, with the groups sorted by nonspectator fragments, so that _ham_op and
+        _s2_op read the file sequentially'''
+        t0 = (logger.process_clock (), logger.perf_counter ())
+        old_h5 = self.opcache_h5
+        self.opcache_h5 = lib.H5TmpFile ()
+        for lbl in ('h', 's'):
+            groups = getattr (self, 'optermgroups_' + lbl)
+            h5grp = self.opcache_h5.create_group (lbl)
+            sorted_groups = {}
+            for i, inv in enumerate (sorted (groups.keys ())):
+                sorted_groups[inv] = groups[inv].load ().dump (h5grp, str (i))
+            setattr (self, 'optermgroups_' + lbl, sorted_groups)
+        old_h5.close ()
+        self.log.timer ('HamS2OvlpOperators sort on-disk operator cache', *t0)
+
     def _index_ovlppart (self, groups):
         # TODO: redesign this in a scalable graph-theoretic way
         # TODO: memcheck for this. It's hard b/c IDK how to guess the final size of ovlplinkstr
@@ -339,11 +441,13 @@ class HamS2OvlpOperators (HamS2Ovlp):
     def get_xvec (self, iroot, *inv):
         fac = self.spin_shuffle[iroot] * self.fermion_frag_shuffle (iroot, inv)
         i, j = self.offs_lroots[iroot]
-        return fac * self.x[i:j]
+        return fac * self.x[:,i:j]
 
     def put_ox1_(self, vec, iroot, *inv):
+        # vec is C-ordered (bra, spectators, nvec); ox1 is (nvec, nstates)
         i, j, fac = self.get_ox1_params(iroot, *inv)
-        self.ox1[i:j] += fac * vec
+        nvec = self.ox1.shape[0]
+        self.ox1[:,i:j] += fac * vec.reshape (-1, nvec).T
         return
     def put_ox1_debug(self, vec, iroot, *inv):
         i, j, fac = self.get_ox1_params(iroot, *inv)
@@ -358,35 +462,104 @@ class HamS2OvlpOperators (HamS2Ovlp):
 
     def _umat_linequiv_(self, ifrag, iroot, umat, ivec, *args):
         if ivec==0:
-            self.x = umat_dot_1frag_(self.x, umat.conj ().T, self.lroots, ifrag, iroot)
+            self.x = umat_dot_1frag_(self.x, umat.conj ().T, self.lroots, ifrag, iroot, axis=1)
         elif ivec==1:
-            self.ox = umat_dot_1frag_(self.ox, umat, self.lroots, ifrag, iroot)
+            self.ox = umat_dot_1frag_(self.ox, umat, self.lroots, ifrag, iroot, axis=1)
         else:
             raise RuntimeError ("Invalid ivec = {}; must be 0 or 1".format (ivec))
 
+    def _init_x_(self, x):
+        '''Load one or more SI trial vectors into the buffer self.x, of shape (nvec, nstates),
+        and zero the corresponding output buffers.
+
+        Args:
+            x : ndarray of size nvec*nstates
+                Trial vector(s), with the nstates index fastest-moving
+
+        Returns:
+            nvec : integer
+                Number of trial vectors
+        '''
+        nvec = x.size // self.nstates
+        assert (nvec*self.nstates == x.size), 'x.size = {}; nstates = {}'.format (
+            x.size, self.nstates)
+        self.x = self.si = np.empty ((nvec, self.nstates), dtype=self.dtype)
+        self.x[:,:] = np.asarray (x).reshape (nvec, self.nstates)
+        self.ox = np.zeros ((nvec, self.nstates), dtype=self.dtype)
+        self.ox1 = np.zeros ((nvec, self.nstates), dtype=self.dtype)
+        return nvec
+
     def _ham_op (self, x):
+        '''Apply the Hamiltonian to a trial vector of shape (nstates,) or to a block of trial
+        vectors of shape (nvec, nstates). The return value has the same shape as x.'''
+        if getattr (param, 'use_gpu', False) and (x.size > self.nstates):
+            # GPU kernels only handle one vector at a time
+            x = x.reshape (-1, self.nstates)
+            return np.stack ([self._ham_op (xi) for xi in x], axis=0)
         t0 = (logger.process_clock (), logger.perf_counter ())
         self.init_profiling ()
-        self.x[:] = x.flat[:]
-        self.ox[:] = 0
+        self._init_x_(x)
         self._umat_linequiv_loop_(0) # U.conj () @ x
-        for inv, group in self.optermgroups_h.items (): self._opuniq_x_group_(inv, group)
+        self._opgroups_x_(self.optermgroups_h)
         self._umat_linequiv_loop_(1) # U.T @ ox
         self.log.info (self.sprint_profile ())
         self.log.timer ('HamS2OvlpOperators._ham_op', *t0)
-        return self.ox.copy ()
+        return self.ox.copy ().reshape (x.shape)
 
     def _s2_op (self, x):
+        '''Apply S^2 to a trial vector of shape (nstates,) or to a block of trial vectors of
+        shape (nvec, nstates). The return value has the same shape as x.'''
+        if getattr (param, 'use_gpu', False) and (x.size > self.nstates):
+            x = x.reshape (-1, self.nstates)
+            return np.stack ([self._s2_op (xi) for xi in x], axis=0)
         t0 = (logger.process_clock (), logger.perf_counter ())
         self.init_profiling ()
-        self.x[:] = x.flat[:]
-        self.ox[:] = 0
+        self._init_x_(x)
         self._umat_linequiv_loop_(0) # U.conj () @ x
-        for inv, group in self.optermgroups_s.items (): self._opuniq_x_group_(inv, group)
+        self._opgroups_x_(self.optermgroups_s)
         self._umat_linequiv_loop_(1) # U.T @ ox
         self.log.info (self.sprint_profile ())
         self.log.timer ('HamS2OvlpOperators._s2_op', *t0)
-        return self.ox.copy ()
+        return self.ox.copy ().reshape (x.shape)
+
+    def _opgroups_x_(self, groups):
+        '''Apply all operator groups to self.x and add the result to self.ox, dividing the
+        groups among self.group_nthreads Python threads if requested'''
+        nworkers = min (self.group_nthreads, len (groups))
+        if (nworkers < 2) or getattr (param, 'use_gpu', False):
+            for inv, group in groups.items (): self._opuniq_x_group_(inv, group.load ())
+            return
+        chunks, costs = self.split_groups (groups, nworkers)
+        omp_nthreads = max (1, lib.num_threads () // nworkers)
+        def work (chunk):
+            w0 = logger.perf_counter ()
+            # Private output buffers; everything else is shared and only read
+            worker = lib.view (self, self.__class__)
+            worker.ox = np.zeros_like (self.ox)
+            worker.ox1 = np.zeros_like (self.ox1)
+            worker.init_profiling ()
+            with lib.with_omp_threads (omp_nthreads):
+                for inv in chunk: worker._opuniq_x_group_(inv, groups[inv].load ())
+            return worker, logger.perf_counter () - w0
+        with ThreadPoolExecutor (max_workers=nworkers) as executor:
+            results = list (executor.map (work, chunks))
+        for i, (worker, dw) in enumerate (results):
+            self.log.debug ('op group chunk %d: %d groups, est. cost %8.1e, wall %9.2f sec',
+                            i, len (chunks[i]), costs[i], dw)
+            self.ox += worker.ox
+            self._reduce_profile_(worker)
+
+    _matvec_profile_keys = ('u', 'sX', 'oX', 'pX', '4fo', '4fr', '4f1', '4f2', '4f3',
+                            'non_uniq_exc', 'op_reduce', 'compute_3frag', 'compute_4frag')
+
+    def _reduce_profile_(self, worker):
+        '''Add the matrix-vector profiling counters of a worker view to those of self'''
+        for key in self._matvec_profile_keys:
+            for pre in ('dt_', 'dw_'):
+                setattr (self, pre+key, getattr (self, pre+key) + getattr (worker, pre+key))
+        for i in range (4):
+            self.dt_oXn[i] += worker.dt_oXn[i]
+            self.dw_oXn[i] += worker.dw_oXn[i]
 
     def _opuniq_x_group_(self, inv, group):
         '''All unique operations which have a set of nonspectator fragments in common'''
@@ -395,6 +568,9 @@ class HamS2OvlpOperators (HamS2Ovlp):
         t0, w0 = logger.process_clock (), logger.perf_counter ()
         # Some rootspaces are redundant: same urootstr for different ket indices.
         # Those vector slices must be added, so I can't use dict comprehension.
+        # The trial-vector index starts out slowest-moving. ox_ovlp_frag only ever touches the
+        # fragment index immediately preceding the collected nonspectator dimensions, so the
+        # trial-vector index ends up fastest-moving among the spectator dimensions.
         vecs = {}
         for ket in set (ovlplink[:,0]):
             key = tuple(self.urootstr[:,ket])  #gets a number 
@@ -421,9 +597,9 @@ class HamS2OvlpOperators (HamS2Ovlp):
 
         for bra in range (self.nroots):
             i, j = self.offs_lroots[bra]
-            self.ox[i:j] += transpose_sivec_with_slow_fragments (
-                self.ox1[i:j], self.lroots[:,bra], *inv
-            )[0]
+            self.ox[:,i:j] += transpose_sivec_with_slow_fragments (
+                self.ox1[:,i:j].ravel (), self.lroots[:,bra], *inv
+            )
         t3, w3 = logger.process_clock (), logger.perf_counter ()
         self.dt_pX += (t3-t2)
         self.dw_pX += (w3-w2)
@@ -873,30 +1049,32 @@ class HamS2OvlpOperators (HamS2Ovlp):
 
     def _ovlp_op (self, x):
         t0 = (logger.process_clock (), logger.perf_counter ())
-        self.x[:] = x.flat[:]
-        self.ox[:] = 0
+        self._init_x_(x)
         self._umat_linequiv_loop_(0) # U.conj () @ x
         for bra, ket in self.exc_null:
             i0, i1 = self.offs_lroots[bra]
             j0, j1 = self.offs_lroots[ket]
             ovlp = self.crunch_ovlp (bra, ket)
-            self.ox[i0:i1] += np.dot (ovlp, self.x[j0:j1])
-            self.ox[j0:j1] += np.dot (ovlp.conj ().T, self.x[i0:i1])
+            self.ox[:,i0:i1] += np.dot (self.x[:,j0:j1], ovlp.T)
+            self.ox[:,j0:j1] += np.dot (self.x[:,i0:i1], ovlp.conj ())
         self._umat_linequiv_loop_(1) # U.T @ ox
         self.log.timer ('HamS2OvlpOperators._ovlp_op', *t0)
-        return self.ox.copy ()
+        return self.ox.copy ().reshape (x.shape)
 
     def get_ham_op (self):
         return CallbackLinearOperator (self, [self.nstates,]*2, dtype=self.dtype,
-                                             matvec=self._ham_op)
+                                             matvec=self._ham_op,
+                                             matmat=lambda x: self._ham_op (x.T).T)
 
     def get_s2_op (self):
         return CallbackLinearOperator (self, [self.nstates,]*2, dtype=self.dtype,
-                                             matvec=self._s2_op)
+                                             matvec=self._s2_op,
+                                             matmat=lambda x: self._s2_op (x.T).T)
 
     def get_ovlp_op (self):
         return CallbackLinearOperator (self, [self.nstates,]*2, dtype=self.dtype,
-                                             matvec=self._ovlp_op)
+                                             matvec=self._ovlp_op,
+                                             matmat=lambda x: self._ovlp_op (x.T).T)
 
     def get_neutral (self, verbose=None):
         # Get a Hamiltonian operator, but the 3- and 4-fragment terms are dropped
@@ -975,7 +1153,7 @@ class HamS2OvlpOperators (HamS2Ovlp):
 
     def get_hdiag (self):
         t0 = (logger.process_clock (), logger.perf_counter ())
-        self.ox[:] = 0
+        self.ox = np.zeros (self.nstates, dtype=self.dtype)
         for row in self.exc_1d: self._crunch_hdiag_env_(self._crunch_1d_, *row)
         for row in self.exc_2d: self._crunch_hdiag_env_(self._crunch_2d_, *row)
         self.log.timer ('HamS2OvlpOperators.get_hdiag', *t0)
@@ -1077,12 +1255,11 @@ class HamS2OvlpOperators (HamS2Ovlp):
 
     def get_hdiag_orth (self, raw2orth):
         self.init_hdiag_orth_profiling ()
-        self.ox[:] = 0
-        hdiag = self.ox
+        self.ox = hdiag = np.zeros (self.nstates, dtype=self.dtype)
         if raw2orth.shape[0] > hdiag.size:
             hdiag = np.zeros (raw2orth.shape[0], dtype=self.ox.dtype)
         for inv, group in self.optermgroups_h.items (): 
-            for op in group.ops:
+            for op in group.load ().ops:
                 for addr_sn in self.hdiag_orth_sn_args (raw2orth, op):
                     i, j = raw2orth.get_manifold_orth_offs (addr_sn)
                     hdiag_sn = self.hdiag_orth_sn (raw2orth, inv, op, addr_sn)
@@ -1102,7 +1279,7 @@ class HamS2OvlpOperators (HamS2Ovlp):
         addrs = raw2orth.idx2addrs (idxs)
         ham = np.zeros ((pspace_size, pspace_size), dtype=self.dtype)
         for inv, group in self.optermgroups_h.items (): 
-            for op in group.ops:
+            for op in group.load ().ops:
                 for bra_sn, ket_sn in self.pspace_ham_sn_args (raw2orth, op):
                     i = addrs[0]==bra_sn
                     j = addrs[0]==ket_sn
@@ -1389,7 +1566,8 @@ class HamS2OvlpOperators (HamS2Ovlp):
 #gen_contract_op_si_hdiag = functools.partial (_fake_gen_contract_op_si_hdiag, ham)
 def gen_contract_op_si_hdiag (las, h1, h2, ci, nelec_frs, smult_fr=None, disc_fr=None, soc=0,
                               nlas=None, _HamS2Ovlp_class=HamS2OvlpOperators, _return_int=False,
-                              screen_thresh=SCREEN_THRESH, **kwargs):
+                              screen_thresh=SCREEN_THRESH, group_nthreads=GROUP_NTHREADS,
+                              **kwargs):
     ''' Build Hamiltonian, spin-squared, and overlap matrices in LAS product state basis
 
     Args:
@@ -1422,6 +1600,12 @@ def gen_contract_op_si_hdiag (las, h1, h2, ci, nelec_frs, smult_fr=None, disc_fr
             operator matrices
         screen_thresh : float
             Tolerance for screening Hamiltonian and S^2 operator components
+        group_nthreads : integer
+            Number of Python threads among which to divide operator groups in the
+            matrix-vector product
+        ints_cache : instance of :class:`frag.IntsCache`
+            Fragment-local intermediates from previous calls, updated rather than rebuilt for
+            the rootspaces whose CI vectors have not changed
         
     Returns: 
         ham_op : LinearOperator of shape (nstates,nstates)
@@ -1454,7 +1638,7 @@ def gen_contract_op_si_hdiag (las, h1, h2, ci, nelec_frs, smult_fr=None, disc_fr
     t1 = (lib.logger.process_clock (), lib.logger.perf_counter ())
     ints, lroots = frag.make_ints (las, ci, nelec_frs, nlas=nlas, smult_fr=smult_fr,
                                    disc_fr=disc_fr, pt_order=pt_order, do_pt_order=do_pt_order,
-                                   verbose=verbose)
+                                   cache=kwargs.get ('ints_cache', None), verbose=verbose)
     t1 = log.timer ('LASSI hsi operator first pass make ints', *t1)
     nstates = np.sum (np.prod (lroots, axis=0))
 
@@ -1463,7 +1647,7 @@ def gen_contract_op_si_hdiag (las, h1, h2, ci, nelec_frs, smult_fr=None, disc_fr
     outerprod = _HamS2Ovlp_class (ints, nlas, lroots, h1, h2,
                                   pt_order=pt_order, do_pt_order=do_pt_order,
                                   dtype=dtype, max_memory=max_memory, log=log,
-                                  screen_thresh=screen_thresh)
+                                  screen_thresh=screen_thresh, group_nthreads=group_nthreads)
 
     if soc and not spin_pure:
         outerprod.spin_shuffle = spin_shuffle_fac
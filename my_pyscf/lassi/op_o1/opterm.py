@@ -1,4 +1,5 @@
 import numpy as np
+import h5py
 from pyscf import lib
 
 class OpTermGroup:
@@ -45,6 +46,21 @@ class OpTermGroup:
         new_group.ops = new_ops
         return new_group            
 
+    def dump (self, h5grp, prefix):
+        '''Copy of self in which the operator arrays are moved into an HDF5 group'''
+        new_group = OpTermGroup (self.inv)
+        new_group.ops = [dump_opterm (op, h5grp, '{}_{}'.format (prefix, i))
+                         for i, op in enumerate (self.ops)]
+        new_group.ovlplink = self.ovlplink
+        return new_group
+
+    def load (self):
+        '''Copy of self in which any operator arrays stored on disk are read into memory'''
+        new_group = OpTermGroup (self.inv)
+        new_group.ops = [load_opterm (op) for op in self.ops]
+        new_group.ovlplink = self.ovlplink
+        return new_group
+
 class OpTermBase:
     '''Elements of spincase_keys index nonuniq_exc to look up bras and kets addressed by this
     operator corresponding to a particular set of ket spin polarization quantum numbers.'''
@@ -76,10 +92,31 @@ class OpTermBase:
         return self.shape
 
 class OpTermReducible (OpTermBase):
+    # Name of the member holding the bulk of the data, which can be swapped for an h5py Dataset
+    _outcore_attr = None
+
     def copy (self):
         return lib.view (self, self.__class__)
 
+    def dump (self, h5grp, name):
+        '''Copy of self with the bulk data array written to h5grp[name] and replaced by a
+        reference to the corresponding h5py Dataset'''
+        op = self.copy ()
+        h5grp[name] = np.asarray (getattr (self, self._outcore_attr))
+        setattr (op, self._outcore_attr, h5grp[name])
+        return op
+
+    def load (self):
+        '''Copy of self with the bulk data array read back into memory if it is on disk'''
+        arr = getattr (self, self._outcore_attr)
+        if not isinstance (arr, h5py.Dataset): return self
+        op = self.copy ()
+        setattr (op, self._outcore_attr, arr[()])
+        return op
+
 class OpTerm (OpTermReducible):
+    _outcore_attr = 'arr'
+
     def __init__(self, arr, ints, comp, _already_stacked=False):
         self.ints = ints
         self.comp = comp
@@ -156,6 +193,18 @@ def reduce_spin (op, bra, ket):
     else:
         return op
 
+def dump_opterm (op, h5grp, name):
+    if isinstance (op, OpTermReducible):
+        return op.dump (h5grp, name)
+    else:
+        return op
+
+def load_opterm (op):
+    if isinstance (op, OpTermReducible):
+        return op.load ()
+    else:
+        return op
+
 class OpTermContracted (np.ndarray, OpTermBase):
     ''' Just farm the dot method to pyscf.lib.dot '''
     def dot (self, other):
@@ -165,6 +214,9 @@ class OpTermContracted (np.ndarray, OpTermBase):
         return np.amax (np.abs (self))
 
 class OpTermNFragments (OpTermReducible):
+    # The d arrays are references to the fragment intermediates; only op is a copy
+    _outcore_attr = 'op'
+
     def __init__(self, op, idx, d, ints, do_crunch=True):
         assert (len (idx) == len (d))
         isort = np.argsort (idx)
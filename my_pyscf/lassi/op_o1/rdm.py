@@ -1,5 +1,6 @@
 import time
 import numpy as np
+from itertools import product
 from scipy import linalg
 from pyscf import lib
 from pyscf.lib import logger, param
@@ -250,7 +251,8 @@ class LRRDM (stdm.LSTDM):
         # Numpy pads array dimension to the left
         sibra = sibra[:,:,b].conj () * o
         siket = siket[:,:,k]
-        fdm = np.stack ([np.dot (b, k.T) for b, k in zip (sibra, siket)], axis=0)
+        # All SI vectors in one batched GEMM call
+        fdm = np.matmul (sibra, siket.transpose (0,2,1))
         return fdm
                 
     def _crunch_1d_(self, bra, ket, i):
@@ -568,6 +570,289 @@ class LRRDM (stdm.LSTDM):
         self.dt_i, self.dw_i = self.dt_i + dt, self.dw_i + dw
         return env_kwargs
 
+class LROTPD (LRRDM):
+    __doc__ = LRRDM.__doc__ + '''
+
+    SUBCLASS: LASSI-root on-top pair density
+
+    `kernel` call returns the 1-body reduced density matrices and the 2-body part of the on-top
+    pair density of LASSI states on a grid, without building the 2-body reduced density matrices
+    in the whole active space. Each 2-body density fluctuation is spin-summed and accumulated in a
+    buffer keyed by the orbitals of the fragments it touches; the buffers are contracted with
+    products of the active orbitals on the grid whenever they exceed half of max_memory, and at
+    the end.
+
+    Additional args:
+        mo_grid : ndarray of shape (nderiv,ngrids,ncas)
+            Values [and first derivatives] of the active orbitals on the grid
+    '''
+
+    def __init__(self, ints, nlas, lroots, si_bra, si_ket, mo_grid, **kwargs):
+        LRRDM.__init__(self, ints, nlas, lroots, si_bra, si_ket, **kwargs)
+        self.mo_grid = mo_grid
+
+    def kernel (self):
+        ''' Main driver method of class.
+
+        Returns:
+            rdm1s : ndarray of shape (nroots_si,2,ncas,ncas)
+                Spin-separated 1-body reduced density matrices of LASSI states
+            otpd2 : ndarray of shape (nroots_si,nderiv,ngrids)
+                1/2 dm2[p,q,r,s] phi_p phi_q phi_r phi_s [and its first derivatives] of LASSI
+                states on the grid, where dm2 is the spin-summed 2-RDM
+            t0 : tuple of length 2
+                timestamp of entry into this function, for profiling by caller
+        '''
+        t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
+        self.init_profiling ()
+        nderiv, ngrids = self.mo_grid.shape[:2]
+        self.rdm1s = np.zeros ([self.nroots_si,2] + [self.norb,]*2, dtype=self.dtype)
+        self.otpd2 = np.zeros ((self.nroots_si, nderiv, ngrids), dtype=self.dtype)
+        self._rdm1s_c = c_arr (self.rdm1s)
+        self._rdm1s_c_ncol = c_int (2*(self.norb**2))
+        self._d2grid_buf = {}
+        self._d2grid_size = 0
+        self._crunch_all_()
+        return self.rdm1s, self.otpd2, t0
+
+    def _add_transpose_(self):
+        self._flush_d2grid_()
+        if self.hermi:
+            self.rdm1s += self.rdm1s.conj ().transpose (0,1,3,2)
+            # phi are real, so the transpose only conjugates the grid values
+            self.otpd2 += self.otpd2.conj ()
+
+    def _put_D2_(self):
+        t0, w0 = logger.process_clock (), logger.perf_counter ()
+        if self._transpose: self.d2[:] = self.d2.transpose (0,1,3,2,5,4).conj ()
+        key = self._orbidx.tobytes ()
+        if key in self._d2grid_buf:
+            self._d2grid_buf[key][1] += self.d2.sum (1)
+        else:
+            d2 = self.d2.sum (1)
+            self._d2grid_buf[key] = [self._orbidx.copy (), d2]
+            self._d2grid_size += d2.size
+            if self._d2grid_size * d2.itemsize / 1e6 > self.max_memory / 2:
+                self._flush_d2grid_()
+        dt, dw = logger.process_clock () - t0, logger.perf_counter () - w0
+        self.dt_p, self.dw_p = self.dt_p + dt, self.dw_p + dw
+
+    def _flush_d2grid_(self):
+        max_memory = max (1, self.max_memory - lib.current_memory ()[0])
+        for orbidx, d2 in self._d2grid_buf.values ():
+            self.otpd2 += dm2_on_grid (d2, self.mo_grid[:,:,orbidx], max_memory=max_memory)
+        self._d2grid_buf = {}
+        self._d2grid_size = 0
+
+def dm2_on_grid (dm2, mo_grid, max_memory=param.MAX_MEMORY):
+    ''' Contract spin-summed 2-RDMs with products of real orbitals on a grid,
+
+    otpd2(r) = 1/2 dm2[p,q,r,s] phi_p(r) phi_q(r) phi_r(r) phi_s(r),
+
+    together with the first derivatives of otpd2 if mo_grid contains those of the orbitals.
+
+    Args:
+        dm2 : ndarray of shape (nroots,norb,norb,norb,norb)
+            Spin-summed 2-RDMs
+        mo_grid : ndarray of shape (nderiv,ngrids,norb)
+            Values [and first derivatives] of the orbitals on the grid
+
+    Kwargs:
+        max_memory : float
+            Memory available for intermediates in MB
+
+    Returns:
+        otpd2 : ndarray of shape (nroots,nderiv,ngrids)
+    '''
+    nroots, norb = dm2.shape[:2]
+    nderiv, ngrids = mo_grid.shape[:2]
+    npair = norb * norb
+    dm2 = dm2.reshape (nroots, npair, npair)
+    otpd2 = np.zeros ((nroots, nderiv, ngrids), dtype=np.result_type (dm2, mo_grid))
+    # All states in one GEMM: dm2[r,pq,rs] -> dm2_c[pq,(r,rs)]
+    dm2_c = np.ascontiguousarray (dm2.transpose (1,0,2)).reshape (npair, nroots*npair)
+    if nderiv > 1:
+        dm2_c += np.ascontiguousarray (dm2.transpose (2,0,1)).reshape (npair, nroots*npair)
+    blksize = int (max_memory * 1e6 / (8 * npair * (nderiv+1+2*nroots)))
+    blksize = max (1, min (ngrids, blksize))
+    for p0, p1 in lib.prange (0, ngrids, blksize):
+        phi = mo_grid[:,p0:p1,:]
+        pair = [(phi[i,:,:,None] * phi[0,:,None,:]).reshape (p1-p0, npair)
+                for i in range (nderiv)]
+        wrk = np.dot (pair[0], dm2_c).reshape (p1-p0, nroots, npair)
+        if nderiv > 1:
+            # dm2_c is symmetrized, but the value only sees the symmetric part anyway
+            otpd2[:,0,p0:p1] = lib.einsum ('gp,grp->rg', pair[0], wrk) / 4
+            # product rule: d(phi_p phi_q) = (dphi_p) phi_q + phi_p (dphi_q)
+            wrk = wrk.reshape (p1-p0, nroots, norb, norb)
+            wrk = (wrk + wrk.transpose (0,1,3,2)).reshape (p1-p0, nroots, npair)
+            for i in range (1, nderiv):
+                otpd2[:,i,p0:p1] = lib.einsum ('gp,grp->rg', pair[i], wrk) / 2
+        else:
+            otpd2[:,0,p0:p1] = lib.einsum ('gp,grp->rg', pair[0], wrk) / 2
+    return otpd2
+
+class LRBRDM (LRRDM):
+    __doc__ = LRRDM.__doc__ + '''
+
+    SUBCLASS: LASSI-root block-sparse reduced density matrix
+
+    `kernel` call returns the 2-body reduced density matrices of LASSI states as a dictionary of
+    blocks keyed by the quadruple of fragments spanned by the four orbital indices, omitting
+    blocks that vanish. No array of size ncas**4 is ever allocated.
+    '''
+
+    def kernel (self):
+        ''' Main driver method of class.
+
+        Returns:
+            rdm1s : ndarray of shape (nroots_si,2,ncas,ncas)
+                Spin-separated 1-body reduced density matrices of LASSI states
+            rdm2s : dict
+                Keys are tuples (i,j,k,l) of fragment indices, and values are the corresponding
+                blocks of shape (nroots_si,4,nlas[i],nlas[j],nlas[k],nlas[l]) of the
+                spin-separated 2-body reduced density matrices of LASSI states
+            t0 : tuple of length 2
+                timestamp of entry into this function, for profiling by caller
+        '''
+        t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
+        self.init_profiling ()
+        self.rdm1s = np.zeros ([self.nroots_si,2] + [self.norb,]*2, dtype=self.dtype)
+        self._rdm1s_c = c_arr (self.rdm1s)
+        self._rdm1s_c_ncol = c_int (2*(self.norb**2))
+        self.rdm2s = {}
+        self._crunch_all_()
+        return self.rdm1s, self.rdm2s, t0
+
+    def _add_transpose_(self):
+        if self.hermi:
+            self.rdm1s += self.rdm1s.conj ().transpose (0,1,3,2)
+            rdm2s = dict (self.rdm2s)
+            for (i,j,k,l), d2 in self.rdm2s.items ():
+                d2 = d2.conj ().transpose (0,1,3,2,5,4)
+                if (j,i,l,k) in rdm2s:
+                    rdm2s[(j,i,l,k)] = rdm2s[(j,i,l,k)] + d2
+                else:
+                    rdm2s[(j,i,l,k)] = d2
+            self.rdm2s = rdm2s
+
+    def _put_D2_(self):
+        t0, w0 = logger.process_clock (), logger.perf_counter ()
+        if self._transpose: self.d2[:] = self.d2.transpose (0,1,3,2,5,4).conj ()
+        inv = [i for i in range (self.nfrags) if self.nlas[i]]
+        ranges = [slice (*self.get_range (i)) for i in inv]
+        for key in product (range (len (inv)), repeat=4):
+            d2 = self.d2[(slice (None), slice (None)) + tuple (ranges[i] for i in key)]
+            if not d2.any (): continue
+            key = tuple (inv[i] for i in key)
+            if key in self.rdm2s:
+                self.rdm2s[key] += d2
+            else:
+                self.rdm2s[key] = d2.copy ()
+        dt, dw = logger.process_clock () - t0, logger.perf_counter () - w0
+        self.dt_p, self.dw_p = self.dt_p + dt, self.dw_p + dw
+
+class BlockRDM2s (object):
+    ''' Spin-separated 2-body reduced density matrices of several states in the PySCF
+    convention, stored as the nonzero blocks spanned by quadruples of fragments. Stands in for
+    the dense array of shape (nroots,2,ncas,ncas,2,ncas,ncas), which is only built by todense
+    (or np.asarray).
+
+    Args:
+        nlas : list of length nfrags
+            Number of orbitals in each fragment
+        blocks : dict
+            Keys are tuples (i,j,k,l) of fragment indices, and values are the corresponding
+            blocks of shape (nroots,2,nlas[i],nlas[j],2,nlas[k],nlas[l]). Absent blocks are zero.
+        nroots : integer
+            Number of states
+        dtype : numpy dtype
+    '''
+
+    def __init__(self, nlas, blocks, nroots, dtype=np.float64):
+        self.nlas = list (nlas)
+        self.blocks = blocks
+        self.nroots = nroots
+        self.dtype = np.dtype (dtype)
+        self.offs = np.cumsum ([0,] + self.nlas)
+
+    @property
+    def ncas (self): return self.offs[-1]
+
+    @property
+    def shape (self):
+        ncas = self.ncas
+        return (self.nroots, 2, ncas, ncas, 2, ncas, ncas)
+
+    @property
+    def ndim (self): return 7
+
+    @property
+    def size (self): return sum ([blk.size for blk in self.blocks.values ()])
+
+    def __len__(self): return self.nroots
+
+    def get_range (self, i):
+        return self.offs[i], self.offs[i+1]
+
+    def __getitem__(self, idx):
+        ''' Only indexing the first (state) axis keeps the result compact. Any further indices
+        are applied to the dense array of the selected states. '''
+        rest = ()
+        if isinstance (idx, tuple):
+            idx, rest = idx[0], idx[1:]
+        blocks = {key: blk[idx] for key, blk in self.blocks.items ()}
+        if np.ndim (np.arange (self.nroots)[idx]) == 0:
+            out = np.zeros (self.shape[1:], dtype=self.dtype)
+            for (i,j,k,l), blk in blocks.items ():
+                out[:,slice (*self.get_range (i)),slice (*self.get_range (j)),:,
+                    slice (*self.get_range (k)),slice (*self.get_range (l))] = blk
+            return out[rest]
+        nroots = len (np.arange (self.nroots)[idx])
+        out = BlockRDM2s (self.nlas, blocks, nroots, dtype=self.dtype)
+        if len (rest): out = out.todense ()[(slice (None),) + rest]
+        return out
+
+    def todense (self):
+        out = np.zeros (self.shape, dtype=self.dtype)
+        for (i,j,k,l), blk in self.blocks.items ():
+            out[:,:,slice (*self.get_range (i)),slice (*self.get_range (j)),:,
+                slice (*self.get_range (k)),slice (*self.get_range (l))] = blk
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.todense ()
+        if dtype is not None: out = out.astype (dtype, copy=False)
+        return out
+
+    def einsum (self, subscripts, *operands):
+        ''' Block-by-block equivalent of np.einsum (subscripts, self.todense (), *operands).
+        The first term of subscripts refers to self, and an explicit output ("->") is required.
+        Each axis of the other operands or the output that shares a label with an orbital axis of
+        self is sliced to match each block in turn. '''
+        inp, outlbl = subscripts.replace (' ', '').split ('->')
+        inp = inp.split (',')
+        assert (len (inp) == len (operands) + 1)
+        assert (len (inp[0]) == 7), 'the 2-RDM needs 7 index labels'
+        dims = {}
+        for lbls, arr in zip (inp, (self,) + operands):
+            for lbl, n in zip (lbls, arr.shape): dims[lbl] = n
+        dtype = np.result_type (self.dtype, *operands)
+        out = np.zeros ([dims[lbl] for lbl in outlbl], dtype=dtype)
+        orblbls = [inp[0][x] for x in (2,3,5,6)]
+        for key, blk in self.blocks.items ():
+            ranges = {}
+            for lbl, frag in zip (orblbls, key):
+                r = slice (*self.get_range (frag))
+                if ranges.setdefault (lbl, r) != r: break
+            else:
+                ops = [arr[tuple (ranges.get (lbl, slice (None)) for lbl in lbls)]
+                       for lbls, arr in zip (inp[1:], operands)]
+                dest = tuple (ranges.get (lbl, slice (None)) for lbl in outlbl)
+                out[dest] += np.einsum (subscripts, blk, *ops)
+        if out.ndim == 0: out = out[()]
+        return out
+
 def get_fdm1_maker (las, ci, nelec_frs, si, **kwargs):
     ''' Get a function that can build the 1-fragment reduced density matrix
     in a single rootspace. For unittesting purposes (make_sdm1 in sitools does the same thing)
@@ -635,6 +920,15 @@ def roots_trans_rdm12s (las, ci, nelec_frs, si_bra, si_ket, **kwargs):
         si_ket : ndarray of shape (nroots,nroots_si)
             Contains LASSI eigenvectors for the ket
 
+    Kwargs:
+        compact : logical
+            If True, rdm2s is returned as an instance of :class:`BlockRDM2s`, which stores only
+            the nonzero blocks spanned by quadruples of fragments. Not available for spin-broken
+            LASSI states.
+        ints_cache : instance of :class:`frag.IntsCache`
+            Fragment-local intermediates from previous calls, updated rather than rebuilt for
+            the rootspaces whose CI vectors have not changed
+
     Returns:
         rdm1s : ndarray of shape (nroots_si,2,ncas,ncas)
             Spin-separated 1-body reduced density matrices of LASSI states
@@ -649,6 +943,7 @@ def roots_trans_rdm12s (las, ci, nelec_frs, si_bra, si_ket, **kwargs):
     ncas = las.ncas
     pt_order = kwargs.get ('pt_order', None)
     do_pt_order = kwargs.get ('do_pt_order', None)
+    compact = kwargs.get ('compact', False)
     assert (si_bra.dtype == si_ket.dtype)
     assert (si_bra.shape == si_ket.shape)
     nroots_si = si_ket.shape[-1]
@@ -661,6 +956,8 @@ def roots_trans_rdm12s (las, ci, nelec_frs, si_bra, si_ket, **kwargs):
     # Handle possible SOC
     nelec_rs = [tuple (x) for x in nelec_frs.sum (0)]
     spin_pure = len (set (nelec_rs)) == 1
+    if compact and not spin_pure:
+        raise NotImplementedError ("Compact 2-RDMs of spin-broken LASSI states")
     if not spin_pure: # Engage the ``spinless mapping''
         ci = ci_map2spinless (ci, nlas, nelec_frs)
         ix = spin_shuffle_idx (nlas)
@@ -676,19 +973,24 @@ def roots_trans_rdm12s (las, ci, nelec_frs, si_bra, si_ket, **kwargs):
                                    disc_fr=disc_fr,
                                    _FragTDMInt_class=FragTDMInt,
                                    pt_order=pt_order,
-                                   do_pt_order=do_pt_order)
+                                   do_pt_order=do_pt_order,
+                                   cache=kwargs.get ('ints_cache', None))
     nstates = np.sum (np.prod (lroots, axis=0))
     
     # Memory check
     current_memory = lib.current_memory ()[0]
-    required_memory = dtype.itemsize*nroots_si*(2*(ncas**2)+4*(ncas**4))/1e6
+    if compact: # the size of the nonzero blocks is not known in advance
+        required_memory = dtype.itemsize*nroots_si*2*(ncas**2)/1e6
+    else:
+        required_memory = dtype.itemsize*nroots_si*(2*(ncas**2)+4*(ncas**4))/1e6
     if current_memory + required_memory > max_memory:
         raise MemoryError ("current: {}; required: {}; max: {}".format (
             current_memory, required_memory, max_memory))
 
     # Second pass: upper-triangle
     t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
-    outerprod = LRRDM (ints, nlas, lroots, si_bra, si_ket,
+    _LRRDM_class = LRBRDM if compact else LRRDM
+    outerprod = _LRRDM_class (ints, nlas, lroots, si_bra, si_ket,
                        pt_order=pt_order, do_pt_order=do_pt_order,
                        dtype=dtype, max_memory=max_memory, log=log)
 
@@ -718,6 +1020,11 @@ def roots_trans_rdm12s (las, ci, nelec_frs, si_bra, si_ket, **kwargs):
     # Put rdm1s in PySCF convention: [p,q] -> q'p
     if spin_pure: rdm1s = rdm1s.transpose (0,1,3,2)
     else: rdm1s = rdm1s[:,0].transpose (0,2,1)
+    if compact:
+        for key, d2 in rdm2s.items ():
+            d2 = d2.reshape ((nroots_si, 2, 2) + d2.shape[2:])
+            rdm2s[key] = d2.transpose (0,1,3,4,2,5,6).conj ()
+        return rdm1s, BlockRDM2s (nlas, rdm2s, nroots_si, dtype=dtype)
     rdm2s = rdm2s.reshape (nroots_si, 2, 2, ncas, ncas, ncas, ncas).transpose (0,1,3,4,2,5,6).conj ()
 
     return rdm1s, rdm2s
@@ -736,6 +1043,12 @@ def roots_make_rdm12s (las, ci, nelec_frs, si, **kwargs):
         si : ndarray of shape (nroots,nroots_si)
             Contains LASSI eigenvectors
 
+    Kwargs:
+        compact : logical
+            If True, rdm2s is returned as an instance of :class:`BlockRDM2s`
+        ints_cache : instance of :class:`frag.IntsCache`
+            See roots_trans_rdm12s
+
     Returns:
         rdm1s : ndarray of shape (nroots_si,2,ncas,ncas)
             Spin-separated 1-body reduced density matrices of LASSI states
@@ -744,3 +1057,71 @@ def roots_make_rdm12s (las, ci, nelec_frs, si, **kwargs):
     '''
     return roots_trans_rdm12s (las, ci, nelec_frs, si, si, **kwargs)        
 
+def roots_make_rdm1s_otpd (las, ci, nelec_frs, si, mo_grid, **kwargs):
+    ''' Build spin-separated LASSI 1-body reduced density matrices and the 2-body part of the
+    on-top pair density of LASSI states on a grid, without building the 2-body reduced density
+    matrices in the whole active space
+
+    Args:
+        las : instance of :class:`LASCINoSymm`
+        ci : list of list of ndarrays
+            Contains all CI vectors
+        nelec_frs : ndarray of shape (nfrags,nroots,2)
+            Number of electrons of each spin in each rootspace in each
+            fragment
+        si : ndarray of shape (nroots,nroots_si)
+            Contains LASSI eigenvectors
+        mo_grid : ndarray of shape (nderiv,ngrids,ncas)
+            Values [and first derivatives] of the active orbitals on the grid
+
+    Returns:
+        rdm1s : ndarray of shape (nroots_si,2,ncas,ncas)
+            Spin-separated 1-body reduced density matrices of LASSI states
+        otpd2 : ndarray of shape (nroots_si,nderiv,ngrids)
+            1/2 dm2[p,q,r,s] phi_p phi_q phi_r phi_s [and its first derivatives], where dm2 is
+            the spin-summed 2-body reduced density matrix of each LASSI state
+    '''
+    verbose = kwargs.get ('verbose', las.verbose)
+    smult_fr = kwargs.get ('smult_fr', None)
+    disc_fr = kwargs.get ('disc_fr', None)
+    log = lib.logger.new_logger (las, verbose)
+    nlas = las.ncas_sub
+    ncas = las.ncas
+    pt_order = kwargs.get ('pt_order', None)
+    do_pt_order = kwargs.get ('do_pt_order', None)
+    nroots_si = si.shape[-1]
+    max_memory = getattr (las, 'max_memory', las.mol.max_memory)
+    dtype = si.dtype
+    nelec_rs = [tuple (x) for x in nelec_frs.sum (0)]
+    if len (set (nelec_rs)) != 1:
+        raise NotImplementedError ("On-top pair density of spin-broken LASSI states")
+
+    # First pass: single-fragment intermediates
+    ints, lroots = frag.make_ints (las, ci, nelec_frs, nlas=nlas, smult_fr=smult_fr,
+                                   disc_fr=disc_fr,
+                                   _FragTDMInt_class=FragTDMInt,
+                                   pt_order=pt_order,
+                                   do_pt_order=do_pt_order)
+
+    # Memory check
+    current_memory = lib.current_memory ()[0]
+    required_memory = dtype.itemsize*nroots_si*(2*(ncas**2)+mo_grid[:,:,0].size)/1e6
+    if current_memory + required_memory > max_memory:
+        raise MemoryError ("current: {}; required: {}; max: {}".format (
+            current_memory, required_memory, max_memory))
+
+    # Second pass: upper-triangle
+    t0 = (lib.logger.process_clock (), lib.logger.perf_counter ())
+    outerprod = LROTPD (ints, nlas, lroots, si, si, mo_grid,
+                        pt_order=pt_order, do_pt_order=do_pt_order,
+                        dtype=dtype, max_memory=max_memory, log=log)
+    lib.logger.timer (las, 'LASSI root OTPD second intermediate indexing setup', *t0)
+    rdm1s, otpd2, t0 = outerprod.kernel ()
+    lib.logger.timer (las, 'LASSI root OTPD second intermediate crunching', *t0)
+    if las.verbose >= lib.logger.TIMER_LEVEL:
+        lib.logger.info (las, 'LASSI root OTPD crunching profile:\n%s', outerprod.sprint_profile ())
+
+    # Put rdm1s in PySCF convention: [p,q] -> q'p
+    rdm1s = rdm1s.transpose (0,1,3,2)
+    otpd2 = otpd2.conj ()
+    return rdm1s, otpd2
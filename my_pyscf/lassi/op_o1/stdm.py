@@ -21,6 +21,42 @@ def mask_exc_table (exc, col=0, mask_space=None):
     idx = np.isin (exc[:,col], mask_space)
     return idx
 
+def expand_sig_exc_table (exc, sig_order, sig_off, ltri=False):
+    ''' Expand a table of interactions between rootspace signatures into a table of interactions
+    between rootspaces
+
+    Args:
+        exc : ndarray of ints of shape (nexc, ncol)
+            The first two columns are bra and ket signature indices
+        sig_order : ndarray of ints of shape (nroots,)
+            Rootspace indices sorted by signature
+        sig_off : ndarray of ints of shape (nsig+1,)
+            Offsets of each signature's rootspaces in sig_order
+
+    Kwargs:
+        ltri : logical
+            If True, keep only interactions with bra index >= ket index
+
+    Returns:
+        exc : ndarray of ints of shape (nexc1, ncol)
+            The first two columns are bra and ket rootspace indices
+    '''
+    if len (sig_order) == len (sig_off) - 1:
+        exc = exc.copy ()
+        exc[:,:2] = sig_order[exc[:,:2]]
+    else:
+        nbra = sig_off[exc[:,0]+1] - sig_off[exc[:,0]]
+        nket = sig_off[exc[:,1]+1] - sig_off[exc[:,1]]
+        reps = nbra * nket
+        rows = np.repeat (np.arange (len (exc)), reps)
+        k = np.arange (reps.sum ()) - np.repeat (np.cumsum (reps) - reps, reps)
+        nket = nket[rows]
+        bra = sig_order[sig_off[exc[rows,0]] + (k // nket)]
+        ket = sig_order[sig_off[exc[rows,1]] + (k % nket)]
+        exc = np.append (np.stack ([bra, ket], axis=1), exc[rows,2:], axis=1)
+    if ltri: exc = exc[exc[:,0] >= exc[:,1]]
+    return exc
+
 class LSTDM (object):
     ''' LAS state transition density matrix intermediate 2 - whole-system DMs
         Carry out multiplications such as
@@ -227,44 +263,149 @@ class LSTDM (object):
         Args:
             nelec_frs: ndarray of ints of shape (nfrags, nroots, 2)
                 Number of electrons in each fragment in each space
+            smult_fr: ndarray of ints of shape (nfrags, nroots) or None
+                Spin multiplicity of each fragment in each space
 
         Returns:
             exc: dict with str keys and ndarray-of-int values. Each row of each ndarray is the
                 argument list for 1 call to the LSTDM._crunch_*_ function with the name that
                 corresponds to the key str (_crunch_1d_, _crunch_1s_, etc.).
         '''
+        subtabs = {key: [np.empty ((0,ncol), dtype=int)]
+                   for key, ncol in self.exc_subtable_ncols.items ()}
+        for blk in self.gen_exc_subtables (nelec_frs, smult_fr):
+            for key, val in blk.items ():
+                subtabs[key].append (val)
+        for key, val in subtabs.items ():
+            val = np.concatenate (val, axis=0)
+            ix = np.lexsort ((val[:,1], val[:,0]))
+            subtabs[key] = val[ix]
+
         exc = {}
-        exc['null'] = np.empty ((0,2), dtype=int)
-        exc['1d'] = np.empty ((0,3), dtype=int)
+        nfrags = self.nfrags
+
+        # Zero-electron interactions
+        exc['null'] = subtabs['null']
+
+        # One-density interactions
+        fragrng = np.arange (nfrags, dtype=int)
+        exc['1d'] = np.append (np.repeat (exc['null'], nfrags, axis=0),
+                               np.tile (fragrng, len (exc['null']))[:,None],
+                               axis=1)
+
+        # Two-density interactions
         exc['2d'] = np.empty ((0,4), dtype=int)
-        exc['1c'] = np.empty ((0,5), dtype=int)
+        if nfrags > 1:
+            fragrng = np.stack (np.tril_indices (nfrags, k=-1), axis=1)
+            exc['2d'] = np.append (np.repeat (exc['null'], len (fragrng), axis=0),
+                                   np.tile (fragrng, (len (exc['null']), 1)),
+                                   axis=1)
+
+        # One-electron interactions
+        exc['1c'] = subtabs['1c']
+
+        # One-electron, one-density interactions
         exc['1c1d'] = np.empty ((0,6), dtype=int)
-        exc['1s'] = np.empty ((0,4), dtype=int)
-        exc['1s1c'] = np.empty ((0,5), dtype=int)
-        exc['1s1c_T'] = np.empty ((0,5), dtype=int)
-        exc['2c'] = np.empty ((0,7), dtype=int)
+        if nfrags > 2:
+            fragrng = np.arange (nfrags, dtype=int)
+            exc['1c1d'] = np.append (np.repeat (exc['1c'], nfrags, axis=0),
+                                     np.tile (fragrng, len (exc['1c']))[:,None],
+                                     axis=1)
+            invalid = ((exc['1c1d'][:,2] == exc['1c1d'][:,5])
+                       | (exc['1c1d'][:,3] == exc['1c1d'][:,5]))
+            exc['1c1d'] = exc['1c1d'][~invalid,:][:,[0,1,2,3,5,4]]
+
+        # Spin-flip interactions; 1s1c and 1s1c_T combined with spin argument
+        exc['1s'] = subtabs['1s']
+        exc['1s1c'] = exc['1s1c_T'] = np.empty ((0,5), dtype=int)
+        if nfrags > 2:
+            exc['1s1c'] = np.append (subtabs['1s1c'], subtabs['1s1c_T'], axis=0)
+
+        # Combine "pair", "split", "coalesce", and "scatter" into "2c"
+        exc['2c'] = np.concatenate ([subtabs['2c_pair'], subtabs['2c_split'],
+                                     subtabs['2c_coalesce'], subtabs['2c_scatter']], axis=0)
+
+        return exc
+
+    exc_subtable_ncols = {'null': 2, '1c': 5, '1s': 4, '1s1c': 6, '1s1c_T': 6, '2c_pair': 7,
+                          '2c_split': 7, '2c_coalesce': 7, '2c_scatter': 7}
+
+    def gen_exc_subtables (self, nelec_frs, smult_fr):
+        ''' Generate the interactions among rootspaces in chunks, classified by type.
+
+        Rootspaces are bucketed by their signature (the number of electrons of each spin and the
+        spin multiplicity of each fragment), and the Slater-Condon rules are evaluated only once
+        for each pair of signatures sharing the same total number of electrons of each spin. The
+        signature pairs are processed in blocks of bra signatures sized to fit in max_memory, and
+        the classified signature pairs are expanded into rootspace pairs.
+
+        Args:
+            nelec_frs: ndarray of ints of shape (nfrags, nroots, 2)
+                Number of electrons in each fragment in each space
+            smult_fr: ndarray of ints of shape (nfrags, nroots) or None
+                Spin multiplicity of each fragment in each space
+
+        Yields:
+            subtabs: dict with str keys and ndarray-of-int values. The keys are those of
+                exc_subtable_ncols. The rows of each ndarray are not sorted.
+        '''
+        nfrags, nroots = nelec_frs.shape[:2]
+        sig_r = nelec_frs.transpose (1,0,2).reshape (nroots, nfrags*2)
+        if smult_fr is not None:
+            sig_r = np.append (sig_r, np.asarray (smult_fr).T, axis=1)
+        usig, inv = np.unique (sig_r, axis=0, return_inverse=True)
+        inv = np.ravel (inv)
+        nsig = len (usig)
+        unelec_rfs = usig[:,:nfrags*2].reshape (nsig, nfrags, 2)
+        usmult_rf = None if smult_fr is None else usig[:,nfrags*2:]
+        sig_order = np.argsort (inv, kind='stable')
+        sig_off = np.append ([0], np.cumsum (np.bincount (inv, minlength=nsig)))
+        rmin = sig_order[sig_off[:-1]]
+        rmax = sig_order[sig_off[1:]-1]
+
+        # Only signatures with the same total numbers of electrons of each spin can interact
+        usector, sector = np.unique (unelec_rfs.sum (1), axis=0, return_inverse=True)
+        sector = np.ravel (sector)
+        rem_mem = max (self.max_memory - lib.current_memory ()[0], 0)
+        for isector in range (len (usector)):
+            sigs = np.where (sector == isector)[0]
+            # ~8 arrays of shape (nexc,nfrags,2) in _classify_exc_
+            blksize = int (rem_mem * 1e6 / (8 * 8 * 2 * nfrags * len (sigs)))
+            blksize = max (1, blksize)
+            for i in range (0, len (sigs), blksize):
+                bra = sigs[i:i+blksize]
+                if usmult_rf is None:
+                    scai = get_scallowed_interactions_blk (unelec_rfs[bra], unelec_rfs[sigs])
+                else:
+                    scai = get_scallowed_interactions_blk (unelec_rfs[bra], unelec_rfs[sigs],
+                                                           smult_rf_bra=usmult_rf[bra],
+                                                           smult_rf_ket=usmult_rf[sigs])
+                scai = np.stack ([bra[scai[:,0]], sigs[scai[:,1]]], axis=1)
+                if self.ltri:
+                    scai = scai[rmax[scai[:,0]] >= rmin[scai[:,1]]]
+                hopping_index = unelec_rfs[scai[:,0]] - unelec_rfs[scai[:,1]]
+                subtabs = self._classify_exc_(scai, hopping_index)
+                yield {key: expand_sig_exc_table (val, sig_order, sig_off, ltri=self.ltri)
+                       for key, val in subtabs.items ()}
+
+    def _classify_exc_(self, scai, hopping_index):
+        ''' Sort interactions into the subtables of gen_exc_subtables
+
+        Args:
+            scai: ndarray of ints of shape (nexc,2)
+                Bra and ket indices
+            hopping_index: ndarray of ints of shape (nexc,nfrags,2)
+                Change in the number of electrons of each spin in each fragment
+
+        Returns:
+            subtabs: dict with str keys and ndarray-of-int values
+        '''
         nfrags = self.nfrags
-        scai = get_scallowed_interactions (nelec_frs, smult_fr=smult_fr,
-                                           max_memory=self.max_memory)
-
-        if self.ltri:
-            tril_index = scai[:,0] >= scai[:,1]
-            scai = scai[tril_index]
-
-        nelec_rfs = nelec_frs.transpose (1,0,2)
-        nexc = scai.shape[0]
-        rem_mem = self.max_memory - lib.current_memory ()[0]
-        reqd_mem = 3 * nexc * nfrags * 2 * nelec_rfs.dtype.itemsize / 1e6
-        if reqd_mem > rem_mem:
-            raise MemoryError (('Inadequate memory to make_exc_tables: for {} interactions, {} MB'
-                                'required of {} MB available ({} MB total)').format (
-                               nexc, reqd_mem, rem_mem, self.max_memory))
-        hopping_index = nelec_rfs[scai[:,0]] - nelec_rfs[scai[:,1]]
+        subtabs = {key: np.empty ((0,ncol), dtype=int)
+                   for key, ncol in self.exc_subtable_ncols.items ()}
 
         # Process connectivity data to quickly distinguish interactions
 
-        # Should probably be all == true anyway if I call this by symmetry blocks
-
         # Number of field operators involved in a given interaction
         nsop = np.abs (hopping_index).sum (1) # 0,0 , 2,0 , 0,2 , 2,2 , 4,0 , 0,4
         nop = nsop.sum (1) # 0, 2, 4
@@ -297,104 +438,53 @@ class LSTDM (object):
         # fragment index lists thus specified to identify the source and destination
         # fragments of the charge or spin units that are transferred in that interaction,
         # and store those fragment indices along with the state indices.
+        def _tab (idx, fcols, *extra):
+            f = findf[idx]
+            return np.concatenate ([scai[idx],] + [f[:,fcols],] + [e[idx,None] for e in extra],
+                                   axis=1)
 
         # Zero-electron interactions
-        idx = (nop==0)
-        exc['null'] = scai[idx]
-
-        # One-density interactions
-        fragrng = np.arange (nfrags, dtype=int)
-        exc['1d'] = np.append (np.repeat (exc['null'], nfrags, axis=0),
-                               np.tile (fragrng, len (exc['null']))[:,None],
-                               axis=1)
-
-        # Two-density interactions
-        if nfrags > 1:
-            fragrng = np.stack (np.tril_indices (nfrags, k=-1), axis=1)
-            exc['2d'] = np.append (np.repeat (exc['null'], len (fragrng), axis=0),
-                                   np.tile (fragrng, (len (exc['null']), 1)),
-                                   axis=1)
+        subtabs['null'] = scai[nop==0]
 
         # One-electron interactions
         idx = nop == 2
-        if nfrags > 1: exc['1c'] = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0], ispin[idx]]
-        ).T
-
-        # One-electron, one-density interactions
-        if nfrags > 2:
-            fragrng = np.arange (nfrags, dtype=int)
-            exc['1c1d'] = np.append (np.repeat (exc['1c'], nfrags, axis=0),
-                                     np.tile (fragrng, len (exc['1c']))[:,None],
-                                     axis=1)
-            invalid = ((exc['1c1d'][:,2] == exc['1c1d'][:,5])
-                       | (exc['1c1d'][:,3] == exc['1c1d'][:,5]))
-            exc['1c1d'] = exc['1c1d'][~invalid,:][:,[0,1,2,3,5,4]]
+        if nfrags > 1: subtabs['1c'] = _tab (idx, [-1,0], ispin)
 
         # Unsymmetric two-electron interactions
         idx_2e = (nop == 4)
-
-        # Two-electron interaction: ii -> jk ("split").
-        idx = idx_2e & (ncharge_index == 3) & (np.amin (charge_index, axis=1) == -2)
-        if nfrags > 2: exc_split = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0], findf[idx][:,-2], findf[idx][:,0],
-            ispin[idx]]
-        ).T
-
-        # Two-electron interaction: ij -> kk ("coalesce")
-        idx = idx_2e & (ncharge_index == 3) & (np.amax (charge_index, axis=1) == 2)
-        if nfrags > 2: exc_coalesce = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0], findf[idx][:,-1], findf[idx][:,1],
-            ispin[idx]]
-        ).T
-
-        if nfrags > 2: exc_split = np.append (exc_split, exc_coalesce, axis=0)
-
-        # Two-electron interaction: k(a)j(b) -> i(a)k(b) ("1s1c") (spin arg = 0)
-        idx = idx_2e & (nspin_index==3) & (ncharge_index==2) & (np.amin(spin_index,axis=1)==-2)
-        if nfrags > 2: exc['1s1c'] = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,1], findf[idx][:,0]]
-        ).T
-
-        # Two-electron interaction: k(b)j(a) -> i(b)k(a) ("1s1c_T") (spin arg = 1)
-        idx = idx_2e & (nspin_index==3) & (ncharge_index==2) & (np.amax(spin_index,axis=1)==2)
-        if nfrags > 2: exc_1s1cT = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-2], findf[idx][:,0], findf[idx][:,-1]]
-        ).T
-
-        # Combine 1s1c and 1s1c_T with spin argument
         if nfrags > 2:
-            exc['1s1c'] = np.append (
-                np.pad (exc['1s1c'], ((0,0),(0,1)), constant_values=0),
-                np.pad (exc_1s1cT,   ((0,0),(0,1)), constant_values=1),
-                axis=0)
-
-        # Two-electron interaction: i(a)j(b) -> j(a)i(b) ("1s") 
-        idx = idx_2e & (ncharge_index == 0) & (nspin_index == 2)
-        if nfrags > 1: exc['1s'] = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0]]
-        ).T
-
-        # Two-electron interaction: ii -> jj ("pair") 
-        idx = idx_2e & (ncharge_index == 2) & (nspin_index < 3)
-        if nfrags > 1: exc_pair = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0], findf[idx][:,-1], findf[idx][:,0],
-            ispin[idx]]
-        ).T
+            # Two-electron interaction: ii -> jk ("split").
+            idx = idx_2e & (ncharge_index == 3) & (np.amin (charge_index, axis=1) == -2)
+            subtabs['2c_split'] = _tab (idx, [-1,0,-2,0], ispin)
 
-        # Two-electron interaction: ij -> kl ("scatter")
-        idx = idx_2e & (ncharge_index == 4)
-        if nfrags > 3: exc_scatter = np.vstack (
-            [scai[idx,0], scai[idx,1], findf[idx][:,-1], findf[idx][:,0], findf[idx][:,-2], findf[idx][:,1], 
-            ispin[idx]]
-        ).T
+            # Two-electron interaction: ij -> kk ("coalesce")
+            idx = idx_2e & (ncharge_index == 3) & (np.amax (charge_index, axis=1) == 2)
+            subtabs['2c_coalesce'] = _tab (idx, [-1,0,-1,1], ispin)
 
-        # Combine "split", "pair", and "scatter" into "2c"
-        if nfrags > 1: exc['2c'] = exc_pair
-        if nfrags > 2: exc['2c'] = np.vstack ((exc['2c'], exc_split))
-        if nfrags > 3: exc['2c'] = np.vstack ((exc['2c'], exc_scatter))
+            # Two-electron interaction: k(a)j(b) -> i(a)k(b) ("1s1c") (spin arg = 0)
+            idx_1s1c = idx_2e & (nspin_index==3) & (ncharge_index==2)
+            idx = idx_1s1c & (np.amin (spin_index, axis=1) == -2)
+            subtabs['1s1c'] = _tab (idx, [-1,1,0], np.zeros_like (ispin))
 
-        return exc
+            # Two-electron interaction: k(b)j(a) -> i(b)k(a) ("1s1c_T") (spin arg = 1)
+            idx = idx_1s1c & (np.amax (spin_index, axis=1) == 2)
+            subtabs['1s1c_T'] = _tab (idx, [-2,0,-1], np.ones_like (ispin))
+
+        if nfrags > 1:
+            # Two-electron interaction: i(a)j(b) -> j(a)i(b) ("1s")
+            idx = idx_2e & (ncharge_index == 0) & (nspin_index == 2)
+            subtabs['1s'] = _tab (idx, [-1,0])
+
+            # Two-electron interaction: ii -> jj ("pair")
+            idx = idx_2e & (ncharge_index == 2) & (nspin_index < 3)
+            subtabs['2c_pair'] = _tab (idx, [-1,0,-1,0], ispin)
+
+        # Two-electron interaction: ij -> kl ("scatter")
+        if nfrags > 3:
+            idx = idx_2e & (ncharge_index == 4)
+            subtabs['2c_scatter'] = _tab (idx, [-1,0,-2,1], ispin)
+
+        return subtabs
 
     ltri = True
     interaction_has_spin = ('_1c_', '_1c1d_', '_1s1c_', '_2c_')
@@ -9,6 +9,7 @@ liblassi = load_library ('liblassi')
 def c_arr (arr): return arr.ctypes.data_as(ctypes.c_void_p)
 c_int = ctypes.c_int
 c_long = ctypes.c_long
+liblassi.SCcntinter.restype = liblassi.SCcntinterspin.restype = c_long
 
 def fermion_spin_shuffle (na_list, nb_list):
     ''' Compute the sign factor corresponding to the convention
@@ -164,6 +165,47 @@ def _get_scallowed_interactions_smult (nelec_frs, smult_fr, max_memory=None):
     ix = np.lexsort ((exc[:,1], exc[:,0]))
     return exc[ix]
 
+def get_scallowed_interactions_blk (nelec_rfs_bra, nelec_rfs_ket, smult_rf_bra=None,
+                                    smult_rf_ket=None):
+    ''' List the pairs of a block of bra rootspaces and a block of ket rootspaces which can be
+        coupled by the Hamiltonian
+
+        Args:
+            nelec_rfs_bra : ndarray of shape (nroots_bra,nfrags,2)
+                Number of electrons of each spin in each fragment in each bra rootspace
+            nelec_rfs_ket : ndarray of shape (nroots_ket,nfrags,2)
+                Number of electrons of each spin in each fragment in each ket rootspace
+
+        Kwargs:
+            smult_rf_bra : ndarray of shape (nroots_bra,nfrags)
+                Spin multiplicity of each fragment in each bra rootspace
+            smult_rf_ket : ndarray of shape (nroots_ket,nfrags)
+                Spin multiplicity of each fragment in each ket rootspace
+
+        Returns:
+            exc : ndarray of shape (nexc,2)
+                Indices of the coupled bra and ket rootspaces within their respective blocks,
+                sorted by bra and then by ket
+    '''
+    nroots_bra, nfrags = nelec_rfs_bra.shape[:2]
+    nroots_ket = nelec_rfs_ket.shape[0]
+    if nroots_bra == 0 or nroots_ket == 0: return np.zeros ((0,2), dtype=np.int_)
+    nelec_rfs_bra = np.ascontiguousarray (nelec_rfs_bra, dtype=np.intc)
+    nelec_rfs_ket = np.ascontiguousarray (nelec_rfs_ket, dtype=np.intc)
+    args = [c_arr (nelec_rfs_bra), c_arr (nelec_rfs_ket)]
+    cnt, lst = liblassi.SCcntinter, liblassi.SClistinter
+    if smult_rf_bra is not None:
+        smult_rf_bra = np.ascontiguousarray (smult_rf_bra, dtype=np.intc)
+        smult_rf_ket = np.ascontiguousarray (smult_rf_ket, dtype=np.intc)
+        args += [c_arr (smult_rf_bra), c_arr (smult_rf_ket)]
+        cnt, lst = liblassi.SCcntinterspin, liblassi.SClistinterspin
+    dims = [c_long (nroots_bra), c_long (nroots_ket), c_int (nfrags)]
+    nexc = cnt (*args, *dims)
+    exc = -1*np.ones ((nexc,2), dtype=np.int_)
+    lst (c_arr (exc), *args, c_long (nexc), *dims)
+    ix = np.lexsort ((exc[:,1], exc[:,0]))
+    return exc[ix]
+
 def get_contig_blks (mask):
     '''Get contiguous chunks from a mask index into an array'''
     mask = np.ravel (mask)
@@ -1,9 +1,11 @@
 import numpy as np
 import time
+import hashlib
 from scipy import linalg
 from mrh.my_pyscf.lassi import op_o0
 from mrh.my_pyscf.lassi import op_o1
 from mrh.my_pyscf.lassi import basis
+from mrh.my_pyscf.lassi import chkfile as lassi_chkfile
 from mrh.my_pyscf.lassi.citools import get_lroots
 from pyscf import lib 
 from pyscf.lib import param, logger
@@ -19,6 +21,9 @@ NROOTS = getattr (__config__, 'lassi_nroots_si', 1)
 DAVIDSON_SCREEN_THRESH = getattr (__config__, 'lassi_hsi_screen_thresh', 1e-12)
 PSPACE_SIZE = getattr (__config__, 'lassi_hsi_pspace_size', 400)
 PRIVREF = getattr (__config__, 'lassi_privref', True)
+GROUP_NTHREADS = getattr (__config__, 'lassi_hsi_group_nthreads', 1)
+ORTH_CACHE = getattr (__config__, 'lassi_orth_cache', True)
+INTS_CACHE = getattr (__config__, 'lassi_ints_cache', False)
 
 op = (op_o0, op_o1)
 
@@ -113,6 +118,23 @@ class SISolver (lib.StreamObject):
         smult : int or None
             Spin-multiplicity of the desired roots when diagonalizing iteratively. If
             unset, the lowest-energy roots are sought regardless of spin.
+        group_nthreads : int
+            When diagonalizing iteratively with opt=1, the number of Python threads among
+            which groups of operator terms are divided in the matrix-vector product
+        orth_cache : instance of basis.OrthCache or None
+            Orthogonalization matrices of rootspace manifolds, reused in subsequent calls
+            if the CI vectors of a manifold have not changed. Set to None to disable.
+        ints_cache : instance of op_o1.frag.IntsCache or None
+            Fragment-local intermediates of opt=1, kept between calls and updated only for the
+            rootspaces whose CI vectors have changed. The CI vectors must not be modified in
+            place between calls. None (default) disables the cache.
+        chkfile : str or None
+            If set, when diagonalizing iteratively, the orthogonalization matrices, the pspace
+            eigenvectors and the current SI vectors of each iteration are saved to this HDF5
+            file as they are computed
+        restart : logical
+            If True, when diagonalizing iteratively, pick up from whatever chkfile contains for
+            the same Hamiltonian, CI vectors and settings, instead of recomputing it
     '''
 
     def __init__(self, las, soc=0, opt=1, davidson_only=False, nroots=NROOTS,
@@ -131,12 +153,20 @@ class SISolver (lib.StreamObject):
         self.conv_tol = CONV_TOL
         self.nroots = nroots
         self.smult = None
+        self.group_nthreads = GROUP_NTHREADS
+        self.orth_cache = basis.OrthCache () if ORTH_CACHE else None
+        self.ints_cache = op_o1.frag.IntsCache () if INTS_CACHE else None
+        self.chkfile = None
+        self.restart = False
         self.converged = False
         self._keys = set((self.__dict__.keys()))
 
     kernel = kernel
     get_init_guess = get_init_guess
 
+    def get_block_key (self, h1, h2, ci_fr, nelec_frs, smult_fr, disc_fr, soc, opt):
+        return get_block_key (self, h1, h2, ci_fr, nelec_frs, smult_fr, disc_fr, soc, opt)
+
     def dump_flags (self, verbose=None):
         if verbose is None: verbose = self.verbose
         log = logger.new_logger(self, verbose)
@@ -152,6 +182,30 @@ class SISolver (lib.StreamObject):
         log.info('spin multiplicity = %s', self.smult)
         log.info('privref = %s', self.privref)
         log.info('davidson_screen_thresh = %g', self.davidson_screen_thresh)
+        log.info('group_nthreads = %d', self.group_nthreads)
+        if self.chkfile:
+            log.info('chkfile = %s', self.chkfile)
+            log.info('restart = %s', self.restart)
+
+def get_block_key (sisolver, h1, h2, ci_fr, nelec_frs, smult_fr, disc_fr, soc, opt):
+    '''Fingerprint of the model-space eigenproblem of one symmetry block, which identifies its
+    intermediates in sisolver.chkfile'''
+    settings = (soc, opt, getattr (sisolver, 'smult', None),
+                getattr (sisolver, 'pspace_size', PSPACE_SIZE),
+                getattr (sisolver, 'privref', PRIVREF),
+                getattr (sisolver, 'davidson_screen_thresh', DAVIDSON_SCREEN_THRESH))
+    fprint = hashlib.sha1 (repr (settings).encode ())
+    for x in (h1, h2, nelec_frs, smult_fr, disc_fr):
+        if x is None: continue
+        x = np.ascontiguousarray (x)
+        fprint.update (repr ((x.shape, x.dtype.str)).encode ())
+        fprint.update (x.data)
+    for ci_r in ci_fr:
+        for ci in ci_r:
+            ci = np.ascontiguousarray (ci)
+            fprint.update (repr ((ci.shape, ci.dtype.str)).encode ())
+            fprint.update (ci.data)
+    return fprint.hexdigest ()
 
 def kernel_Davidson (sisolver, e0, h1, h2, norb_f, ci_fr, nelec_frs, smult_fr, disc_fr, soc,
                          opt):
@@ -173,20 +227,34 @@ def kernel_Davidson (sisolver, e0, h1, h2, norb_f, ci_fr, nelec_frs, smult_fr, d
     screen_thresh = getattr (sisolver, 'davidson_screen_thresh', DAVIDSON_SCREEN_THRESH)
     pspace_size = getattr (sisolver, 'pspace_size', PSPACE_SIZE)
     smult = getattr (sisolver, 'smult', None)
+    group_nthreads = getattr (sisolver, 'group_nthreads', GROUP_NTHREADS)
+    chkfile = getattr (sisolver, 'chkfile', None)
+    chkdata = {}
+    if chkfile:
+        chkkey = get_block_key (sisolver, h1, h2, ci_fr, nelec_frs, smult_fr, disc_fr, soc, opt)
+        if getattr (sisolver, 'restart', False):
+            chkdata = lassi_chkfile.load_sisolver_chk (sisolver, chkkey, chkfile=chkfile)
+            if len (chkdata):
+                log.info ('LASSI restarting from intermediates %s in %s', list (chkdata.keys ()),
+                          chkfile)
     h_op_raw, s2_op, ovlp_op, hdiag_raw, _get_ovlp = op[opt].gen_contract_op_si_hdiag (
         sisolver.las, h1, h2, ci_fr, nelec_frs, smult_fr=smult_fr, soc=soc, disc_fr=disc_fr,
-        screen_thresh=screen_thresh
+        screen_thresh=screen_thresh, group_nthreads=group_nthreads,
+        ints_cache=getattr (sisolver, 'ints_cache', None)
     )
     if verbose >= logger.DEBUG:
         # The sort is slow
         log.debug ("fingerprint of hdiag raw: %15.10e", lib.fp (np.sort (hdiag_raw)))
     t0 = (logger.process_clock (), logger.perf_counter ())
     raw2orth = basis.get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=_get_ovlp,
-                                     smult_fr=smult_fr, smult_si=smult, disc_fr=disc_fr)
+                                     smult_fr=smult_fr, smult_si=smult, disc_fr=disc_fr,
+                                     cache=getattr (sisolver, 'orth_cache', None))
     raw2orth.log_debug1_hdiag_raw (log, hdiag_raw)
     orth2raw = raw2orth.H
     mem_orth = raw2orth.get_nbytes () / 1e6
     t0 = log.timer ('LASSI get orthogonal basis ({:.2f} MB)'.format (mem_orth), *t0)
+    if chkfile:
+        lassi_chkfile.dump_sisolver_chk (sisolver, chkkey, chkfile=chkfile, orth_cache=True)
     hdiag_orth = op[opt].get_hdiag_orth (hdiag_raw, h_op_raw, raw2orth)
     if verbose >= logger.DEBUG:
         # The sort is slow
@@ -203,10 +271,16 @@ def kernel_Davidson (sisolver, e0, h1, h2, norb_f, ci_fr, nelec_frs, smult_fr, d
                 penvalue = above - below + 0.001
                 log.debug ("Hdiag penalty value: %17.10e", penvalue)
                 hdiag_penalty[i:] = penvalue
-    if pspace_size:
+    if pspace_size and 'pspace_addr' in chkdata:
+        pw, pv, addr = chkdata['pspace_pw'], chkdata['pspace_pv'], chkdata['pspace_addr']
+    elif pspace_size:
         pw, pv, addr = pspace (hdiag_orth, h_op_raw, raw2orth, opt, pspace_size, log=log,
                                penalty=hdiag_penalty)
         t0 = log.timer ('LASSI make pspace Hamiltonian', *t0)
+        if chkfile:
+            lassi_chkfile.dump_sisolver_chk (sisolver, chkkey, chkfile=chkfile, pspace_pw=pw,
+                                             pspace_pv=pv, pspace_addr=addr)
+    if pspace_size:
         if pspace_size >= hdiag_orth.size:
             pv = pv[:,:nroots]
             pw = pw[:nroots]
@@ -216,23 +290,35 @@ def kernel_Davidson (sisolver, e0, h1, h2, norb_f, ci_fr, nelec_frs, smult_fr, d
         precond_op = make_pspace_precond (hdiag_orth, pw, pv, addr, level_shift=level_shift)
     else:
         precond_op = lib.make_diag_precond (hdiag_orth, level_shift=level_shift)
-    if si0 is not None:
+    if 'x' in chkdata and chkdata['x'].shape[-1] == hdiag_orth.size:
+        x0 = chkdata['x'].T
+    elif si0 is not None:
         x0 = raw2orth (ovlp_op (si0))
     else:
         x0 = None
     x0 = sisolver.get_init_guess (hdiag_orth, nroots, x0, log=log, penalty=hdiag_penalty)
-    def h_op (x):
-        return raw2orth (h_op_raw (orth2raw (x)))
+    def h_op (xs):
+        # Apply the Hamiltonian to all of the trial vectors at once
+        xs = orth2raw (np.stack (xs, axis=-1))
+        hxs = raw2orth (h_op_raw.matmat (xs))
+        return list (np.ascontiguousarray (hxs.T))
     log.info ("LASSI E(const) = %15.10f", e0)
+    callback = None
+    if chkfile:
+        def callback (envs):
+            lassi_chkfile.dump_sisolver_chk (sisolver, chkkey, chkfile=chkfile,
+                                             x=np.stack (envs['x0'], axis=0))
     print ("right before davidson", nroots, flush=True)
-    conv, e, x1 = lib.davidson1 (lambda xs: [h_op (x) for x in xs],
-                                 x0, precond_op, nroots=nroots,
+    conv, e, x1 = lib.davidson1 (h_op, x0, precond_op, nroots=nroots,
                                  verbose=davidson_log, max_cycle=max_cycle,
-                                 max_space=max_space, tol=conv_tol)
+                                 max_space=max_space, tol=conv_tol, callback=callback)
     conv = all (conv)
+    if chkfile:
+        lassi_chkfile.dump_sisolver_chk (sisolver, chkkey, chkfile=chkfile,
+                                         x=np.stack (x1, axis=0))
     if not conv: log.warn ('LASSI Davidson diagonalization not converged')
-    si1 = np.stack ([orth2raw (x) for x in x1], axis=-1)
-    s2 = np.array ([np.dot (x.conj (), s2_op (x)) for x in si1.T])
+    si1 = orth2raw (np.stack (x1, axis=-1))
+    s2 = lib.einsum ('ij,ij->j', si1.conj (), s2_op.matmat (si1))
     return conv, e, si1, s2
 
 def pspace (hdiag_orth, h_op_raw, raw2orth, opt, pspace_size, log=None, penalty=None):
@@ -303,7 +389,8 @@ def kernel_incore (sisolver, e0, h1, h2, norb_f, ci_fr, nelec_frs, smult_fr, soc
 
     # Error catch: linear dependencies in basis
     raw2orth = basis.get_orth_basis (ci_fr, norb_f, nelec_frs, _get_ovlp=_get_ovlp,
-                                     smult_fr=smult_fr)
+                                     smult_fr=smult_fr,
+                                     cache=getattr (sisolver, 'orth_cache', None))
     xhx = raw2orth (ham_blk.T).T
     logger.info (sisolver, '%d/%d linearly independent model states',
                      xhx.shape[1], xhx.shape[0])
@@ -16,10 +16,13 @@ def weighted_average_densities(mc):
 	Compute the weighted average 1- and 2-electron LAS densities
 	in the selected modal space
 	"""
-    casdm1s = [mc.make_one_casdm1s(mc.ci, state=state) for state in mc.statlis]
-    casdm2 = [mc.make_one_casdm2(mc.ci, state=state) for state in mc.statlis]
-    weights = [1 / len(mc.statlis), ] * len(mc.statlis)
-    return (np.tensordot(weights, casdm1s, axes=1)), (np.tensordot(weights, casdm2, axes=1))
+    # Accumulate one state at a time instead of stacking all states' densities in memory
+    weight = 1 / len(mc.statlis)
+    casdm1s = casdm2 = 0
+    for state in mc.statlis:
+        casdm1s = casdm1s + weight * mc.make_one_casdm1s(mc.ci, state=state)
+        casdm2 = casdm2 + weight * mc.make_one_casdm2(mc.ci, state=state)
+    return casdm1s, casdm2
 
 
 # Importing functions from the PySCF-forge
@@ -1,4 +1,4 @@
-from pyscf import ao2mo, lib
+from pyscf import ao2mo, lib, __config__
 from pyscf.mcscf.addons import StateAverageMCSCFSolver
 import numpy as np
 from mrh.my_pyscf.lassi import lassi
@@ -6,6 +6,9 @@ import h5py
 import tempfile
 from pyscf.mcpdft.otfnal import transfnal, get_transfnal
 from pyscf.mcpdft.mcpdft import _get_e_decomp
+from pyscf.mcpdft import _dms
+from pyscf.mcpdft.otpd import _grid_ao2mo
+from mrh.my_pyscf.lassi.op_o1.rdm import dm2_on_grid
 
 try:
     from pyscf.mcpdft.mcpdft import _PDFT, _mcscf_env
@@ -14,6 +17,8 @@ except ImportError:
           "pyscf-forge can be found at : https://github.com/pyscf/pyscf-forge"
     raise ImportError(msg)
 
+OTPD_DIRECT = getattr(__config__, 'mcpdft_laspdft_otpd_direct', False)
+
 
 def make_casdm1s(filename, i):
     """
@@ -37,6 +42,295 @@ def make_casdm2s(filename, i):
     return rdm2s
 
 
+def make_otpd2(filename, i):
+    """
+    This function reads the 2-body part of the on-top pair density of the given state 'i'
+    from a tempfile
+    """
+    with h5py.File(filename, 'r') as f:
+        otpd2 = f[f'otpd2_{i}'][:]
+        otpd2 = np.array(otpd2)
+    return otpd2
+
+
+def get_mo_grid(ot, mo_cas, max_memory=2000):
+    """
+    Values [and first derivatives, if ot.Pi_deriv] of the active orbitals on the grid of ot, in
+    the order of ot._numint.block_loop
+
+    Returns:
+        mo_grid : ndarray of shape (nderiv, ngrids, ncas)
+    """
+    ni = ot._numint
+    nao = mo_cas.shape[0]
+    nderiv = (1, 4)[ot.Pi_deriv]
+    mo_grid = []
+    for ao, mask, weight, _ in ni.block_loop(ot.mol, ot.grids, nao, ot.dens_deriv, max_memory):
+        if ao.ndim == 2:
+            ao = ao[None, :, :]
+        mo_grid.append(_grid_ao2mo(ot.mol, ao[:nderiv], mo_cas, non0tab=mask))
+    return np.concatenate(mo_grid, axis=1)
+
+
+def _rho_product(rho, deriv):
+    """
+    rho[0]*rho[1] [and its first derivatives] for rho of shape (2, *, ngrids)
+    """
+    Pi = np.empty(((1, 4)[deriv], rho.shape[-1]), dtype=rho.dtype)
+    Pi[0] = rho[0, 0] * rho[1, 0]
+    for ideriv in range(1, Pi.shape[0]):
+        Pi[ideriv] = rho[0, ideriv] * rho[1, 0] + rho[0, 0] * rho[1, ideriv]
+    return Pi
+
+
+def energy_ot_direct(ot, casdm1s, otpd2, mo_coeff, ncore, max_memory=2000, hermi=1):
+    """
+    On-top energy from the 1-RDMs and the 2-body part of the on-top pair density on the grid,
+
+    Pi(r) = rho[0](r)*rho[1](r) - rho_cas[0](r)*rho_cas[1](r) + otpd2(r),
+
+    where otpd2 = 1/2 dm2[p,q,r,s] phi_p phi_q phi_r phi_s [and its first derivatives] as
+    returned by lassi.root_make_rdm1s_otpd. This gives the same result as ot.energy_ot
+    without the 2-RDM.
+    """
+    E_ot = 0.0
+    ni, xctype = ot._numint, ot.xctype
+    if xctype == 'HF': return E_ot
+    dens_deriv = ot.dens_deriv
+    Pi_deriv = ot.Pi_deriv
+
+    nao = mo_coeff.shape[0]
+    ncas = casdm1s.shape[-1]
+    dm1s = _dms.casdm1s_to_dm1s(ot, casdm1s, mo_coeff=mo_coeff, ncore=ncore, ncas=ncas)
+    mo_cas = mo_coeff[:, ncore:][:, :ncas]
+    dm1s_cas = np.stack([mo_cas @ casdm1s[i] @ mo_cas.conj().T for i in range(2)], axis=0)
+
+    t0 = (lib.logger.process_clock(), lib.logger.perf_counter())
+    make_rho = tuple(ni._gen_rho_evaluator(ot.mol, dm1s[i, :, :], hermi=hermi, with_lapl=False)
+                     for i in range(2))
+    make_rho_cas = tuple(ni._gen_rho_evaluator(ot.mol, dm1s_cas[i, :, :], hermi=hermi,
+                                               with_lapl=False)
+                         for i in range(2))
+    p0 = 0
+    for ao, mask, weight, _ in ni.block_loop(ot.mol, ot.grids, nao, dens_deriv, max_memory):
+        p1 = p0 + weight.size
+        rho = np.asarray([m[0](0, ao, mask, xctype) for m in make_rho])
+        rho_cas = np.asarray([m[0](0, ao, mask, xctype) for m in make_rho_cas])
+        if rho.ndim == 2:
+            rho = np.expand_dims(rho, 1)
+            rho_cas = np.expand_dims(rho_cas, 1)
+        Pi = _rho_product(rho, Pi_deriv) - _rho_product(rho_cas, Pi_deriv)
+        Pi += otpd2[:Pi.shape[0], p0:p1]
+        t0 = lib.logger.timer(ot, 'on-top pair density calculation', *t0)
+        E_ot += ot.eval_ot(rho, Pi, dderiv=0, weights=weight)[0].dot(weight)
+        t0 = lib.logger.timer(ot, 'on-top energy calculation', *t0)
+        p0 = p1
+
+    return E_ot
+
+
+def energy_mcwfn_rdm1s(mc, mo_coeff=None, ot=None, casdm1s=None):
+    """
+    Wave-function part of the MC-PDFT energy for on-top functionals without a hybrid correlation
+    component, which does not depend on the 2-RDM. See pyscf.mcpdft.mcpdft.energy_mcwfn
+    """
+    if ot is None: ot = mc.otfnal
+    if mo_coeff is None: mo_coeff = mc.mo_coeff
+    hyb_x = ot._numint.rsh_and_hybrid_coeff(ot.otxc, mc.mol.spin)[2][0]
+    dm1s = _dms.casdm1s_to_dm1s(mc, casdm1s, mo_coeff=mo_coeff)
+    dm1 = dm1s[0] + dm1s[1]
+
+    Vnn = mc._scf.energy_nuc()
+    Te_Vne = np.tensordot(mc._scf.get_hcore(), dm1)
+    E_x = 0.0
+    if abs(hyb_x) > 1e-10:
+        vj, vk = mc._scf.get_jk(dm=dm1s)
+        vj = vj[0] + vj[1]
+        E_x = -(np.tensordot(vk[0], dm1s[0]) + np.tensordot(vk[1], dm1s[1])) / 2
+    else:
+        vj = mc._scf.get_j(dm=dm1)
+    E_j = np.tensordot(vj, dm1) / 2
+    return Vnn + Te_Vne + E_j + (hyb_x * E_x)
+
+
+def energy_tot_otpd(mc, mo_coeff=None, ci=None, ot=None, state=0, verbose=None):
+    """
+    MC-PDFT total energy of one LASSI state, with the on-top energy evaluated from the on-top
+    pair density on the grid. The 2-RDM is only built for hybrid functionals or at debug
+    verbosity. See pyscf.mcpdft.mcpdft.energy_tot
+
+    Returns:
+        e_tot : float
+            Total MC-PDFT energy including nuclear repulsion energy
+        E_ot : float
+            On-top (cf. exchange-correlation) energy
+    """
+    if ot is None: ot = mc.otfnal
+    ot.reset(mol=mc.mol)
+    if mo_coeff is None: mo_coeff = mc.mo_coeff
+    if ci is None: ci = mc.ci
+    if verbose is None: verbose = mc.verbose
+    log = lib.logger.new_logger(mc, verbose)
+    t0 = (lib.logger.process_clock(), lib.logger.perf_counter())
+
+    casdm1s = mc.make_one_casdm1s(ci, state=state)
+    otpd2 = mc.make_one_otpd2(ot=ot, state=state, mo_coeff=mo_coeff)
+    t0 = log.timer('rdms', *t0)
+
+    hyb_c = ot._numint.rsh_and_hybrid_coeff(ot.otxc, mc.mol.spin)[2][1]
+    if abs(hyb_c) > 1e-10 or log.verbose >= lib.logger.DEBUG:
+        casdm2 = mc.make_one_casdm2(ci, state=state)
+        e_mcwfn = mc.energy_mcwfn(ot=ot, mo_coeff=mo_coeff, casdm1s=casdm1s, casdm2=casdm2,
+                                  verbose=verbose)
+    else:
+        e_mcwfn = energy_mcwfn_rdm1s(mc, mo_coeff=mo_coeff, ot=ot, casdm1s=casdm1s)
+    t0 = log.timer('MC wfn energy', *t0)
+
+    e_dft = energy_ot_direct(ot, casdm1s, otpd2, mo_coeff, mc.ncore, max_memory=mc.max_memory)
+    t0 = log.timer('E_ot', *t0)
+    return e_mcwfn + e_dft, e_dft
+
+
+def energy_ot_states(ot, casdm1s, mo_coeff, ncore, cascm2=None, otpd2=None, max_memory=2000,
+                     hermi=1):
+    """
+    On-top energies of several states in a single pass over the grid. The AO values [and
+    derivatives] on each grid block are evaluated once for all states, and the on-top functional
+    is evaluated for all of the states in the block in a single call.
+
+    Args:
+        casdm1s : ndarray of shape (nstates, 2, ncas, ncas)
+            Spin-separated 1-RDMs of the states
+        mo_coeff : ndarray of shape (nao, nmo)
+        ncore : integer
+
+    Kwargs:
+        cascm2 : ndarray of shape (nstates, ncas, ncas, ncas, ncas)
+            Spin-summed 2-body cumulants of the states
+        otpd2 : ndarray of shape (nstates, nderiv, ngrids)
+            2-body part of the on-top pair density of the states; see energy_ot_direct.
+            Exactly one of cascm2 and otpd2 must be provided.
+
+    Returns:
+        E_ot : ndarray of shape (nstates,)
+    """
+    assert ((cascm2 is None) != (otpd2 is None))
+    nstates = len(casdm1s)
+    E_ot = np.zeros(nstates)
+    ni, xctype = ot._numint, ot.xctype
+    if xctype == 'HF': return E_ot
+    dens_deriv = ot.dens_deriv
+    Pi_deriv = ot.Pi_deriv
+    if Pi_deriv > 1:
+        raise NotImplementedError("on-top pair density second derivatives")
+
+    nao = mo_coeff.shape[0]
+    ncas = casdm1s.shape[-1]
+    mo_cas = mo_coeff[:, ncore:][:, :ncas]
+    dm1s = np.stack([_dms.casdm1s_to_dm1s(ot, casdm1s[i], mo_coeff=mo_coeff, ncore=ncore,
+                                          ncas=ncas)
+                     for i in range(nstates)], axis=0).reshape(2 * nstates, nao, nao)
+    make_rho = ni._gen_rho_evaluator(ot.mol, dm1s, hermi=hermi, with_lapl=False)[0]
+    if otpd2 is not None:
+        dm1s_cas = lib.einsum('pi,sij,qj->spq', mo_cas, casdm1s.reshape(2 * nstates, ncas, ncas),
+                              mo_cas.conj())
+        make_rho_cas = ni._gen_rho_evaluator(ot.mol, dm1s_cas, hermi=hermi, with_lapl=False)[0]
+
+    t0 = (lib.logger.process_clock(), lib.logger.perf_counter())
+    p0 = 0
+    for ao, mask, weight, _ in ni.block_loop(ot.mol, ot.grids, nao, dens_deriv, max_memory):
+        ngrids = weight.size
+        p1 = p0 + ngrids
+        rho = np.asarray([make_rho(i, ao, mask, xctype) for i in range(2 * nstates)])
+        rho = rho.reshape(nstates, 2, -1, ngrids)
+        Pi = np.stack([_rho_product(r, Pi_deriv) for r in rho], axis=0)
+        if otpd2 is not None:
+            rho_cas = np.asarray([make_rho_cas(i, ao, mask, xctype) for i in range(2 * nstates)])
+            rho_cas = rho_cas.reshape(nstates, 2, -1, ngrids)
+            Pi -= np.stack([_rho_product(r, Pi_deriv) for r in rho_cas], axis=0)
+            Pi += otpd2[:, :Pi.shape[1], p0:p1]
+        else:
+            ao_cas = ao[None, :, :] if ao.ndim == 2 else ao[:Pi.shape[1]]
+            mo_grid = _grid_ao2mo(ot.mol, ao_cas, mo_cas, non0tab=mask)
+            Pi += dm2_on_grid(cascm2, mo_grid, max_memory=max_memory)
+        t0 = lib.logger.timer(ot, 'on-top pair density calculation', *t0)
+        # All states of the block at once, stacked along the grid dimension
+        rho = rho.transpose(1, 2, 0, 3).reshape(2, rho.shape[2], nstates * ngrids)
+        Pi = Pi.transpose(1, 0, 2).reshape(Pi.shape[1], nstates * ngrids)
+        weights = np.tile(weight, nstates)
+        eot = ot.eval_ot(rho, Pi, dderiv=0, weights=weights)[0]
+        E_ot += np.dot(eot.reshape(nstates, ngrids), weight)
+        t0 = lib.logger.timer(ot, 'on-top energy calculation', *t0)
+        p0 = p1
+
+    return E_ot
+
+
+def energy_tot_states(mc, mo_coeff=None, ci=None, ot=None, states=None, verbose=None):
+    """
+    MC-PDFT total energies of several LASSI states, with the on-top energies of as many states as
+    fit in memory evaluated in one pass over the grid. See pyscf.mcpdft.mcpdft.energy_tot
+
+    Kwargs:
+        states : sequence of integers
+            Indices of the states (into mc.states); defaults to all
+
+    Returns:
+        e_tot : ndarray of shape (nstates,)
+            Total MC-PDFT energies including nuclear repulsion energy
+        E_ot : ndarray of shape (nstates,)
+            On-top (cf. exchange-correlation) energies
+    """
+    if ot is None: ot = mc.otfnal
+    ot.reset(mol=mc.mol)
+    if mo_coeff is None: mo_coeff = mc.mo_coeff
+    if ci is None: ci = mc.ci
+    if states is None: states = range(len(mc.states))
+    if verbose is None: verbose = mc.verbose
+    log = lib.logger.new_logger(mc, verbose)
+    t0 = (lib.logger.process_clock(), lib.logger.perf_counter())
+    states = list(states)
+    nstates = len(states)
+    ncas = mc.ncas
+
+    casdm1s = np.stack([mc.make_one_casdm1s(ci, state=i) for i in states], axis=0)
+    hyb_c = ot._numint.rsh_and_hybrid_coeff(ot.otxc, mc.mol.spin)[2][1]
+    need_casdm2 = abs(hyb_c) > 1e-10 or log.verbose >= lib.logger.DEBUG
+    if mc.otpd_direct:
+        if ot.grids.coords is None:
+            ot.grids.build(with_non0tab=True)
+        mem_per_state = 8 * (2 * (ncas ** 2) + 4 * ot.grids.weights.size) / 1e6
+    else:
+        mem_per_state = 8 * (2 * (ncas ** 2) + 2 * (ncas ** 4)) / 1e6
+    nblk = mc._get_nblk(mem_per_state)
+
+    e_mcwfn = np.zeros(nstates)
+    e_ot = np.zeros(nstates)
+    for i, j in lib.prange(0, nstates, nblk):
+        casdm2 = cascm2 = otpd2 = None
+        if need_casdm2 or not mc.otpd_direct:
+            casdm2 = [mc.make_one_casdm2(ci, state=k) for k in states[i:j]]
+        if mc.otpd_direct:
+            otpd2 = np.stack([mc.make_one_otpd2(ot=ot, state=k, mo_coeff=mo_coeff)
+                              for k in states[i:j]], axis=0)
+        else:
+            cascm2 = np.stack([_dms.dm2_cumulant(dm2, dm1s)
+                               for dm2, dm1s in zip(casdm2, casdm1s[i:j])], axis=0)
+        t0 = log.timer('rdms', *t0)
+        for k in range(i, j):
+            if need_casdm2:
+                e_mcwfn[k] = mc.energy_mcwfn(ot=ot, mo_coeff=mo_coeff, casdm1s=casdm1s[k],
+                                             casdm2=casdm2[k - i], verbose=verbose)
+            else:
+                e_mcwfn[k] = energy_mcwfn_rdm1s(mc, mo_coeff=mo_coeff, ot=ot, casdm1s=casdm1s[k])
+        t0 = log.timer('MC wfn energy', *t0)
+        e_ot[i:j] = energy_ot_states(ot, casdm1s[i:j], mo_coeff, mc.ncore, cascm2=cascm2,
+                                     otpd2=otpd2, max_memory=mc.max_memory)
+        t0 = log.timer('E_ot', *t0)
+        casdm2 = cascm2 = otpd2 = None
+    return e_mcwfn + e_ot, e_ot
+
+
 class _LASPDFT(_PDFT):
     'MC-PDFT energy for a LASSCF wavefunction'
 
@@ -79,6 +373,7 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
         setattr(_mc_class, 'states', None)
         setattr(_mc_class, 'statlis', None)
         setattr(_mc_class, 'rdmstmpfile', None)
+        otpd_direct = OTPD_DIRECT
 
         def get_h2eff(self, mo_coeff=None):
             if self._in_mcscf_env:
@@ -88,7 +383,7 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
         
         # Have to pass this due to dump_chk, which won't work for LAS.
         def compute_pdft_energy_(self, mo_coeff=None, ci=None, ot=None, otxc=None,
-                                 grids_level=None, grids_attr=None, dunp_chk=False, **kwargs):
+                                 grids_level=None, grids_attr=None, dump_chk=False, **kwargs):
             return _LASPDFT.compute_pdft_energy_(self, mo_coeff=mo_coeff, ci=ci, ot=ot, otxc=otxc,
                     grids_level=grids_level, grids_attr=grids_attr, dump_chk=False, **kwargs)
 
@@ -135,12 +430,8 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
             just call a reader function which will read the rdms from this temp file.
             '''
 
-            def _store_rdms(self):
-                # MRH: I made it loop over blocks of states to handle the O(N^5) memory cost
-                # If there's enough memory it'll still do them all at once
+            def _get_nblk(self, mem_per_state):
                 log = lib.logger.new_logger(self, self.verbose)
-                safety_factor = 1.3
-                mem_per_state = safety_factor * 8 * (2 * (self.ncas ** 2) + 4 * (self.ncas ** 4)) / 1e6
                 current_mem = lib.current_memory()[0]
 
                 if current_mem > self.max_memory:
@@ -149,9 +440,20 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
                     nblk = 1
                 else:
                     nblk = max(1, int((self.max_memory - current_mem) / mem_per_state) - 1)
+                return nblk
 
-                log.debug('_store_rdms: looping over %d states at a time of %d total', len(self.states),
-                          nblk)
+            def _store_rdms(self):
+                # MRH: I made it loop over blocks of states to handle the O(N^5) memory cost
+                # If there's enough memory it'll still do them all at once
+                if self.otpd_direct:
+                    return self._store_otpd()
+                log = lib.logger.new_logger(self, self.verbose)
+                safety_factor = 1.3
+                mem_per_state = safety_factor * 8 * (2 * (self.ncas ** 2) + 4 * (self.ncas ** 4)) / 1e6
+                nblk = self._get_nblk(mem_per_state)
+
+                log.debug('_store_rdms: looping over %d states at a time of %d total', nblk,
+                          len(self.states))
 
                 rdmstmpfile = self.rdmstmpfile
                 with h5py.File(rdmstmpfile, 'a') as f:
@@ -168,20 +470,124 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
                         for k in range(i, j):
                             stateno = self.states[k]
                             rdm1s_dname = f'rdm1s_{stateno}'
-                            f.create_dataset(rdm1s_dname, data=rdm1s[k])
+                            f.create_dataset(rdm1s_dname, data=rdm1s[k - i])
                             rdm2s_dname = f'rdm2s_{stateno}'
-                            f.create_dataset(rdm2s_dname, data=rdm2s[k])
+                            f.create_dataset(rdm2s_dname, data=rdm2s[k - i])
 
                         rdm1s = rdm2s = None
 
+            def _store_otpd(self, ot=None, mo_coeff=None):
+                # Instead of the 2-RDMs, store the 2-body part of the on-top pair density of each
+                # state on the grid, built from fragment-local intermediates
+                if ot is None: ot = self.otfnal
+                if mo_coeff is None: mo_coeff = self.mo_coeff
+                if ot.Pi_deriv > 1:
+                    raise NotImplementedError("on-top pair density second derivatives")
+                log = lib.logger.new_logger(self, self.verbose)
+                if ot.grids.coords is None:
+                    ot.grids.build(with_non0tab=True)
+                ncore, ncas = self.ncore, self.ncas
+                mo_grid = get_mo_grid(ot, mo_coeff[:, ncore:ncore + ncas],
+                                      max_memory=self.max_memory)
+                safety_factor = 1.3
+                mem_per_state = safety_factor * 8 * (2 * (ncas ** 2) + mo_grid[:, :, 0].size) / 1e6
+                nblk = self._get_nblk(mem_per_state)
+
+                log.debug('_store_otpd: looping over %d states at a time of %d total on %d grid '
+                          'points', nblk, len(self.states), mo_grid.shape[1])
+
+                with h5py.File(self.rdmstmpfile, 'a') as f:
+                    for i in range(0, len(self.states), nblk):
+                        j = min(i + nblk, len(self.states))
+
+                        rdm1s, otpd2 = lassi.root_make_rdm1s_otpd(self, self.ci, self.si, mo_grid,
+                                                                  state=self.states[i:j])
+
+                        if len(self.states[i:j]) == 1:
+                            rdm1s = [rdm1s]
+                            otpd2 = [otpd2]
+
+                        for k in range(i, j):
+                            stateno = self.states[k]
+                            for dname, data in ((f'rdm1s_{stateno}', rdm1s[k - i]),
+                                                (f'otpd2_{stateno}', otpd2[k - i])):
+                                if dname in f: del f[dname]
+                                f.create_dataset(dname, data=data)
+
+                        rdm1s = otpd2 = None
+                self._otpd_key = self._get_otpd_key(ot, mo_coeff)
+
+            def _get_otpd_key(self, ot, mo_coeff):
+                # Identifies the grid, the active orbitals, and the LASSI states of the stored
+                # on-top pair densities
+                ncore, ncas = self.ncore, self.ncas
+                return (ot.Pi_deriv, ot.grids.weights.size, ot.grids.weights.sum(),
+                        lib.fp(mo_coeff[:, ncore:ncore + ncas]), lib.fp(self.si))
+
             def make_one_casdm1s(self, ci=None, state=0, **kwargs):
                 rdmstmpfile = self.rdmstmpfile
                 return make_casdm1s(rdmstmpfile, self.states[state])
 
             def make_one_casdm2(self, ci=None, state=0, **kwargs):
+                if self.otpd_direct:
+                    rdm2s = lassi.root_make_rdm12s(self, self.ci, self.si,
+                                                   state=self.states[state])[1]
+                    return rdm2s.sum((0, 3))
                 rdmstmpfile = self.rdmstmpfile
                 return make_casdm2s(rdmstmpfile, self.states[state]).sum((0, 3))
 
+            def make_one_otpd2(self, ot=None, state=0, mo_coeff=None):
+                if ot is None: ot = self.otfnal
+                if mo_coeff is None: mo_coeff = self.mo_coeff
+                if ot.grids.coords is None:
+                    ot.grids.build(with_non0tab=True)
+                if getattr(self, '_otpd_key', None) != self._get_otpd_key(ot, mo_coeff):
+                    self._store_otpd(ot=ot, mo_coeff=mo_coeff)
+                return make_otpd2(self.rdmstmpfile, self.states[state])
+
+            _epdft_batch = None
+
+            def compute_pdft_energy_(self, mo_coeff=None, ci=None, ot=None, otxc=None,
+                                     grids_level=None, grids_attr=None, dump_chk=False, **kwargs):
+                # The first call to energy_tot inside evaluates all of the states at once
+                with lib.temporary_env(self, _epdft_batch={}):
+                    return _LASPDFT.compute_pdft_energy_(self, mo_coeff=mo_coeff, ci=ci, ot=ot,
+                                                         otxc=otxc, grids_level=grids_level,
+                                                         grids_attr=grids_attr, dump_chk=False,
+                                                         **kwargs)
+
+            def energy_tot(self, mo_coeff=None, ci=None, ot=None, state=0, verbose=None,
+                           otxc=None, grids_level=None, grids_attr=None, logger_tag='MC-PDFT'):
+                if ((self._epdft_batch is not None) and (ot is None) and (otxc is None)
+                        and (grids_level is None) and not grids_attr):
+                    if state not in self._epdft_batch:
+                        states = range(len(self.states))
+                        e_tot, e_ot = energy_tot_states(self, mo_coeff=mo_coeff, ci=ci,
+                                                        states=states, verbose=verbose)
+                        self._epdft_batch.update({i: (e_tot[i], e_ot[i]) for i in states})
+                    e_tot, e_ot = self._epdft_batch[state]
+                    lib.logger.note(self, '%s E = %s, Eot(%s) = %s', logger_tag, e_tot,
+                                    self.otfnal.otxc, e_ot)
+                    return e_tot, e_ot
+                if not self.otpd_direct:
+                    return _PDFT.energy_tot(self, mo_coeff=mo_coeff, ci=ci, ot=ot, state=state,
+                                            verbose=verbose, otxc=otxc, grids_level=grids_level,
+                                            grids_attr=grids_attr, logger_tag=logger_tag)
+                if grids_attr is None: grids_attr = {}
+                if grids_level is not None: grids_attr['level'] = grids_level
+                if len(grids_attr) or (otxc is not None):
+                    old_ot = ot if (ot is not None) else self.otfnal
+                    if otxc is None: otxc = old_ot.otxc
+                    ot = get_transfnal(self.mol, otxc)
+                    ot.grids.__dict__.update(old_ot.grids.__dict__)
+                    ot.grids.__dict__.update(**grids_attr)
+                elif ot is None:
+                    ot = self.otfnal
+                e_tot, e_ot = energy_tot_otpd(self, mo_coeff=mo_coeff, ci=ci, ot=ot, state=state,
+                                              verbose=verbose)
+                lib.logger.note(self, '%s E = %s, Eot(%s) = %s', logger_tag, e_tot, ot.otxc, e_ot)
+                return e_tot, e_ot
+
         else:
             make_one_casdm1s = mc.__class__.state_make_casdm1s
             make_one_casdm2 = mc.__class__.state_make_casdm2
@@ -216,5 +622,5 @@ def get_mcpdft_child_class(mc, ot, DoLASSI=False, states=None, **kwargs):
     pdft = PDFT(mc._scf, mc.ncas_sub, mc.nelecas_sub, my_ot=ot, **kwargs)
     _keys = pdft._keys.copy()
     pdft.__dict__.update(mc.__dict__)
-    pdft._keys = pdft._keys.union(_keys)
+    pdft._keys = pdft._keys.union(_keys).union(['otpd_direct'])
     return pdft
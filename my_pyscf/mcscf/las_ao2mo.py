@@ -1,9 +1,18 @@
 import numpy as np
 from scipy import linalg
-from pyscf import ao2mo, lib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pyscf import ao2mo, lib, __config__
 from mrh.my_pyscf.df.sparse_df import sparsedf_array
 
-def get_h2eff_df (las, mo_coeff):
+DF_NTHREADS = getattr (__config__, 'las_ao2mo_df_nthreads', 1)
+
+def get_h2eff_df (las, mo_coeff, nthreads=None):
+    '''Active-space ERIs (p1a1|a2a3), lower-triangular in a2a3, from density fitting. The aux
+    blocks are read by las.with_df.loop, which prefetches the next block from disk if _cderi is
+    stored in a file. If nthreads > 1, up to nthreads aux blocks are contracted at the same time
+    on a thread pool, and their contributions are added to eri in aux-block order.'''
+    if nthreads is None: nthreads = DF_NTHREADS
     # Store intermediate with one contracted ao index for faster calculation of exchange!
     log = lib.logger.new_logger (las, las.verbose)
     gpu=las.use_gpu
@@ -37,12 +46,13 @@ def get_h2eff_df (las, mo_coeff):
         mem_per_aux += nao*(nao+1) # see note above
     mem_per_aux *= safety_factor * 8 / 1e6
     mem_per_aux = max (1, mem_per_aux)
-    blksize = max (1, min (naux, int (mem_av / mem_per_aux)))
+    nthreads = max (1, min (nthreads, naux//2))
+    # Up to nthreads+1 blocks are held in memory at once
+    blksize = max (1, min (naux, int (mem_av / mem_per_aux / (1 + int (nthreads>1)*nthreads))))
     assert (blksize>1)
     log.debug2 ("LAS DF ERI blksize = %d, mem_av = %d MB, mem_per_aux = %d MB", blksize, mem_av, mem_per_aux)
     log.debug2 ("LAS DF ERI naux = %d, nao = %d, nmo = %d", naux, nao, nmo)
-    eri = 0
-    for cderi in las.with_df.loop (blksize=blksize):
+    def contract_block (cderi):
         #t1 = lib.logger.timer (las, 'Sparsedf', *t0)
         bPmn = sparsedf_array (cderi)
         bmuP1 = bPmn.contract1 (mo_cas)
@@ -51,13 +61,36 @@ def get_h2eff_df (las, mo_coeff):
                  str (bPmn.shape), str (np.shares_memory (bPmn, cderi)),
                  str (np.may_share_memory (bPmn, cderi)),
                  str (bPmn.flags['C_CONTIGUOUS']))
-        if mem_enough_int : bmuP.append (bmuP1)
         buvP = np.tensordot (mo_cas.conjugate (), bmuP1, axes=((0),(0)))
         eri1 = np.tensordot (bmuP1, buvP, axes=((2),(2)))
         eri1 = np.tensordot (mo_coeff.conjugate (), eri1, axes=((0),(0)))
-        eri += lib.pack_tril (eri1.reshape (nmo*ncas, ncas, ncas)).reshape (nmo, -1)
-        cderi = bPmn = bmuP1 = buvP = eri1 = None
+        eri1 = lib.pack_tril (eri1.reshape (nmo*ncas, ncas, ncas)).reshape (nmo, -1)
         #t1 = lib.logger.timer (las, 'rest of the calculation', *t1)
+        return bmuP1, eri1
+    eri = 0
+    if nthreads > 1:
+        omp_nthreads = max (1, lib.num_threads () // nthreads)
+        def work (cderi):
+            with lib.with_omp_threads (omp_nthreads):
+                return contract_block (cderi)
+        pending = deque ()
+        def reduce_block ():
+            nonlocal eri
+            bmuP1, eri1 = pending.popleft ().result ()
+            if mem_enough_int : bmuP.append (bmuP1)
+            eri += eri1
+        with ThreadPoolExecutor (max_workers=nthreads) as executor:
+            for cderi in las.with_df.loop (blksize=blksize):
+                pending.append (executor.submit (work, cderi))
+                cderi = None
+                if len (pending) >= nthreads: reduce_block ()
+            while len (pending): reduce_block ()
+    else:
+        for cderi in las.with_df.loop (blksize=blksize):
+            bmuP1, eri1 = contract_block (cderi)
+            if mem_enough_int : bmuP.append (bmuP1)
+            eri += eri1
+            cderi = bmuP1 = eri1 = None
     #if mem_enough_int and not gpu: eri = lib.tag_array (eri, bmPu=np.concatenate (bmuP, axis=-1).transpose (0,2,1))
     if mem_enough_int : eri = lib.tag_array (eri, bmPu=np.concatenate (bmuP, axis=-1).transpose (0,2,1))
     if las.verbose > lib.logger.DEBUG:
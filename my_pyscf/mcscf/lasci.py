@@ -3,7 +3,7 @@ from pyscf import fci
 from pyscf.fci import cistring
 from pyscf.mcscf import casci, casci_symm, df
 from pyscf.tools import dump_mat
-from pyscf import symm, gto, scf, ao2mo, lib
+from pyscf import symm, gto, scf, ao2mo, lib, __config__
 from pyscf.fci.direct_spin1 import _unpack_nelec
 from mrh.my_pyscf.mcscf.addons import state_average_n_mix, get_h1e_zipped_fcisolver, las2cas_civec
 from mrh.my_pyscf.mcscf import lasci_sync, _DFLASCI, lasscf_guess, las_ao2mo
@@ -18,6 +18,9 @@ from scipy import linalg
 import numpy as np
 import copy
 
+FRAG_NTHREADS = getattr (__config__, 'lasci_frag_nthreads', 1)
+H2EFF_INCR_THRESH = getattr (__config__, 'lasscf_h2eff_incr_thresh', 0.0)
+
 def LASCI (mf_or_mol, ncas_sub, nelecas_sub, **kwargs):
     if isinstance(mf_or_mol, gto.Mole):
         mf = scf.RHF(mf_or_mol)
@@ -1061,9 +1064,16 @@ class LASCINoSymm (casci.CASCI):
         self.max_cycle_macro = 50
         self.max_cycle_micro = 5
         self.min_cycle_macro = 0
+        # Number of fragment CI problems to solve at the same time in Python threads
+        self.frag_nthreads = FRAG_NTHREADS
+        # Maximum norm of the active-unactive block of the orbital steps, accumulated since
+        # h2eff_sub was last rebuilt, for which h2eff_sub and the orbital-Hessian ERIs are updated
+        # from the previous macrocycle instead of rebuilt (0 = always rebuild)
+        self.h2eff_incr_thresh = H2EFF_INCR_THRESH
         keys = set(('e_states', 'fciboxes', 'nroots', 'weights', 'ncas_sub', 'nelecas_sub',
                     'conv_tol_grad', 'conv_tol_self', 'max_cycle_macro', 'max_cycle_micro',
-                    'ah_level_shift', 'states_converged', 'chkfile', 'e_lexc'))
+                    'ah_level_shift', 'states_converged', 'chkfile', 'e_lexc',
+                    'frag_nthreads', 'h2eff_incr_thresh'))
         self._keys = set(self.__dict__.keys()).union(keys)
         self.fciboxes = []
         if isinstance(spin_sub,int):
@@ -2394,7 +2404,8 @@ class LASCINoSymm (casci.CASCI):
         dma = linalg.block_diag (*[dm[0] for dm in casdm1s_sub])
         dmb = linalg.block_diag (*[dm[1] for dm in casdm1s_sub])
         casdm1s = np.stack ([dma, dmb], axis=0)
-        if gpu or not (isinstance (self, _DFLASCI)):
+        if (gpu or not (isinstance (self, _DFLASCI)) or not hasattr (h2eff_sub, 'bmPu')
+                or not isinstance (self.with_df._cderi, np.ndarray)):
             dm1s = np.dot (mo_cas, np.dot (casdm1s, moH_cas)).transpose (1,0,2)
             if not _full: dm1s = dm1s[0]+dm1s[1]
             return self.get_veff (dm = dm1s, spin_sep=_full)
@@ -2517,6 +2528,8 @@ class LASCINoSymm (casci.CASCI):
         log.info ('max_cycle_macro = %d', self.max_cycle_macro)
         log.info ('max_cycle_micro = %d', self.max_cycle_micro)
         log.info ('conv_tol_grad = %s', self.conv_tol_grad)
+        log.info ('frag_nthreads = %d', self.frag_nthreads)
+        log.info ('h2eff_incr_thresh = %s', self.h2eff_incr_thresh)
         log.info ('max_memory %d MB (current use %d MB)', self.max_memory,
                   lib.current_memory()[0])
         for i, fcibox in enumerate (self.fciboxes):
@@ -1,9 +1,11 @@
 from pyscf import lib, symm
+from pyscf.fci import cistring
 from mrh.my_pyscf.fci.csfstring import ImpossibleCIvecError
 from mrh.my_pyscf.mcscf import _DFLASCI
 from scipy.sparse import linalg as sparse_linalg
 from scipy import linalg 
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 # This must be locked to CSF solver for the forseeable future, because I know of no other way to
 # handle spin-breaking potentials while retaining spin constraint
@@ -56,6 +58,8 @@ def kernel (las, mo_coeff=None, ci0=None, casdm0_fr=None, conv_tol_grad=1e-4,
 
     ugg = None
     converged = False
+    h2eff_incr = False
+    norm_g_last = np.inf
     ci1 = ci0
     t2 = (t1[0], t1[1])
     it = 0
@@ -92,48 +96,63 @@ def kernel (las, mo_coeff=None, ci0=None, casdm0_fr=None, conv_tol_grad=1e-4,
         casdm1s_sub = casdm1s_new
 
         t1 = log.timer ('LASCI get_veff after ci', *t1)
-        H_op = las.get_hop (ugg=ugg, mo_coeff=mo_coeff, ci=ci1, h2eff_sub=h2eff_sub, veff=veff,
-                            do_init_eri=False)
-        g_vec = H_op.get_grad ()
-        if las.verbose > lib.logger.INFO:
-            g_orb_test, g_ci_test = las.get_grad (ugg=ugg, mo_coeff=mo_coeff, ci=ci1,
-                                                  h2eff_sub=h2eff_sub, veff=veff)[:2]
-            if ugg.nvar_orb:
-                err = linalg.norm (g_orb_test - g_vec[:ugg.nvar_orb])
-                log.debug ('GRADIENT IMPLEMENTATION TEST: |D g_orb| = %.15g', err)
+        while True:
+            H_op = las.get_hop (ugg=ugg, mo_coeff=mo_coeff, ci=ci1, h2eff_sub=h2eff_sub,
+                                veff=veff, do_init_eri=False)
+            g_vec = H_op.get_grad ()
+            if las.verbose > lib.logger.INFO:
+                g_orb_test, g_ci_test = las.get_grad (ugg=ugg, mo_coeff=mo_coeff, ci=ci1,
+                                                      h2eff_sub=h2eff_sub, veff=veff)[:2]
+                if ugg.nvar_orb:
+                    err = linalg.norm (g_orb_test - g_vec[:ugg.nvar_orb])
+                    log.debug ('GRADIENT IMPLEMENTATION TEST: |D g_orb| = %.15g', err)
+                    assert (err < 1e-5), '{}'.format (err)
+                for isub in range (len (ugg.ncsf_sub)):
+                    # TODO: double-check that this code works in SA-LASSCF
+                    i = ugg.ncsf_sub[:isub].sum ()
+                    j = i + ugg.ncsf_sub[isub].sum ()
+                    k = i + ugg.nvar_orb
+                    l = j + ugg.nvar_orb
+                    log.debug ('GRADIENT IMPLEMENTATION TEST: |D g_ci({})| = %.15g'.format (isub), 
+                               linalg.norm (g_ci_test[i:j] - g_vec[k:l]))
+                # TODO: figure out why this fails in intermediate combined lascis in lasscf_async
+                err = linalg.norm (g_ci_test - g_vec[ugg.nvar_orb:])
                 assert (err < 1e-5), '{}'.format (err)
-            for isub in range (len (ugg.ncsf_sub)):
-                # TODO: double-check that this code works in SA-LASSCF
-                i = ugg.ncsf_sub[:isub].sum ()
-                j = i + ugg.ncsf_sub[isub].sum ()
-                k = i + ugg.nvar_orb
-                l = j + ugg.nvar_orb
-                log.debug ('GRADIENT IMPLEMENTATION TEST: |D g_ci({})| = %.15g'.format (isub), 
-                           linalg.norm (g_ci_test[i:j] - g_vec[k:l]))
-            # TODO: figure out why this fails in intermediate combined lascis in lasscf_async
-            err = linalg.norm (g_ci_test - g_vec[ugg.nvar_orb:])
-            assert (err < 1e-5), '{}'.format (err)
-        gx = H_op.get_gx ()
-        prec_op = H_op.get_prec ()
-        prec = prec_op (np.ones_like (g_vec)) # Check for divergences
-        norm_gorb = linalg.norm (g_vec[:ugg.nvar_orb]) if ugg.nvar_orb else 0.0
-        norm_gci = linalg.norm (g_vec[ugg.nvar_orb:]) if ugg.ncsf_sub.sum () else 0.0
-        norm_gx = linalg.norm (gx) if gx.size else 0.0
-        x0 = prec_op._matvec (-g_vec)
-        norm_xorb = linalg.norm (x0[:ugg.nvar_orb]) if ugg.nvar_orb else 0.0
-        norm_xci = linalg.norm (x0[ugg.nvar_orb:]) if ugg.ncsf_sub.sum () else 0.0
-        lib.logger.info (
-            las, 'LASCI macro %d : E = %.15g ; |g_int| = %.15g ; |g_ci| = %.15g ; |g_x| = %.15g',
-            it, H_op.e_tot, norm_gorb, norm_gci, norm_gx)
-        #log.info (
-        #    ('LASCI micro init : E = %.15g ; |g_orb| = %.15g ; |g_ci| = %.15g ; |x0_orb| = %.15g '
-        #    '; |x0_ci| = %.15g'), H_op.e_tot, norm_gorb, norm_gci, norm_xorb, norm_xci)
-        las.dump_chk (mo_coeff=mo_coeff, ci=ci1)
-        if (((norm_gorb<conv_tol_grad and norm_gci<conv_tol_grad)
-             or ((norm_gorb+norm_gci)<norm_gx/10))
-            and (it>=las.min_cycle_macro)):
-                converged = True
-                break
+            gx = H_op.get_gx ()
+            prec_op = H_op.get_prec ()
+            prec = prec_op (np.ones_like (g_vec)) # Check for divergences
+            norm_gorb = linalg.norm (g_vec[:ugg.nvar_orb]) if ugg.nvar_orb else 0.0
+            norm_gci = linalg.norm (g_vec[ugg.nvar_orb:]) if ugg.ncsf_sub.sum () else 0.0
+            norm_gx = linalg.norm (gx) if gx.size else 0.0
+            x0 = prec_op._matvec (-g_vec)
+            norm_xorb = linalg.norm (x0[:ugg.nvar_orb]) if ugg.nvar_orb else 0.0
+            norm_xci = linalg.norm (x0[ugg.nvar_orb:]) if ugg.ncsf_sub.sum () else 0.0
+            lib.logger.info (
+                las, ('LASCI macro %d : E = %.15g ; |g_int| = %.15g ; |g_ci| = %.15g ; '
+                      '|g_x| = %.15g'), it, H_op.e_tot, norm_gorb, norm_gci, norm_gx)
+            #log.info (
+            #    ('LASCI micro init : E = %.15g ; |g_orb| = %.15g ; |g_ci| = %.15g ; |x0_orb| = %.15g '
+            #    '; |x0_ci| = %.15g'), H_op.e_tot, norm_gorb, norm_gci, norm_xorb, norm_xci)
+            las.dump_chk (mo_coeff=mo_coeff, ci=ci1)
+            converged = (((norm_gorb<conv_tol_grad and norm_gci<conv_tol_grad)
+                          or ((norm_gorb+norm_gci)<norm_gx/10))
+                         and (it>=las.min_cycle_macro))
+            # The errors of an incrementally-updated h2eff_sub accumulate until the gradient stops
+            # decreasing, and convergence measured with it can't be trusted
+            stalled = (norm_gorb+norm_gci) >= norm_g_last
+            if not (h2eff_incr and (converged or stalled)): break
+            # Rebuild h2eff_sub, and everything that depends on it, and test again at the same
+            # point
+            log.info ('Rebuilding incrementally-updated h2eff_sub to %s',
+                      'confirm convergence' if converged else 'continue')
+            h2eff_sub = las.get_h2eff (mo_coeff)
+            h2eff_incr = converged = False
+            veff = las.get_veff (dm = las.make_rdm1 (mo_coeff=mo_coeff, ci=ci1))
+            veff = las.split_veff (veff, h2eff_sub, mo_coeff=mo_coeff, ci=ci1)
+            casdm1frs = las.states_make_casdm1s_sub (ci=ci1)
+            t1 = log.timer ('LASCI h2eff_sub rebuild', *t1)
+        if converged: break
+        norm_g_last = norm_gorb + norm_gci
         if gpu:
             log.info('bPpj construction is bypassed in Hessian constructor')
         H_op._init_eri_() 
@@ -185,6 +204,7 @@ def kernel (las, mo_coeff=None, ci0=None, casdm0_fr=None, conv_tol_grad=1e-4,
                                   M=prec_op)[0]
             t1 = log.timer ('LASCI {} microcycles'.format (microit[0]), *t1)
             mo_coeff, ci1, h2eff_sub = H_op.update_mo_ci_eri (x, h2eff_sub)
+            h2eff_incr = getattr (H_op, 'h2eff_sub_incr', False)
             t1 = log.timer ('LASCI Hessian update', *t1)
 
             #veff = las.get_veff (mo_coeff=mo_coeff, ci=ci1)
@@ -210,6 +230,7 @@ def kernel (las, mo_coeff=None, ci0=None, casdm0_fr=None, conv_tol_grad=1e-4,
                 log.info ('Attempt {} of 3 to scale down trial step vector'.format (i+1))
                 x *= .5
             mo_coeff, ci1, h2eff_sub, veff = mo2, ci2, h2eff_sub2, veff2
+            h2eff_incr = getattr (H_op, 'h2eff_sub_incr', False)
 
 
         casdm1frs = las.states_make_casdm1s_sub (ci=ci1)
@@ -269,9 +290,10 @@ def ci_cycle (las, mo, ci0, veff, h2eff_sub, casdm1frs, log):
     t1 = (lib.logger.process_clock(), lib.logger.perf_counter())
     h1eff_sub = las.get_h1eff (mo, veff=veff, h2eff_sub=h2eff_sub, casdm1frs=casdm1frs)
     ncas_cum = np.cumsum ([0] + las.ncas_sub.tolist ()) + las.ncore
-    e_cas = []
-    ci1 = []
+    e_cas = [0 for idx in range (las.nfrags)] # TODO: proper energy calculation for frozen_ci
+    ci1 = list (ci0)
     e0 = 0.0 
+    kernel_args = {}
     for isub, (fcibox, ncas, nelecas, h1e, fcivec) in enumerate (zip (las.fciboxes, las.ncas_sub,
                                                                       las.nelecas_sub, h1eff_sub,
                                                                       ci0)):
@@ -299,19 +321,80 @@ def ci_cycle (las, mo, ci0, veff, h2eff_sub, casdm1frs, log):
                     wfnsym_str = symm.irrep_id2name (las.mol.groupname, wfnsym)
                 log.debug1 ("LASCI subspace {} state {} with wfnsym {}".format (isub, state,
                                                                                 wfnsym_str))
-
         if isub not in frozen_ci:
-            e_sub, fcivec = fcibox.kernel(h1e, eri_cas, ncas, nelecas,
-                                          ci0=fcivec, verbose=log,
-                                          max_memory = max_memory,
-                                          ecore=e0, orbsym=orbsym)
-        else:
-            e_sub = 0 # TODO: proper energy calculation (probably doesn't matter tho)
-        e_cas.append (e_sub)
-        ci1.append (fcivec)
-        t1 = log.timer ('FCI box for subspace {}'.format (isub), *t1)
+            kernel_args[isub] = (h1e, eri_cas, ncas, nelecas, fcivec, max_memory, orbsym)
+
+    def kernel_sub (isub, omp_nthreads=None, max_memory=None):
+        h1e, eri_cas, ncas, nelecas, fcivec, max_memory0, orbsym = kernel_args[isub]
+        if max_memory is None: max_memory = max_memory0
+        t2 = (lib.logger.process_clock(), lib.logger.perf_counter())
+        if omp_nthreads is None: omp_nthreads = lib.num_threads ()
+        with lib.with_omp_threads (omp_nthreads):
+            e_sub, fcivec = las.fciboxes[isub].kernel(h1e, eri_cas, ncas, nelecas,
+                                                      ci0=fcivec, verbose=log,
+                                                      max_memory = max_memory,
+                                                      ecore=e0, orbsym=orbsym)
+        log.timer ('FCI box for subspace {}'.format (isub), *t2)
+        return e_sub, fcivec
+
+    nworkers = min (getattr (las, 'frag_nthreads', 1), len (kernel_args))
+    if nworkers < 2:
+        for isub in kernel_args:
+            e_cas[isub], ci1[isub] = kernel_sub (isub)
+    else:
+        max_memory = max(400, las.max_memory-lib.current_memory()[0])
+        omp_nthreads, max_memory = split_ci_cycle_threads (las, list (kernel_args.keys ()),
+                                                           nworkers, max_memory=max_memory)
+        # Largest problems first, so that the small ones fill in the gaps at the end
+        order = sorted (kernel_args.keys (), key=lambda isub: -omp_nthreads[isub])
+        with ThreadPoolExecutor (max_workers=nworkers) as executor:
+            futures = {isub: executor.submit (kernel_sub, isub, omp_nthreads[isub],
+                                              max_memory[isub])
+                       for isub in order}
+            for isub, future in futures.items ():
+                e_cas[isub], ci1[isub] = future.result ()
+        log.timer ('FCI boxes on {} threads'.format (nworkers), *t1)
     return e_cas, ci1
 
+def split_ci_cycle_threads (las, frags, nworkers, max_memory=None):
+    ''' Divide the OpenMP threads, and optionally the memory, among fragment CI problems which are
+    solved at the same time on a pool of nworkers Python threads, in proportion to the number of
+    determinants in each fragment CI problem.
+
+    Args:
+        las: a LASCI object
+        frags: list of integers
+            Indices of fragments whose CI problems are to be solved
+        nworkers: integer
+            Number of fragment CI problems solved at the same time
+
+    Kwargs:
+        max_memory: float
+            Memory in MB available to all of the fragment CI problems together
+
+    Returns:
+        omp_nthreads: dict
+            Number of OpenMP threads for each fragment in frags
+        max_memory: dict
+            Memory in MB for each fragment in frags. Only returned if max_memory is provided.
+            The shares of any nworkers fragments running at the same time add up to no more
+            than max_memory.
+    '''
+    ndet = {}
+    for isub in frags:
+        ncas = las.ncas_sub[isub]
+        neleca, nelecb = las.nelecas_sub[isub]
+        ndet[isub] = (cistring.num_strings (ncas, neleca)
+                      * cistring.num_strings (ncas, nelecb))
+    nthreads = lib.num_threads ()
+    # The total weight of the problems expected to be running at the same time
+    wtot = sum (sorted (ndet.values (), reverse=True)[:nworkers])
+    omp_nthreads = {isub: min (nthreads, max (1, int (round (nthreads * ndet[isub] / wtot))))
+                    for isub in frags}
+    if max_memory is None: return omp_nthreads
+    max_memory = {isub: max_memory * ndet[isub] / wtot for isub in frags}
+    return omp_nthreads, max_memory
+
 def all_nonredundant_idx (nmo, ncore, ncas_sub):
     ''' Generate a index mask array addressing all nonredundant, lower-triangular elements of an
     nmo-by-nmo orbital-rotation unitary generator amplitude matrix for a LASSCF or LASCI problem
@@ -1,13 +1,24 @@
 import os
+import threading
 import numpy as np
 from scipy import linalg
-from pyscf import gto, scf, mcscf, ao2mo, lib, df
+from pyscf import gto, scf, mcscf, ao2mo, lib, df, __config__
 from pyscf.lib import logger
 from pyscf.fci.direct_spin1 import _unpack_nelec
 from pyscf.mcscf.addons import _state_average_mcscf_solver
 from mrh.my_pyscf.mcscf import _DFLASCI, lasci_sync, lasci
+from mrh.my_pyscf.df.compress import compress_cderi
 import copy, json
 
+# Force the outcore (HDF5 scratch file) impurity cderi even if it would fit in memory
+IMPHAM_OUTCORE = getattr (__config__, 'lasscf_async_impham_outcore', False)
+# Force integral-direct impurity ERIs even if the whole-molecule s8 array is available
+IMPHAM_DIRECT = getattr (__config__, 'lasscf_async_impham_direct', False)
+# Compress the auxiliary basis of the impurity cderi by a pivoted Cholesky decomposition of the
+# impurity ERIs, stopped once the largest residual diagonal element falls below this
+# (0 = keep all of the whole-molecule auxiliary basis)
+IMPHAM_AUX_TOL = getattr (__config__, 'lasscf_async_impham_aux_tol', 0)
+
 class ImpurityMole (gto.Mole):
     def __init__(self, las, stdout=None, output=None):
         gto.Mole.__init__(self)
@@ -102,7 +113,43 @@ class ImpuritySCF (scf.hf.SCF):
         ImpurityMole object.'''
         self.mol._update_space_(imporb_coeff, nelec_imp)
 
-    def _update_impham_1_(self, veff, dm1s, e_tot=None):
+    def _loop_cderi (self, blksize=None):
+        '''Iterate over blocks of the impurity-basis three-center integrals, whether they are
+        held in memory or in an HDF5 scratch file'''
+        if getattr (self, 'with_df', None) is not None:
+            for eri1 in self.with_df.loop (blksize=blksize):
+                yield eri1
+            return
+        cderi = self._cderi
+        naux, npair = cderi.shape
+        if blksize is None:
+            blksize = max (1, int (self.max_memory*.05e6/8/max (1,npair)))
+        for b0 in range (0, naux, blksize):
+            b1 = min (naux, b0+blksize)
+            yield np.asarray (cderi[b0:b1])
+
+    def _set_cderi_(self, _cderi):
+        '''Store impurity-basis three-center integrals, compressing their auxiliary index first if
+        IMPHAM_AUX_TOL is set. If this object isn't density-fitted, also build _eri from them.'''
+        naux = _cderi.shape[0]
+        if IMPHAM_AUX_TOL:
+            _cderi = compress_cderi (_cderi, tol=IMPHAM_AUX_TOL)
+            # The scratch file, if any, is no longer needed
+            if isinstance (_cderi, np.ndarray): self._cderi_h5 = None
+        # The auxiliary basis no longer matches that of the whole molecule
+        self._aux_compressed = _cderi.shape[0] != naux
+        if getattr (self, 'with_df', None) is not None:
+            self.with_df._cderi = _cderi
+        elif isinstance (_cderi, np.ndarray):
+            self._cderi = _cderi
+            self._eri = np.dot (_cderi.conj ().T, _cderi)
+        else:
+            self._cderi = _cderi
+            self._eri = 0
+            for eri2 in self._loop_cderi ():
+                self._eri += np.dot (eri2.conj ().T, eri2)
+
+    def _update_impham_1_(self, veff, dm1s, e_tot=None, _cderi=None):
         '''Update energy_nuc (), get_hcore (), and the two-electron integrals in either _eri or
         with_df to correspond to the current full-system total energy, the current full-system
         state-averaged Fock matrix, and the current impurity orbitals, respectively. I.E.,
@@ -118,6 +165,9 @@ class ImpuritySCF (scf.hf.SCF):
         Kwargs:
             e_tot : float
                 Full-system LASSCF total energy; defaults to value stored on parent LASSCF object
+            _cderi : ndarray of shape (naux, nimp*(nimp+1)/2)
+                Density-fitting three-center integrals in the impurity orbital basis, if they
+                have already been computed; e.g., by get_impurity_cderi
         '''
         if e_tot is None: e_tot = self.mol._las.e_tot
         imporb_coeff = self.mol.get_imporb_coeff ()
@@ -127,10 +177,9 @@ class ImpuritySCF (scf.hf.SCF):
         log = logger.new_logger (self, self.verbose)
         t0 = (logger.process_clock(), logger.perf_counter())
         conv_eris_mem_error = MemoryError (("Conventional two-electron integrals in asynchronous "
-                                            "LASSCF (integral-direct algorithm is not yet "
-                                            "supported)"))
+                                            "LASSCF (impurity _eri array does not fit)"))
         df_eris_mem_error = MemoryError (("Density-fitted two-electron integrals in asynchronous "
-                                          "LASSCF (outcore algorithm is not yet supported"))
+                                          "LASSCF (impurity _eri array does not fit)"))
         if hasattr(self.mol, 'use_gpu'):
             gpu = self.mol.use_gpu
         else:
@@ -229,35 +278,57 @@ class ImpuritySCF (scf.hf.SCF):
                 else:
                     libgpu.pull_eri_impham(gpu, _cderi, naoaux, nao_f, return_4c2eeri)
                     self._cderi=_cderi
+            elif _cderi is not None:
+                log.debug("Using precomputed impurity cderi, nimp: " + str(nimp))
+                assert (_cderi.shape == (mf.with_df.get_naoaux (), nimp*(nimp+1)//2))
+                self._set_cderi_(_cderi)
             else:         
-                if not self._is_mem_enough (df_naux = mf.with_df.get_naoaux ()):
-                    raise df_eris_mem_error
-                _cderi = np.empty ((mf.with_df.get_naoaux (), nimp*(nimp+1)//2),
-                               dtype=imporb_coeff.dtype)
+                naux = mf.with_df.get_naoaux ()
+                outcore = IMPHAM_OUTCORE or not self._is_mem_enough (df_naux = naux)
+                if outcore and getattr (self, 'with_df', None) is None:
+                    # _eri has to be in memory anyway
+                    if not self._is_mem_enough ():
+                        raise df_eris_mem_error
+                if outcore:
+                    # Replacing the previous scratch file closes and deletes it
+                    self._cderi_h5 = lib.H5TmpFile ()
+                    _cderi = self._cderi_h5.create_dataset ('j3c', (naux, nimp*(nimp+1)//2),
+                                                            dtype=imporb_coeff.dtype)
+                else:
+                    _cderi = np.empty ((naux, nimp*(nimp+1)//2), dtype=imporb_coeff.dtype)
                 ijmosym, mij_pair, moij, ijslice = ao2mo.incore._conc_mos (imporb_coeff, imporb_coeff,
                                                                         compact=True)
                 b0 = 0
 
-                log.debug("Doing CPU version of impham, nimp: " + str(nimp))
+                log.debug("Doing {} CPU version of impham, nimp: {}".format (
+                    ('incore', 'outcore')[outcore], nimp))
                 for eri1 in mf.with_df.loop ():
                     b1 = b0 + eri1.shape[0]
-                    eri2 = _cderi[b0:b1]
-                    eri2 = ao2mo._ao2mo.nr_e2 (eri1, moij, ijslice, aosym='s2', mosym=ijmosym,out=eri2)
+                    if outcore:
+                        _cderi[b0:b1] = ao2mo._ao2mo.nr_e2 (eri1, moij, ijslice, aosym='s2',
+                                                            mosym=ijmosym)
+                    else:
+                        eri2 = _cderi[b0:b1]
+                        eri2 = ao2mo._ao2mo.nr_e2 (eri1, moij, ijslice, aosym='s2', mosym=ijmosym,out=eri2)
                     b0 = b1
-                if getattr (self, 'with_df', None) is not None:
-                    self.with_df._cderi = _cderi
-                else:
-                    self._cderi = _cderi
-                    self._eri = np.dot (_cderi.conj ().T, _cderi)
+                self._set_cderi_(_cderi)
 
         else:
-            if getattr (mf, '_eri', None) is None:
-                if not mf._is_mem_enough ():
-                    raise conv_eris_mem_error
-                mf._eri = mf.mol.intor('int2e', aosym='s8')
             if not self._is_mem_enough ():
                 raise conv_eris_mem_error
-            self._eri = ao2mo.full (mf._eri, imporb_coeff, 4)
+            direct = IMPHAM_DIRECT
+            if getattr (mf, '_eri', None) is None and not direct:
+                direct = not mf._is_mem_enough ()
+            if direct:
+                # Shell batches of the whole-molecule ERIs are generated and transformed on the
+                # fly; the whole-molecule s8 array is never stored
+                log.debug ("Doing integral-direct version of impham, nimp: %d", nimp)
+                self._eri = ao2mo.outcore.general_iofree (mf.mol, (imporb_coeff,)*4,
+                                                          compact=True)
+            else:
+                if getattr (mf, '_eri', None) is None:
+                    mf._eri = mf.mol.intor('int2e', aosym='s8')
+                self._eri = ao2mo.full (mf._eri, imporb_coeff, 4)
         t0 = log.timer ("Two-electron integrals in embedding subspace", *t0)
         # External mean-field; potentially spin-broken
         h1s = mf.get_hcore ()[None,:,:] + veff
@@ -525,7 +596,27 @@ class ImpuritySolver ():
 
         return kf2
 
-    def _pull_keyframe_(self, kf, max_size='mid'):
+    def _get_imporb_space (self, kf, max_size='mid'):
+        '''Build the impurity orbital subspace for a keyframe without updating anything.
+
+        Args:
+            kf : object of :class:`LASKeyframe`
+                Contains whole-molecule MO coefficients, CI vectors, and intermediate arrays
+
+        Kwargs:
+            max_size : str or int
+                Control size of impurity subspace
+
+        Returns:
+            fo_coeff : ndarray of shape (nao, nimp)
+                Impurity orbital coefficients
+            nelec_f : int or tuple of length 2
+                Number of electrons in the impurity
+        '''
+        return self._imporb_builder (kf.mo_coeff, kf.dm1s, kf.veff, kf.fock1,
+                                     max_size=max_size)
+
+    def _pull_keyframe_(self, kf, max_size='mid', imporb_space=None, _cderi=None):
         '''Update this impurity solver, and all encapsulated impurity objects all the way down,
         with a new IO basis set, the corresponding Hamiltonian, and initial guess MO coefficients
         and CI vectors based on new whole-molecule data.
@@ -537,13 +628,18 @@ class ImpuritySolver ():
         Kwargs:
             max_size : str or int
                 Control size of impurity subspace
+            imporb_space : tuple of length 2
+                Output of self._get_imporb_space (kf, max_size=max_size), if already computed
+            _cderi : ndarray of shape (naux, nimp*(nimp+1)/2)
+                Density-fitting three-center integrals in the basis of imporb_space[0], if
+                already computed; e.g., by get_impurity_cderi
         '''
-        fo_coeff, nelec_f = self._imporb_builder (kf.mo_coeff, kf.dm1s, kf.veff, kf.fock1,
-                                                  max_size=max_size)
+        if imporb_space is None: imporb_space = self._get_imporb_space (kf, max_size=max_size)
+        fo_coeff, nelec_f = imporb_space
         self._update_space_(fo_coeff, nelec_f)
         self._update_trial_state_(kf.mo_coeff, kf.ci, veff=kf.veff, dm1s=kf.dm1s)
         self._update_impurity_hamiltonian_(kf.mo_coeff, kf.ci, h2eff_sub=kf.h2eff_sub,
-                                           veff=kf.veff, dm1s=kf.dm1s)
+                                           veff=kf.veff, dm1s=kf.dm1s, _cderi=_cderi)
         if hasattr (self, '_max_stepsize'): self._max_stepsize = None # PySCF issue #1762
 
     _update_keyframe_ = _pull_keyframe_
@@ -607,7 +703,8 @@ class ImpuritySolver ():
             self.mo_coeff[:,nocc:] = mo_virt @ c
 
     def _update_impurity_hamiltonian_(self, mo_coeff, ci, h2eff_sub=None, e_states=None, veff=None,
-                                      dm1s=None, casdm1rs=None, casdm2rs=None, weights=None):
+                                      dm1s=None, casdm1rs=None, casdm2rs=None, weights=None,
+                                      _cderi=None):
         '''Update the Hamiltonian data contained within this impurity solver and all encapsulated
         impurity objects'''
         from mrh.my_pyscf.gpu import libgpu
@@ -629,7 +726,7 @@ class ImpuritySolver ():
             casdm2rs = np.stack (casdm2rs, axis=1)
 
         # Set underlying SCF object Hamiltonian to state-averaged Heff
-        self._scf._update_impham_1_(veff, dm1s, e_tot=e_tot)
+        self._scf._update_impham_1_(veff, dm1s, e_tot=e_tot, _cderi=_cderi)
         casdm2sr = casdm2rs.transpose (1,0,2,3,4,5)
         casdm2r = casdm2sr[0] + casdm2sr[1] + casdm2sr[1].transpose (0,3,4,1,2) + casdm2sr[2]
         casdm1s = np.tensordot (weights, casdm1rs, axes=1)
@@ -677,13 +774,18 @@ class ImpuritySolver ():
     def get_vj_ext (self, mo_ext, dm1rs_ext, bmPu=None):
         output_shape = list (dm1rs_ext.shape[:-2]) + [self.mol.nao (), self.mol.nao ()]
         dm1 = dm1rs_ext.reshape (-1, mo_ext.shape[1], mo_ext.shape[1])
-        if bmPu is not None:
+        if bmPu is not None and not getattr (self._scf, '_aux_compressed', False):
             log = logger.new_logger (self, self.verbose)
             t_vj = (logger.process_clock(), logger.perf_counter())
             bPuu = np.tensordot (bmPu, mo_ext, axes=((0),(0)))
             rho = np.tensordot (dm1, bPuu, axes=((1,2),(1,2)))
-            bPii = self._scf._cderi
-            vj = lib.unpack_tril (np.tensordot (rho, bPii, axes=((-1),(0))))
+            vj = 0
+            b0 = 0
+            for bPii in self._scf._loop_cderi ():
+                b1 = b0 + bPii.shape[0]
+                vj += np.tensordot (rho[:,b0:b1], bPii, axes=((-1),(0)))
+                b0 = b1
+            vj = lib.unpack_tril (vj)
             t_vj = log.timer("vj ext", *t_vj)    
         else: # Safety case: AO-basis SCF driver
             imporb_coeff = self.mol.get_imporb_coeff ()
@@ -1000,7 +1102,8 @@ class ImpurityLASCI (lasci.LASCINoSymm, ImpuritySolver):
     _hop = ImpurityLASCI_HessianOperator
 
     def _update_impurity_hamiltonian_(self, mo_coeff, ci, h2eff_sub=None, e_states=None, veff=None,
-                                      dm1s=None, casdm1rs=None, casdm2rs=None, weights=None):
+                                      dm1s=None, casdm1rs=None, casdm2rs=None, weights=None,
+                                      _cderi=None):
         if weights is None: weights = self.weights
         if casdm1rs is None: casdm1rs = self.states_make_casdm1s (ci=self.ci)
         if casdm2rs is None: 
@@ -1020,7 +1123,7 @@ class ImpurityLASCI (lasci.LASCINoSymm, ImpuritySolver):
                 casdm2rs[:,:,i:j,i:j,i:j,i:j] = d2f[:]
         ImpuritySolver._update_impurity_hamiltonian_(
             self, mo_coeff, ci, h2eff_sub=h2eff_sub, e_states=e_states, veff=veff, dm1s=dm1s,
-            casdm1rs=casdm1rs, casdm2rs=casdm2rs, weights=weights
+            casdm1rs=casdm1rs, casdm2rs=casdm2rs, weights=weights, _cderi=_cderi
         )
 
     def get_grad_orb (self, **kwargs):
@@ -1088,6 +1191,50 @@ class ImpurityLASCI (lasci.LASCINoSymm, ImpuritySolver):
         return np.dot (self.weights, energy_elec)
 
 
+def get_impurity_cderi (las, imporb_coeffs):
+    '''Transform the whole-molecule density-fitting three-center integrals into the orbital
+    bases of several impurities at once, reading each block of auxiliary basis functions only
+    once.
+
+    Args:
+        las : instance of :class:`LASCINoSymm`
+        imporb_coeffs : list of ndarrays of shape (nao, *)
+            Impurity orbital coefficients in the whole-molecule AO basis
+
+    Returns:
+        cderis : list of ndarrays of shape (naux, *(*+1)/2) or None
+            Impurity-basis three-center integrals in the same order as imporb_coeffs. None if
+            the whole-molecule SCF object isn't density-fitted, if the GPU is in use, or if the
+            arrays don't all fit in memory together (or the outcore algorithm is forced).
+    '''
+    mf = las._scf
+    if getattr (mf, 'with_df', None) is None or getattr (las, 'use_gpu', False): return None
+    if IMPHAM_OUTCORE: return None
+    log = logger.new_logger (las, las.verbose)
+    t0 = (logger.process_clock(), logger.perf_counter())
+    naux = mf.with_df.get_naoaux ()
+    npairs = [c.shape[1]*(c.shape[1]+1)//2 for c in imporb_coeffs]
+    mem = 8*naux*sum (npairs)/1e6
+    mem_avail = las.max_memory*.95 - lib.current_memory ()[0]
+    if mem > mem_avail:
+        log.debug ('Not enough memory for fused impurity cderi (%.1f MB needed, %.1f MB avail)',
+                   mem, mem_avail)
+        return None
+    cderis = []
+    mos = []
+    for imporb_coeff, npair in zip (imporb_coeffs, npairs):
+        cderis.append (np.empty ((naux, npair), dtype=imporb_coeff.dtype))
+        mos.append (ao2mo.incore._conc_mos (imporb_coeff, imporb_coeff, compact=True))
+    b0 = 0
+    for eri1 in mf.with_df.loop ():
+        b1 = b0 + eri1.shape[0]
+        for cderi, (ijmosym, mij_pair, moij, ijslice) in zip (cderis, mos):
+            eri2 = cderi[b0:b1]
+            eri2 = ao2mo._ao2mo.nr_e2 (eri1, moij, ijslice, aosym='s2', mosym=ijmosym, out=eri2)
+        b0 = b1
+    log.timer ('Fused two-electron integrals for {} impurities'.format (len (cderis)), *t0)
+    return cderis
+
 def get_impurity_casscf (las, ifrag, imporb_builder=None):
     output = getattr (las.mol, 'output', None)
     # MRH: checking for '/dev/null' specifically as a string is how mol.build does it
@@ -1111,15 +1258,20 @@ def get_impurity_casscf (las, ifrag, imporb_builder=None):
     imc.__dict__.update (params.get (ifrag, {}))
     return imc
 
+# Guards the check-then-set of las._flas_stdout by concurrent tasks (see
+# lasscf_async.schedule_macrocycle), so that each output file is opened only once
+FLAS_STDOUT_LOCK = threading.Lock ()
+
 def get_pair_lasci (las, frags, inherit_df=False):
-    stdout_dict = stdout = getattr (las, '_flas_stdout', None)
-    if stdout is not None: stdout = stdout.get (frags, None)
     output = getattr (las.mol, 'output', None)
     if not ((output is None) or (output=='/dev/null')):
         output = output + '.' + '.'.join ([str (s) for s in frags])
-    imol = ImpurityMole (las, output=output, stdout=stdout)
-    if stdout is None and output is not None and stdout_dict is not None:
-        stdout_dict[frags] = imol.stdout
+    with FLAS_STDOUT_LOCK:
+        stdout_dict = stdout = getattr (las, '_flas_stdout', None)
+        if stdout is not None: stdout = stdout.get (frags, None)
+        imol = ImpurityMole (las, output=output, stdout=stdout)
+        if stdout is None and output is not None and stdout_dict is not None:
+            stdout_dict[frags] = imol.stdout
     imf = ImpurityHF (imol)
     if inherit_df and isinstance (las, _DFLASCI):
         imf = imf.density_fit ()
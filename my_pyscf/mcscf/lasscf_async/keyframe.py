@@ -46,6 +46,13 @@ class LASKeyframe (object):
                 h2eff_sub=self.h2eff_sub)
         return self._h1eff_sub
 
+    def populate_(self):
+        ''' Evaluate all of the lazily-computed attributes now, so that threads which share this
+        keyframe only read it '''
+        self._fock1 = self.fock1
+        self._h1eff_sub = self.h1eff_sub
+        return self
+
     def copy (self):
         ''' MO coefficients deepcopy; CI vectors shallow copy. Everything else, drop. '''
         mo1 = self.mo_coeff.copy ()
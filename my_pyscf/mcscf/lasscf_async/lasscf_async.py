@@ -1,4 +1,5 @@
 import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 from scipy import linalg
 from pyscf import lib
@@ -7,7 +8,7 @@ from mrh.my_pyscf.mcscf import lasci, lasscf_sync_o0
 from mrh.my_pyscf.mcscf.lasscf_guess import interpret_frags_atoms
 from mrh.my_pyscf.mcscf.lasscf_async import keyframe, combine
 from mrh.my_pyscf.mcscf.lasscf_async.split import get_impurity_space_constructor
-from mrh.my_pyscf.mcscf.lasscf_async.crunch import get_impurity_casscf
+from mrh.my_pyscf.mcscf.lasscf_async.crunch import get_impurity_casscf, get_impurity_cderi
 
 def kernel (las, mo_coeff=None, ci0=None, conv_tol_grad=1e-4,
             assert_no_dupes=False, verbose=lib.logger.NOTE, frags_orbs=None,
@@ -53,45 +54,15 @@ def kernel (las, mo_coeff=None, ci0=None, conv_tol_grad=1e-4,
     impurities = [get_impurity_casscf (las, i, imporb_builder=builder)
                   for i, builder in enumerate (imporb_builders)]
     t1 = log.timer_debug1 ('impurity solver construction', *t0)
-    # GRAND CHALLENGE: replace rigid algorithm below with dynamic task scheduling
+    nworkers = min (getattr (las, 'frag_nthreads', 1), nfrags)
     for it in range (las.max_cycle_macro):
         t_macro = (lib.logger.process_clock(), lib.logger.perf_counter())    
-        # 1. Divide into fragments
-        for impurity in impurities: 
-            impurity._pull_keyframe_(kf1)
-            t_macro = log.timer("Pull keyframe for fragment",*t_macro)
-        
-        # 2. CASSCF on each fragment
-        kf2_list = []
-        for impurity in impurities:
-            impurity.kernel ()
-            t_macro = log.timer("Fragment CASSCF",*t_macro)
-            kf2_list.append (impurity._push_keyframe (kf1))
-            t_macro = log.timer("Push keyframe for fragment",*t_macro)
-
-            
-        # 3. Combine from fragments. It should not be necessary to do this in any particular order,
-        #    and the below does it March Madness tournament style; e.g.:
-        #
-        #       kf2_list[0] --- kf2_list[1]     kf2_list[2] --- kf2_list[3]
-        #                    |                               |
-        #                   kfi --------------------------- kfj
-        #                                    |
-        #                                   kf2
-        #
-        nkf = len (kf2_list)
-        ncyc = int (np.ceil (np.log2 (nkf)))
-        for i in range (int (np.ceil (np.log2 (nkf)))):
-            nkfi = len (kf2_list)
-            kf3_list = []
-            for kf2, kf3 in zip (kf2_list[::2],kf2_list[1::2]):
-                kf3_list.append (combine.combine_pair (las, kf2, kf3, kf_ref=kf1))
-                t_macro = log.timer("Recombination",*t_macro)
-            if nkfi%2: kf3_list.insert (len(kf3_list)-1, kf2_list[-1])
-            # Insert this at second-to-last position so that it gets "mixed in" next cycle
-            kf2_list = kf3_list
-        assert (len (kf2_list) == 1)
-        kf1 = kf2_list[0]
+        if nworkers > 1:
+            # Steps 1-3 of rigid_macrocycle as concurrent tasks
+            kf1 = schedule_macrocycle (las, impurities, kf1, nworkers, log)
+            t_macro = log.timer ("Scheduled fragment CASSCF and recombination tasks", *t_macro)
+        else:
+            kf1 = rigid_macrocycle (las, impurities, kf1, log, t_macro)
 
         # Evaluate status and break if converged
         e_tot = las.energy_nuc () + las.energy_elec (
@@ -140,6 +111,148 @@ def kernel (las, mo_coeff=None, ci0=None, conv_tol_grad=1e-4,
     e_cas = None # TODO: get rid of this worthless, meaningless variable
     return converged, e_tot, e_states, mo_energy, mo_coeff, e_cas, ci1, h2eff_sub, veff
 
+def rigid_macrocycle (las, impurities, kf1, log, t_macro):
+    '''Solve the impurity problems one at a time and then combine the resulting keyframes in a
+    fixed pairwise tournament'''
+    # 1. Divide into fragments
+    pull_kwargs = prepare_pull_keyframe (las, impurities, kf1, log)
+    for impurity, kwargs in zip (impurities, pull_kwargs):
+        impurity._pull_keyframe_(kf1, **kwargs)
+        t_macro = log.timer("Pull keyframe for fragment",*t_macro)
+    
+    # 2. CASSCF on each fragment
+    kf2_list = []
+    for impurity in impurities:
+        impurity.kernel ()
+        t_macro = log.timer("Fragment CASSCF",*t_macro)
+        kf2_list.append (impurity._push_keyframe (kf1))
+        t_macro = log.timer("Push keyframe for fragment",*t_macro)
+
+        
+    # 3. Combine from fragments. It should not be necessary to do this in any particular order,
+    #    and the below does it March Madness tournament style; e.g.:
+    #
+    #       kf2_list[0] --- kf2_list[1]     kf2_list[2] --- kf2_list[3]
+    #                    |                               |
+    #                   kfi --------------------------- kfj
+    #                                    |
+    #                                   kf2
+    #
+    for i, j in get_combine_tree (len (kf2_list)):
+        kf2_list.append (combine.combine_pair (las, kf2_list[i], kf2_list[j], kf_ref=kf1))
+        kf2_list[i] = kf2_list[j] = None
+        t_macro = log.timer("Recombination",*t_macro)
+    return kf2_list[-1]
+
+def get_combine_tree (nkf):
+    '''The pairs of keyframes combined by a macrocycle, in a fixed pairwise tournament.
+    Keyframes 0 to nkf-1 come from the impurity problems, and keyframe nkf+k is the result of
+    the kth pair. Each round pairs off the keyframes left in the tournament in order; if their
+    number is odd, the last one is moved to the second-to-last position of the next round, so
+    that it gets "mixed in" there.
+
+    Args:
+        nkf : integer
+            Number of keyframes to combine
+
+    Returns:
+        tree : list of length nkf-1 of tuples of 2 integers
+            Indices of the keyframes combined by each pair
+    '''
+    tree = []
+    kf_list = list (range (nkf))
+    while len (kf_list) > 1:
+        kf3_list = []
+        for i, j in zip (kf_list[::2], kf_list[1::2]):
+            kf3_list.append (nkf + len (tree))
+            tree.append ((i, j))
+        if len (kf_list)%2: kf3_list.insert (len(kf3_list)-1, kf_list[-1])
+        kf_list = kf3_list
+    return tree
+
+def schedule_macrocycle (las, impurities, kf1, nworkers, log):
+    '''Solve the impurity problems and combine the resulting keyframes as concurrent tasks on
+    a pool of nworkers Python threads. The keyframes are combined in the same fixed pairs as in
+    rigid_macrocycle, so the result does not depend on the order in which the tasks finish, but
+    each combination starts as soon as both of its keyframes are available, rather than waiting
+    for all impurity problems to finish.
+
+    Args:
+        las : instance of :class:`LASSCFNoSymm`
+        impurities : list of length nfrags of impurity CASSCF solvers
+        kf1 : instance of :class:`LASKeyframe`
+            Keyframe at the beginning of the macrocycle
+        nworkers : integer
+            Number of tasks that run at the same time
+        log : instance of :class:`pyscf.lib.logger.Logger`
+
+    Returns:
+        kf2 : instance of :class:`LASKeyframe`
+            Keyframe combining the results of all impurity problems
+    '''
+    omp_nthreads = max (1, lib.num_threads () // nworkers)
+    # The shared keyframe is only read by the tasks
+    kf1.populate_()
+    pull_kwargs = prepare_pull_keyframe (las, impurities, kf1, log)
+    def impurity_task (impurity, kwargs):
+        with lib.with_omp_threads (omp_nthreads):
+            impurity._pull_keyframe_(kf1, **kwargs)
+            impurity.kernel ()
+            return impurity._push_keyframe (kf1)
+    def combine_task (kf2, kf3):
+        with lib.with_omp_threads (omp_nthreads):
+            return combine.combine_pair (las, kf2, kf3, kf_ref=kf1)
+    def timed (label, fn, *args):
+        w0 = lib.logger.perf_counter ()
+        kf = fn (*args)
+        return label, kf, lib.logger.perf_counter () - w0
+    nkf = len (impurities)
+    tree = get_combine_tree (nkf)
+    kf_list = [None for i in range (nkf + len (tree))]
+    with ThreadPoolExecutor (max_workers=nworkers) as executor:
+        pending = {}
+        for i, (impurity, kwargs) in enumerate (zip (impurities, pull_kwargs)):
+            label = 'Fragment {} CASSCF'.format (i)
+            pending[executor.submit (timed, label, impurity_task, impurity, kwargs)] = i
+        todo = list (range (len (tree)))
+        while len (pending):
+            done = wait (list (pending.keys ()), return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                label, kf, dw = future.result ()
+                log.debug ('%s task: wall time %9.2f sec', label, dw)
+                kf_list[pending.pop (future)] = kf
+            for k in list (todo):
+                i, j = tree[k]
+                if kf_list[i] is None or kf_list[j] is None: continue
+                todo.remove (k)
+                kf2, kf3 = kf_list[i], kf_list[j]
+                kf_list[i] = kf_list[j] = None
+                label = 'Recombination {} {}'.format (sorted (kf2.frags), sorted (kf3.frags))
+                pending[executor.submit (timed, label, combine_task, kf2, kf3)] = nkf + k
+    assert (len (todo) == 0)
+    return kf_list[-1]
+
+def prepare_pull_keyframe (las, impurities, kf1, log):
+    '''Build the impurity orbital subspaces for all impurities and, if density fitting is used,
+    transform the three-center integrals into all of them in a single pass over the whole-molecule
+    cderi array.
+
+    Args:
+        las : instance of :class:`LASSCFNoSymm`
+        impurities : list of length nfrags of impurity CASSCF solvers
+        kf1 : instance of :class:`LASKeyframe`
+            Keyframe at the beginning of the macrocycle
+        log : instance of :class:`pyscf.lib.logger.Logger`
+
+    Returns:
+        pull_kwargs : list of length nfrags of dict
+            Kwargs for each impurity's _pull_keyframe_ method
+    '''
+    spaces = [impurity._get_imporb_space (kf1) for impurity in impurities]
+    cderis = get_impurity_cderi (las, [space[0] for space in spaces])
+    if cderis is None: cderis = [None for space in spaces]
+    return [{'imporb_space': space, '_cderi': cderi} for space, cderi in zip (spaces, cderis)]
+
 def get_grad (las, mo_coeff=None, ci=None, ugg=None, kf=None):
     '''Return energy gradient for orbital rotation and CI relaxation.
 
@@ -204,6 +317,10 @@ class LASSCFNoSymm (lasci.LASCINoSymm):
         for the ``LASCI'' step.
     combine_pair_max_frags : integer
         Maximum number of frags to simultaneously relax during the combine_pair step.
+    frag_nthreads : integer
+        If greater than 1, the impurity CASSCF problems and the combine_pair steps of each
+        macrocycle are scheduled as tasks on this many Python threads, and each combine_pair
+        step starts as soon as two keyframes are available.
     '''
     def __init__(self, mf, ncas, nelecas, ncore=None, spin_sub=None, **kwargs):
         lasci.LASCINoSymm.__init__(self, mf, ncas, nelecas, ncore=ncore, spin_sub=spin_sub,
@@ -3,7 +3,7 @@ from scipy import linalg
 from mrh.util.la import matrix_svd_control_options
 from mrh.my_pyscf.mcscf import lasci, lasci_sync, _DFLASCI
 from mrh.my_pyscf.mcscf import lasscf_guess
-from pyscf import gto, scf, symm
+from pyscf import gto, scf, symm, lib
 from pyscf.mcscf import mc_ao2mo, casci_symm, mc1step
 from pyscf.mcscf import df as mc_df
 from pyscf.lo import orth
@@ -46,8 +46,26 @@ class LASSCF_HessianOperator (lasci_sync.LASCI_HessianOperator):
     #   7) current prec may not be "good enough" - get_prec
     #   8) define "gx" in this context - get_gx 
 
+    _prev_eris = None
+    h2eff_sub_norm_uext = 0
+
+    def __init__(self, las, ugg, h2eff_sub=None, **kwargs):
+        # Left by an incremental update of h2eff_sub in the previous macrocycle, if any. The
+        # carried ERIs are used once, so drop them from h2eff_sub to avoid keeping them alive.
+        self.h2eff_sub_norm_uext = getattr (h2eff_sub, 'norm_uext', 0)
+        self._prev_eris = getattr (h2eff_sub, 'prev_eris', None)
+        if self._prev_eris is not None: del h2eff_sub.prev_eris
+        lasci_sync.LASCI_HessianOperator.__init__(self, las, ugg, h2eff_sub=h2eff_sub, **kwargs)
+
     def _init_eri_(self):
         lasci_sync._init_df_(self)
+        if self._prev_eris is not None:
+            t0 = (logger.process_clock (), logger.perf_counter ())
+            self.cas_type_eris = self._prev_eris.rotate (self.mo_coeff, self.las._scf.get_ovlp (),
+                                                         self.ncore, self.ncas)
+            self._prev_eris = None
+            logger.timer (self.las, 'rotate cas-type ERIs of previous macrocycle', *t0)
+            return
         if isinstance (self.las, _DFLASCI):
             self.cas_type_eris = mc_df._ERIS (self.las, self.mo_coeff, self.with_df)
         else:
@@ -141,7 +159,89 @@ class LASSCF_HessianOperator (lasci_sync.LASCI_HessianOperator):
             return gorb + (f1_prime - f1_prime.T)
 
     def _update_h2eff_sub (self, mo1, umat, h2eff_sub):
-        return self.las.ao2mo (mo1)
+        ''' Rebuild h2eff_sub from scratch, unless the norm of the active-unactive block of the
+        orbital rotations accumulated since it was last rebuilt is smaller than
+        las.h2eff_incr_thresh, in which case update it from the previous one and the cached (pp|aa)
+        and (pa|pa) integrals. The incremental update is exact in the first index and in the
+        active-active block of umat, and neglects terms of second order in the active-unactive
+        block. The bmPu tag is rotated by the active-active block of umat only; since fast_veffa
+        only uses it for the change of veff due to a change of the active-space density matrix,
+        the neglected terms are again of second order. The (pp|aa) and (pa|pa) integrals are
+        carried forward in the prev_eris tag, so that the next Hessian operator rotates them
+        instead of building them from scratch (see _init_eri_). '''
+        las = self.las
+        ncore, ncas, nocc, nmo = self.ncore, self.ncas, self.nocc, self.nmo
+        thresh = getattr (las, 'h2eff_incr_thresh', 0)
+        uext = umat[:,ncore:nocc].copy ()
+        uext[ncore:nocc,:] = 0
+        norm_uext = self.h2eff_sub_norm_uext + linalg.norm (uext)
+        eris = getattr (self, 'cas_type_eris', None)
+        self.h2eff_sub_incr = (norm_uext < thresh) and (eris is not None)
+        if not self.h2eff_sub_incr:
+            return las.ao2mo (mo1)
+        logger.debug (las, 'Incremental h2eff_sub update with accumulated |U_xa| = %e', norm_uext)
+        ucas = umat[ncore:nocc,ncore:nocc]
+        # Zeroth order in uext: rotate h2eff_sub and bmPu like LASCI
+        h2eff_sub1 = lasci_sync.LASCI_HessianOperator._update_h2eff_sub (self, mo1, umat, h2eff_sub)
+        bmPu = getattr (h2eff_sub1, 'bmPu', None)
+        # First order in uext: one active index at a time from the unactive orbitals
+        h2eff_corr = np.zeros ((nmo, ncas, ncas, ncas), dtype=umat.dtype)
+        mem_av = las.max_memory - lib.current_memory ()[0]
+        blksize = int (max (1, min (nmo, mem_av*1e6/8/(6*nmo*ncas*ncas + 2*ncas**3))))
+        for p0, p1 in lib.prange (0, nmo, blksize):
+            corr = np.tensordot (np.asarray (eris.ppaa[p0:p1]), uext, axes=((1),(0))) # pbca
+            corr = np.tensordot (corr, ucas, axes=((1),(0))) # pcab
+            corr = np.tensordot (corr, ucas, axes=((1),(0))) # pabc
+            para = np.tensordot (np.asarray (eris.papa[p0:p1]), ucas, axes=((1),(0))) # pxca
+            para = np.tensordot (para, uext, axes=((1),(0))) # pcab
+            para = np.tensordot (para, ucas, axes=((1),(0))) # pabc
+            corr += para + para.transpose (0,1,3,2)
+            h2eff_corr += np.tensordot (umat[p0:p1], corr, axes=((0),(0)))
+        h2eff_corr = lib.pack_tril (h2eff_corr.reshape (nmo*ncas, ncas, ncas)).reshape (nmo, -1)
+        h2eff_sub1 = np.asarray (h2eff_sub1) + h2eff_corr
+        # The neglected terms break the permutation symmetry of the (aa|aa) block, which other
+        # code assumes; restore it
+        eri_cas = lib.unpack_tril (h2eff_sub1[ncore:nocc].reshape (ncas*ncas, -1))
+        eri_cas = eri_cas.reshape ([ncas,]*4)
+        eri_cas = (eri_cas + eri_cas.transpose (1,0,2,3)) / 2
+        eri_cas = (eri_cas + eri_cas.transpose (2,3,0,1)) / 2
+        h2eff_sub1[ncore:nocc] = lib.pack_tril (eri_cas.reshape (ncas*ncas, ncas, ncas)).reshape (
+            ncas, -1)
+        tags = {'norm_uext': norm_uext}
+        if bmPu is not None: tags['bmPu'] = bmPu
+        mem_eris = 6*8*nmo*nmo*ncas*ncas/1e6
+        if mem_eris < las.max_memory - lib.current_memory ()[0]:
+            tags['prev_eris'] = _PrevERIS (eris, self.mo_coeff)
+        return lib.tag_array (h2eff_sub1, **tags)
+
+class _PrevERIS (object):
+    ''' The cas_type_eris of a LASSCF_HessianOperator, and the MO coefficients defining their
+    basis, carried forward to the next macrocycle by an incremental h2eff_sub update '''
+    def __init__(self, eris, mo_coeff):
+        self.eris = eris
+        self.mo_coeff = mo_coeff
+
+    def rotate (self, mo1, s1e, ncore, ncas):
+        ''' (pp|aa) and (pa|pa) integrals in the basis of mo1. The general indices are rotated
+        exactly, but the active indices only by the active-active block of the rotation; terms of
+        first order in its active-unactive block are neglected. '''
+        nocc = ncore + ncas
+        umat = self.mo_coeff.conj ().T @ s1e @ mo1
+        ucas = umat[ncore:nocc,ncore:nocc]
+        ppaa = np.tensordot (umat, np.asarray (self.eris.ppaa), axes=((0),(0))) # pqab
+        ppaa = np.tensordot (ppaa, umat, axes=((1),(0))) # pabq
+        ppaa = np.tensordot (ppaa, ucas, axes=((1),(0))) # pbqa
+        ppaa = np.tensordot (ppaa, ucas, axes=((1),(0))) # pqab
+        papa = np.tensordot (umat, np.asarray (self.eris.papa), axes=((0),(0))) # paqb
+        papa = np.tensordot (papa, ucas, axes=((1),(0))) # pqba
+        papa = np.tensordot (papa, umat, axes=((1),(0))) # pbaq
+        papa = np.tensordot (papa, ucas, axes=((1),(0))) # paqb
+        return _RotatedERIS (np.ascontiguousarray (ppaa), np.ascontiguousarray (papa))
+
+class _RotatedERIS (object):
+    def __init__(self, ppaa, papa):
+        self.ppaa = ppaa
+        self.papa = papa
 
 class LASSCFNoSymm (lasci.LASCINoSymm):
     _ugg = LASSCF_UnitaryGroupGenerators
@@ -1,7 +1,8 @@
 import unittest
 import numpy as np
 from pyscf import gto, scf
-from mrh.my_pyscf.dmet import runDMET
+from mrh.my_pyscf.dmet import runDMET, runMultiDMET
+from mrh.my_pyscf.df.compress import compress_cderi
 
 '''
 ***** RHF Embedding *****
@@ -97,9 +98,35 @@ class KnownValues(unittest.TestCase):
         e_ref = mf.e_tot
         dmet_mf = runDMET(mf, lo_method='lowdin', bath_tol=1e-10, atmlst=[0,])[0]
         e_check = dmet_mf.e_tot
-        del mol, mf, dmet_mf
         self.assertAlmostEqual(e_ref, e_check, 6)
+        with self.subTest('aux compression'):
+            dmet_mf, mydmet = runDMET(mf, lo_method='lowdin', bath_tol=1e-10, atmlst=[0,], aux_tol=1e-12)
+            neo = mydmet.ao2eo.shape[1]
+            self.assertLessEqual(dmet_mf.with_df._cderi.shape[0], neo*(neo+1)//2)
+            self.assertLess(dmet_mf.with_df._cderi.shape[0], mf.with_df.get_naoaux())
+            self.assertAlmostEqual(e_ref, dmet_mf.e_tot, 6)
+        with self.subTest('incompressible aux basis'):
+            cderi = np.random.default_rng(0).standard_normal((neo, neo*(neo+1)//2))
+            self.assertIs(compress_cderi(cderi, tol=1e-12), cderi)
+        del mol, mf, dmet_mf
     
+    def test_multi_dmet_rhf(self):
+        mol = get_mole1()
+        mf = scf.RHF(mol).density_fit()
+        mf.kernel()
+        atmlsts = [[0,], [1,], [2,]]
+        e_ref = [runDMET(mf, lo_method='lowdin', bath_tol=1e-10, atmlst=atmlst)[0].e_tot
+                 for atmlst in atmlsts]
+        for nthreads in (1, 2):
+            with self.subTest(nthreads=nthreads):
+                dmet_mfs, mydmets = runMultiDMET(mf, atmlsts, lo_method='lowdin', bath_tol=1e-10,
+                                                 nthreads=nthreads, verbose=mol.verbose)
+                self.assertEqual(len(dmet_mfs), len(atmlsts))
+                for e0, dmet_mf in zip(e_ref, dmet_mfs):
+                    self.assertAlmostEqual(e0, dmet_mf.e_tot, 6)
+                    self.assertAlmostEqual(mf.e_tot, dmet_mf.e_tot, 6)
+        del mol, mf, dmet_mfs
+
     # ROHF Embedding
     def test_vanilla_rohf(self):
         mol = get_mole2()
@@ -120,8 +120,34 @@ def case_trans_ppdm (self, norb, nelec, spin):
             print (i,j,ppdm[i,j],ppdm_ref[i,j])
     self.assertAlmostEqual (lib.fp (ppdm), lib.fp (ppdm_ref), 8)
 
+def case_trans_rdm12s_batch (self, norb, nelec):
+    ndeta = cistring.num_strings (norb,nelec[0])
+    ndetb = cistring.num_strings (norb,nelec[1])
+    cibra = 1 - 2*(rng.random ((3, ndeta, ndetb), dtype=float))
+    ciket = 1 - 2*(rng.random ((4, ndeta, ndetb), dtype=float))
+    tdm1s_ref = np.zeros ((3,4,2,norb,norb))
+    tdm2s_ref = np.zeros ((3,4,4,norb,norb,norb,norb))
+    for i, j in itertools.product (range (3), range (4)):
+        d1s, d2s = direct_spin1.trans_rdm12s (cibra[i], ciket[j], norb, nelec)
+        tdm1s_ref[i,j] = np.stack (d1s, axis=0).transpose (0,2,1)
+        tdm2s_ref[i,j] = np.stack (d2s, axis=0)
+    # Memory for 5 bra or ket intermediates: both the bras and the kets are split into blocks
+    mem5 = 5 * 2 * norb * norb * ndeta * ndetb * 8 / 1e6
+    for max_memory in (None, mem5, 1e-6):
+        tdm1s, tdm2s = rdm.trans_rdm12s_batch (cibra, ciket, norb, nelec, max_memory=max_memory)
+        self.assertAlmostEqual (lib.fp (tdm1s), lib.fp (tdm1s_ref), 8)
+        self.assertAlmostEqual (lib.fp (tdm2s), lib.fp (tdm2s_ref), 8)
+    tdm1s, tdm2s = rdm.trans_rdm12s_batch (cibra, ciket, norb, nelec, do2=False)
+    self.assertAlmostEqual (lib.fp (tdm1s), lib.fp (tdm1s_ref), 8)
+    self.assertIsNone (tdm2s)
+
 class KnownValues(unittest.TestCase):
 
+    def test_trans_rdm12s_batch (self):
+        for norb, nelec in cases:
+            with self.subTest (norb=norb, nelec=nelec):
+                case_trans_rdm12s_batch (self, norb, nelec)
+
     def test_trans_rdm13hs (self):
         for norb, nelec in cases:
             with self.subTest (norb=norb, nelec=nelec):
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from pyscf import gto, scf, lib
+from mrh.my_pyscf.grad import numeric as numeric_grad
+
+def setUpModule ():
+    global mol, mf, de_ref
+    mol = gto.M (atom='O 0 0 0; H 0.95 0.1 0; H -0.3 0.9 0.1', basis='sto-3g', verbose=0,
+                 output='/dev/null')
+    mf = scf.RHF (mol)
+    mf.conv_tol = 1e-12
+    mf.kernel ()
+    de_ref = mf.nuc_grad_method ().kernel ()
+
+def tearDownModule ():
+    global mol, mf, de_ref
+    mol.stdout.close ()
+    del mol, mf, de_ref
+
+class _CountingScanner:
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.ncalls = 0
+    def __call__(self, atom):
+        self.ncalls += 1
+        return self.scanner (atom)
+
+class KnownValues (unittest.TestCase):
+
+    def test_nproc (self):
+        de = {}
+        for nproc in (1, 2):
+            with self.subTest (nproc=nproc):
+                mygrad = numeric_grad.Gradients (mf, stepsize=1e-4, nproc=nproc)
+                mygrad.scanner.conv_tol = 1e-12
+                de[nproc] = mygrad.kernel ()
+                self.assertAlmostEqual (abs (de[nproc] - de_ref).max (), 0, 6)
+        self.assertAlmostEqual (abs (de[2] - de[1]).max (), 0, 8)
+
+    def test_nproc_omp (self):
+        # The parent has already run OpenMP regions with several threads before it forks
+        with lib.with_omp_threads (4):
+            mf1 = scf.RHF (mol)
+            mf1.conv_tol = 1e-12
+            mf1.kernel ()
+            mygrad = numeric_grad.Gradients (mf1, stepsize=1e-4, nproc=2)
+            mygrad.scanner.conv_tol = 1e-12
+            de = mygrad.kernel ()
+        self.assertAlmostEqual (abs (de - de_ref).max (), 0, 6)
+
+    def test_restart (self):
+        with tempfile.TemporaryDirectory () as tmpdir:
+            chkfile = os.path.join (tmpdir, 'numgrad.chk')
+            mygrad = numeric_grad.Gradients (mf, stepsize=1e-4, chkfile=chkfile)
+            mygrad.scanner.conv_tol = 1e-12
+            de0 = mygrad.kernel ()
+            with h5py.File (chkfile, 'a') as fh5:
+                self.assertEqual (len (fh5['numgrad']), 6*mol.natm)
+                del fh5['numgrad/1_2_p']
+                del fh5['numgrad/2_0_m']
+            mygrad = numeric_grad.Gradients (mf, stepsize=1e-4, chkfile=chkfile)
+            mygrad.scanner.conv_tol = 1e-12
+            mygrad.scanner = _CountingScanner (mygrad.scanner)
+            de1 = mygrad.kernel ()
+            # The two missing displacements, plus resetting the scanner to the reference geometry
+            self.assertEqual (mygrad.scanner.ncalls, 3)
+            self.assertAlmostEqual (abs (de1 - de0).max (), 0, 8)
+            with h5py.File (chkfile, 'r') as fh5:
+                self.assertEqual (len (fh5['numgrad']), 6*mol.natm)
+            # Records at a different step size are not reused
+            mygrad = numeric_grad.Gradients (mf, stepsize=2e-4, chkfile=chkfile)
+            mygrad.scanner.conv_tol = 1e-12
+            mygrad.scanner = _CountingScanner (mygrad.scanner)
+            mygrad.kernel ()
+            self.assertEqual (mygrad.scanner.ncalls, 6*mol.natm+1)
+
+    def test_reference_geometry (self):
+        # x + 1e-4 - 1e-4 != x for x = 0.99995 in floating point
+        mol1 = gto.M (atom='O 0 0 0; H 0.99995 0.1 0; H -0.3 0.9 0.1', basis='sto-3g',
+                      verbose=0, output='/dev/null')
+        mf1 = scf.RHF (mol1)
+        mf1.conv_tol = 1e-12
+        mf1.kernel ()
+        with tempfile.TemporaryDirectory () as tmpdir:
+            chkfile = os.path.join (tmpdir, 'numgrad.chk')
+            mygrad = numeric_grad.Gradients (mf1, stepsize=1e-4, chkfile=chkfile)
+            mygrad.scanner.conv_tol = 1e-12
+            mygrad.scanner = _CountingScanner (mygrad.scanner)
+            de0 = mygrad.kernel ()
+            self.assertEqual (mygrad.scanner.ncalls, 6*mol1.natm+1)
+            self.assertAlmostEqual (mygrad.scanner.scanner.e_tot, mf1.e_tot, 10)
+            with h5py.File (chkfile, 'r') as fh5:
+                self.assertEqual (len (fh5['numgrad']), 6*mol1.natm)
+            mygrad = numeric_grad.Gradients (mf1, stepsize=1e-4, chkfile=chkfile)
+            mygrad.scanner = _CountingScanner (mygrad.scanner)
+            de1 = mygrad.kernel ()
+            self.assertEqual (mygrad.scanner.ncalls, 0)
+            self.assertAlmostEqual (abs (de1 - de0).max (), 0, 12)
+        mol1.stdout.close ()
+
+if __name__ == "__main__":
+    print("Full Tests for numeric gradients")
+    unittest.main()
@@ -109,6 +109,34 @@ class KnownValues(unittest.TestCase):
         e_lexc = np.concatenate ([item for sublist in las_test.e_lexc for item in sublist])
         self.assertTrue (np.all (e_lexc>-1e-8))
 
+    def test_frag_nthreads (self):
+        from mrh.my_pyscf.mcscf import lasci_sync
+        _check_()
+        las_test = las_ref[0].state_average (weights=weights, **states)
+        mo_coeff, ci0 = las_test.mo_coeff, las_test.ci
+        h2eff_sub = las_test.get_h2eff (mo_coeff)
+        casdm1frs = las_test.states_make_casdm1s_sub (ci=ci0)
+        veff = las_test.get_veff (dm=las_test.make_rdm1 (mo_coeff=mo_coeff, ci=ci0))
+        veff = las_test.split_veff (veff, h2eff_sub, mo_coeff=mo_coeff, ci=ci0)
+        log = lib.logger.new_logger (las_test, las_test.verbose)
+        e_ref, ci_ref = lasci_sync.ci_cycle (las_test, mo_coeff, ci0, veff, h2eff_sub,
+                                             casdm1frs, log)
+        las_test.frag_nthreads = 3
+        e_test, ci_test = lasci_sync.ci_cycle (las_test, mo_coeff, ci0, veff, h2eff_sub,
+                                               casdm1frs, log)
+        self.assertAlmostEqual (lib.fp (e_test), lib.fp (e_ref), 9)
+        for c_test, c_ref in zip (ci_test, ci_ref):
+            for c1, c0 in zip (c_test, c_ref):
+                self.assertAlmostEqual (abs (np.dot (c1.ravel (), c0.ravel ())), 1, 8)
+        with self.subTest ('memory split'):
+            frags = list (range (las_test.nfrags))
+            for nworkers in (1, 2, 3):
+                mem = lasci_sync.split_ci_cycle_threads (las_test, frags, nworkers,
+                                                         max_memory=1000)[1]
+                mem = sorted (mem.values (), reverse=True)
+                self.assertLessEqual (sum (mem[:nworkers]), 1000 + 1e-8)
+                self.assertTrue (all ([m > 0 for m in mem]))
+
     def test_convergence_slow (self):
         _check_()
         las_test = las.state_average (weights=weights, **states)
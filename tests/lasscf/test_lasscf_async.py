@@ -27,9 +27,11 @@ def tearDownModule():
     mf.stdout.close ()
     del mf, frag_atom_list, mo0
 
-def _run_mod (mod):
-    las=mod.LASSCF(mf, (2,2), (2,2))
+def _run_mod (mod, mf1=None, **kwargs):
+    if mf1 is None: mf1 = mf
+    las=mod.LASSCF(mf1, (2,2), (2,2))
     las.conv_tol_grad = 1e-7
+    las.set (**kwargs)
     localize_fn = getattr (las, 'set_fragments_', las.localize_init_guess)
     mo_coeff=localize_fn (frag_atom_list, mo0)
     las.state_average_(weights=[.2,]*5,
@@ -47,12 +49,82 @@ class KnownValues (unittest.TestCase):
         las_syn = _run_mod (syn)
         with self.subTest ('synchronous calculation converged'):
             self.assertTrue (las_syn.converged)
+        las_thr = _run_mod (asyn, frag_nthreads=2)
+        with self.subTest ('scheduled asynchronous calculation converged'):
+            self.assertTrue (las_thr.converged)
+            self.assertAlmostEqual (las_syn.e_tot, las_thr.e_tot, 7)
+            # Keyframes are combined in the same fixed order as in the unthreaded calculation
+            self.assertAlmostEqual (las_asyn.e_tot, las_thr.e_tot, 9)
         with self.subTest ('average energy'):
             self.assertAlmostEqual (las_syn.e_tot, las_asyn.e_tot, 7)
         for i in range (5):
             with self.subTest ('energy', state=i):
                 self.assertAlmostEqual (las_syn.e_states[i], las_asyn.e_states[i], 6)
 
+    def test_combine_tree (self):
+        from mrh.my_pyscf.mcscf.lasscf_async.lasscf_async import get_combine_tree
+        self.assertEqual (get_combine_tree (1), [])
+        self.assertEqual (get_combine_tree (5), [(0,1), (2,3), (5,4), (6,7)])
+        for nkf in range (2, 9):
+            with self.subTest (nkf=nkf):
+                tree = get_combine_tree (nkf)
+                self.assertEqual (len (tree), nkf-1)
+                # Every keyframe but the last is combined exactly once, after it is made
+                used = sorted (sum ([list (pair) for pair in tree], []))
+                self.assertEqual (used, list (range (2*nkf-2)))
+                for k, (i, j) in enumerate (tree):
+                    self.assertLess (max (i, j), nkf+k)
+
+    def test_impurity_cderi (self):
+        from mrh.my_pyscf.mcscf.lasscf_async.split import get_impurity_space_constructor
+        from mrh.my_pyscf.mcscf.lasscf_async.crunch import get_impurity_casscf
+        las = asyn.LASSCF (mf.density_fit (), (2,2), (2,2))
+        mo_coeff = las.set_fragments_(frag_atom_list, mo0)
+        ci0 = las.get_init_guess_ci (mo_coeff)
+        kf = las.get_keyframe (mo_coeff, ci0)
+        impurities = [get_impurity_casscf (las, i, imporb_builder=get_impurity_space_constructor (
+                        las, i, frag_orbs=frag_orbs)) for i, frag_orbs in enumerate (las.frags_orbs)]
+        log = lib.logger.new_logger (las, las.verbose)
+        pull_kwargs = asyn.lasscf_async.prepare_pull_keyframe (las, impurities, kf, log)
+        for i, (impurity, kwargs) in enumerate (zip (impurities, pull_kwargs)):
+            impurity._pull_keyframe_(kf)
+            cderi_ref = impurity._scf.with_df._cderi
+            with self.subTest (frag=i):
+                self.assertEqual (kwargs['_cderi'].shape, cderi_ref.shape)
+                self.assertAlmostEqual (lib.fp (kwargs['_cderi']), lib.fp (cderi_ref), 9)
+
+    def test_impham_outcore_direct (self):
+        from mrh.my_pyscf.mcscf.lasscf_async import crunch
+        with self.subTest ('integral-direct'):
+            mf1 = mf.copy ()
+            mf1._eri = None
+            crunch.IMPHAM_DIRECT = True
+            try:
+                las_test = _run_mod (asyn, mf1=mf1)
+            finally:
+                crunch.IMPHAM_DIRECT = False
+            las_ref = _run_mod (syn)
+            self.assertTrue (las_test.converged)
+            self.assertAlmostEqual (las_test.e_tot, las_ref.e_tot, 7)
+        with self.subTest ('outcore'):
+            mf_df = mf.density_fit ().run ()
+            crunch.IMPHAM_OUTCORE = True
+            try:
+                las_test = _run_mod (asyn, mf1=mf_df)
+            finally:
+                crunch.IMPHAM_OUTCORE = False
+            las_ref = _run_mod (syn, mf1=mf_df)
+            self.assertTrue (las_test.converged)
+            self.assertAlmostEqual (las_test.e_tot, las_ref.e_tot, 7)
+        with self.subTest ('aux compression'):
+            crunch.IMPHAM_AUX_TOL = 1e-12
+            try:
+                las_test = _run_mod (asyn, mf1=mf_df)
+            finally:
+                crunch.IMPHAM_AUX_TOL = 0
+            self.assertTrue (las_test.converged)
+            self.assertAlmostEqual (las_test.e_tot, las_ref.e_tot, 7)
+
 if __name__ == "__main__":
     print("Full Tests for lasscf_async")
     unittest.main()
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import copy
 import unittest
 import tempfile
@@ -71,6 +72,74 @@ class KnownValues(unittest.TestCase):
         las = LASSCF (mf_hs_df, (4,), ((4,0),), spin_sub=(5,)).set (conv_tol_grad=1e-5).run ()
         self.assertAlmostEqual (las.e_tot, mf_hs_df.e_tot, 8)
 
+    def test_h2eff_df_nthreads (self):
+        from mrh.my_pyscf.mcscf import las_ao2mo
+        las = LASSCF (mf_df, (4,), (4,), spin_sub=(1,))
+        # Small max_memory to get several aux blocks
+        las.max_memory = lib.current_memory ()[0] + 20
+        h2eff_ref = las_ao2mo.get_h2eff_df (las, mf_df.mo_coeff, nthreads=1)
+        h2eff_test = las_ao2mo.get_h2eff_df (las, mf_df.mo_coeff, nthreads=3)
+        # sparsedf_array screening depends on the aux block size, which depends on nthreads
+        self.assertAlmostEqual (lib.fp (h2eff_test), lib.fp (h2eff_ref), 7)
+        self.assertAlmostEqual (lib.fp (h2eff_test.bmPu), lib.fp (h2eff_ref.bmPu), 6)
+
+    def test_h2eff_incr (self):
+        for my_mf, my_mc in ((mf, mc), (mf_df, mc_df)):
+            with self.subTest (df=(my_mf is mf_df)):
+                self._test_h2eff_incr (my_mf, my_mc)
+
+    def _test_h2eff_incr (self, my_mf, my_mc):
+        from pyscf.mcscf import mc_ao2mo
+        from pyscf.mcscf import df as mc_df
+        las = LASSCF (my_mf, (4,), (4,), spin_sub=(1,)).set (max_cycle_macro=1).run ()
+        ugg = las.get_ugg ()
+        h_op = las.get_hop (ugg=ugg)
+        h2eff_sub = las.get_h2eff (h_op.mo_coeff)
+        las.h2eff_incr_thresh = 1.0
+        np.random.seed (1)
+        xorb = (np.random.rand (ugg.nvar_orb) - 0.5)
+        errs, errs_eris = [], []
+        for scale in (1e-2, 1e-3):
+            x = np.zeros (ugg.nvar_tot)
+            x[:ugg.nvar_orb] = scale * xorb
+            mo1, ci1, h2eff_test = h_op.update_mo_ci_eri (x, h2eff_sub)
+            self.assertTrue (h_op.h2eff_sub_incr)
+            h2eff_ref = las.get_h2eff (mo1)
+            errs.append (np.amax (np.abs (h2eff_test - h2eff_ref)))
+            self.assertEqual (hasattr (h2eff_test, 'bmPu'), hasattr (h2eff_ref, 'bmPu'))
+            # The next Hessian operator rotates the (pp|aa) and (pa|pa) ERIs of this one
+            h_op1 = las.get_hop (ugg=ugg, mo_coeff=mo1, ci=ci1, h2eff_sub=h2eff_test)
+            self.assertFalse (hasattr (h2eff_test, 'prev_eris'))
+            if my_mf is mf_df:
+                eris_ref = mc_df._ERIS (las, mo1, las.with_df)
+            else:
+                eris_ref = mc_ao2mo._ERIS (las, mo1, method='incore', level=2)
+            errs_eris.append (max (np.amax (np.abs (h_op1.cas_type_eris.ppaa - eris_ref.ppaa[()])),
+                                   np.amax (np.abs (h_op1.cas_type_eris.papa - eris_ref.papa[()]))))
+        # Neglected terms are second-order in the active-unactive rotation for h2eff_sub, and
+        # first-order for the rotated ERIs
+        self.assertLess (errs[1], errs[0]/50)
+        self.assertLess (errs_eris[1], errs_eris[0]/5)
+        with self.subTest ('kernel'):
+            las.set (max_cycle_macro=50, conv_tol_grad=1e-5).run ()
+            self.assertTrue (las.converged)
+            self.assertAlmostEqual (las.e_tot, my_mc.e_tot, 6)
+
+    def test_h2eff_incr_kernel (self):
+        for my_mf, my_mc in ((mf, mc), (mf_df, mc_df)):
+            with self.subTest (df=(my_mf is mf_df)):
+                las = LASSCF (my_mf, (4,), (4,), spin_sub=(1,))
+                las.conv_tol_grad = 1e-5
+                las.h2eff_incr_thresh = 1.0
+                las.verbose = lib.logger.INFO
+                las.stdout = io.StringIO ()
+                las.kernel (my_mc.mo_coeff)
+                log = las.stdout.getvalue ()
+                # The incremental update was used, and convergence was confirmed afterwards
+                self.assertIn ('Rebuilding incrementally-updated h2eff_sub', log)
+                self.assertTrue (las.converged)
+                self.assertAlmostEqual (las.e_tot, my_mc.e_tot, 6)
+
     def test_derivatives (self):
         np.random.seed(1)
         las = LASSCF (mf, (4,), (4,), spin_sub=(1,)).set (max_cycle_macro=1, ah_level_shift=0).run ()
@@ -246,6 +246,25 @@ def case_contract_op_si (ks, las, h1, h2, ci_fr, nelec_frs, smult_fr=None, soc=0
         ks.assertAlmostEqual (lib.fp (ovlp_op (x)), lib.fp (ovlp @ x), 7)
         ks.assertAlmostEqual (lib.fp (ovlp_op (x)), lib.fp (ovlp @ x), 7)
         ks.assertAlmostEqual (lib.fp (ovlp_op (x)), lib.fp (x.conj () @ ovlp).conj (), 7)
+    xs = (2 * np.random.rand (nstates, 3)) - 1
+    if soc:
+        xs = xs + 1j*np.random.rand (nstates, 3)
+    with ks.subTest ('ham_op block'):
+        ks.assertAlmostEqual (lib.fp (ham_op.matmat (xs)), lib.fp (ham @ xs), 7)
+    with ks.subTest ('s2_op block'):
+        ks.assertAlmostEqual (lib.fp (s2_op.matmat (xs)), lib.fp (s2 @ xs), 7)
+    with ks.subTest ('ovlp_op block'):
+        ks.assertAlmostEqual (lib.fp (ovlp_op.matmat (xs)), lib.fp (ovlp @ xs), 7)
+    group_nthreads = ham_op.parent.group_nthreads
+    try:
+        ham_op.parent.group_nthreads = 3
+        with ks.subTest ('ham_op threaded'):
+            ks.assertAlmostEqual (lib.fp (ham_op (x)), lib.fp (ham @ x), 7)
+            ks.assertAlmostEqual (lib.fp (ham_op.matmat (xs)), lib.fp (ham @ xs), 7)
+        with ks.subTest ('s2_op threaded'):
+            ks.assertAlmostEqual (lib.fp (s2_op.matmat (xs)), lib.fp (s2 @ xs), 7)
+    finally:
+        ham_op.parent.group_nthreads = group_nthreads
 
 def debug_contract_op_si (ks, las, h1, h2, ci_fr, nelec_frs, smult_fr=None, soc=0):
     nroots = nelec_frs.shape[1]
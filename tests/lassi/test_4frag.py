@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import copy
+import functools
 import unittest
 import numpy as np
 from scipy import linalg
@@ -31,6 +32,7 @@ from mrh.my_pyscf.lassi import op_o0
 from mrh.my_pyscf.lassi import op_o1
 from mrh.my_pyscf.lassi import LASSIS
 from mrh.my_pyscf.lassi.op_o1.utilities import lst_hopping_index, get_scallowed_interactions
+from mrh.my_pyscf.lassi.op_o1.utilities import get_scallowed_interactions_blk
 from mrh.my_pyscf.lassi.op_o1 import get_fdm1_maker
 from mrh.my_pyscf.lassi.sitools import make_sdm1
 from mrh.tests.lassi.addons import case_contract_hlas_ci, case_lassis_fbf_2_model_state
@@ -160,6 +162,16 @@ class KnownValues(unittest.TestCase):
                     d12_o1_test = root_trans_rdm12s (las, las.ci, si_bra, si_ket, state=i,
                                                      soc=False, break_symmetry=False, opt=1)[r]
                     self.assertAlmostEqual (lib.fp (d12_o1_test), lib.fp (d12_o0[r][i]), 9)
+        d1, d2 = op_o1.roots_trans_rdm12s (las, las.ci, nelec_frs, si_bra, si_ket, compact=True)
+        with self.subTest ('compact'):
+            self.assertLess (d2.size, d12_o1[1].size)
+            self.assertAlmostEqual (lib.fp (d1), lib.fp (d12_o1[0]), 9)
+            self.assertAlmostEqual (lib.fp (np.asarray (d2)), lib.fp (d12_o1[1]), 9)
+            self.assertAlmostEqual (lib.fp (d2[1]), lib.fp (d12_o1[1][1]), 9)
+        with self.subTest ('compact einsum'):
+            eri = ham_2q (las, las.mo_coeff, veff_c=None, h2eff_sub=None)[2]
+            e2 = d2.einsum ('rsijtkl,ijkl->r', eri)
+            self.assertAlmostEqual (lib.fp (e2), lib.fp (lib.einsum ('rsijtkl,ijkl->r', d12_o1[1], eri)), 9)
 
     #@unittest.skip('debugging')
     def test_lassis (self):
@@ -251,6 +263,11 @@ class KnownValues(unittest.TestCase):
         nop = np.abs (hopping_index).sum ((0,1))
         exc_ref = np.asarray (np.where (nop<=4)).T
         self.assertTrue (np.all (exc_test==exc_ref))
+        nelec_rfs = nelec_frs.transpose (1,0,2)
+        nbra = nelec_rfs.shape[0] // 3
+        exc_blk = get_scallowed_interactions_blk (nelec_rfs[nbra:], nelec_rfs)
+        exc_blk[:,0] += nbra
+        self.assertTrue (np.all (exc_blk==exc_ref[exc_ref[:,0]>=nbra]))
 
     #@unittest.skip('debugging')
     def test_fdm1 (self):
@@ -262,6 +279,97 @@ class KnownValues(unittest.TestCase):
                     sdm1 = make_sdm1 (las, iroot, ifrag, si=si)
                     self.assertAlmostEqual (lib.fp (fdm1), lib.fp (sdm1), 7)
 
+    #@unittest.skip('debugging')
+    def test_make_ints_update (self):
+        from mrh.my_pyscf.lassi.op_o1 import frag
+        def flat (m):
+            if isinstance (m, list):
+                for x in m: yield from flat (x)
+            else: yield m
+        ints0 = frag.make_ints (las, las.ci, nelec_frs, smult_fr=smult_fr)[0]
+        # Rotate the local states of one rootspace of one fragment
+        ci1 = [list (c) for c in las.ci]
+        u = linalg.expm (np.array ([[0,0.3],[-0.3,0]]))
+        ci1[1][0] = np.tensordot (u, ci1[1][0], axes=1)
+        ints_ref = frag.make_ints (las, ci1, nelec_frs, smult_fr=smult_fr)[0]
+        ints_test = frag.make_ints (las, ci1, nelec_frs, smult_fr=smult_fr, ints0=ints0)[0]
+        for ifrag, (i0, i1, iref) in enumerate (zip (ints0, ints_test, ints_ref)):
+            with self.subTest ('reuse', ifrag=ifrag):
+                self.assertIs (i1, i0)
+                self.assertGreater (i1.nblks_reused, 0)
+                if ifrag == 1:
+                    self.assertGreater (i1.nblks_made, 0)
+                else:
+                    self.assertEqual (i1.nblks_made, 0)
+            for key in iref.mat_keys:
+                with self.subTest (key, ifrag=ifrag):
+                    for x, y in zip (flat (i1.mats[key]), flat (iref.mats[key])):
+                        self.assertEqual (x is None, y is None)
+                        if x is not None: self.assertAlmostEqual (lib.fp (x), lib.fp (y), 9)
+        FragTDMInt = functools.partial (frag.FragTDMInt, tdm_nthreads=3)
+        ints_test = frag.make_ints (las, ci1, nelec_frs, smult_fr=smult_fr,
+                                    _FragTDMInt_class=FragTDMInt)[0]
+        for ifrag, (i1, iref) in enumerate (zip (ints_test, ints_ref)):
+            for key in iref.mat_keys:
+                with self.subTest ('tdm_nthreads', key=key, ifrag=ifrag):
+                    for x, y in zip (flat (i1.mats[key]), flat (iref.mats[key])):
+                        self.assertEqual (x is None, y is None)
+                        if x is not None: self.assertAlmostEqual (lib.fp (x), lib.fp (y), 9)
+
+    #@unittest.skip('debugging')
+    def test_ints_cache (self):
+        from mrh.my_pyscf.lassi import LASSI
+        from mrh.my_pyscf.lassi.op_o1.frag import IntsCache
+        def get_nblks (cache):
+            made = [[i.nblks_made for i in ints] for ints in cache.values ()]
+            reused = [[i.nblks_reused for i in ints] for ints in cache.values ()]
+            return np.array (made), np.array (reused)
+        def get_lsi (ci=None):
+            lsi = LASSI (las, ci=ci, davidson_only=True)
+            lsi.sisolver.conv_tol = 1e-12
+            return lsi
+        # Perturb the local states of one rootspace of one fragment
+        ci1 = [list (c) for c in las.ci]
+        c = ci1[1][6]
+        c = c.reshape (c.shape[0], -1) + 0.1 * np.random.default_rng (0).random (c[0].size)
+        ci1[1][6] = linalg.qr (c.T, mode='economic')[0].T.reshape (ci1[1][6].shape)
+        lsi_ref = [get_lsi (ci=ci).run () for ci in (las.ci, ci1)]
+        self.assertGreater (abs (lsi_ref[1].e_roots[0] - lsi_ref[0].e_roots[0]), 1e-6)
+        dm_ref = [lsi.make_casdm12s () for lsi in lsi_ref]
+        lsi = get_lsi ()
+        lsi.sisolver.ints_cache = cache = IntsCache ()
+        lsi.kernel ()
+        self.assertEqual (len (cache), 1)
+        made, reused = get_nblks (cache)
+        self.assertTrue (np.all (made > 0))
+        self.assertTrue (np.all (reused == 0))
+        with self.subTest ('unchanged CI vectors'):
+            lsi.kernel ()
+            self.assertAlmostEqual (lsi.e_roots[0], lsi_ref[0].e_roots[0], 8)
+            made, reused = get_nblks (cache)
+            self.assertTrue (np.all (made == 0))
+            self.assertTrue (np.all (reused > 0))
+        with self.subTest ('make_casdm12s'):
+            for i in range (2):
+                dm1s, dm2s = lsi.make_casdm12s ()
+                self.assertAlmostEqual (lib.fp (dm1s), lib.fp (dm_ref[0][0]), 8)
+                self.assertAlmostEqual (lib.fp (dm2s), lib.fp (dm_ref[0][1]), 8)
+            self.assertEqual (len (cache), 2)
+            made, reused = get_nblks (cache)
+            self.assertTrue (np.all (made == 0))
+            self.assertTrue (np.all (reused > 0))
+        with self.subTest ('one rootspace of one fragment changed'):
+            lsi.ci = ci1
+            lsi.kernel ()
+            self.assertAlmostEqual (lsi.e_roots[0], lsi_ref[1].e_roots[0], 8)
+            dm1s, dm2s = lsi.make_casdm12s ()
+            self.assertAlmostEqual (lib.fp (dm1s), lib.fp (dm_ref[1][0]), 8)
+            self.assertAlmostEqual (lib.fp (dm2s), lib.fp (dm_ref[1][1]), 8)
+            made, reused = get_nblks (cache)
+            self.assertTrue (np.all (reused[:,[0,2,3]] > 0))
+            self.assertTrue (np.all (made[:,1] > 0))
+            self.assertTrue (np.all (made[:,[0,2,3]] == 0))
+
     #@unittest.skip('debugging')
     def test_contract_hlas_ci (self):
         h0, h1, h2 = ham_2q (las, las.mo_coeff)
@@ -272,6 +380,32 @@ class KnownValues(unittest.TestCase):
         h0, h1, h2 = ham_2q (las, las.mo_coeff)
         case_contract_op_si (self, las, h1, h2, las.ci, nelec_frs, smult_fr=smult_fr)
 
+    #@unittest.skip('debugging')
+    def test_contract_op_si_outcore (self):
+        from mrh.my_pyscf.lassi.op_o1 import hsi
+        class HamS2OvlpOperators (hsi.HamS2OvlpOperators):
+            # Pretend that the operator cache does not fit in memory
+            def checkmem_1oppart (self, exc, fn): return self.max_memory
+        h0, h1, h2 = ham_2q (las, las.mo_coeff)
+        ham, s2, ovlp = op[1].ham (las, h1, h2, las.ci, nelec_frs, smult_fr=smult_fr)[:3]
+        ham_op, s2_op, ovlp_op, hdiag = op[1].gen_contract_op_si_hdiag (
+            las, h1, h2, las.ci, nelec_frs, smult_fr=smult_fr,
+            _HamS2Ovlp_class=HamS2OvlpOperators)[:4]
+        self.assertIsNotNone (ham_op.parent.opcache_h5)
+        xs = (2 * np.random.rand (ham.shape[0], 3)) - 1
+        self.assertAlmostEqual (lib.fp (hdiag), lib.fp (ham.diagonal ()), 7)
+        self.assertAlmostEqual (lib.fp (ham_op.matmat (xs)), lib.fp (ham @ xs), 7)
+        self.assertAlmostEqual (lib.fp (s2_op.matmat (xs)), lib.fp (s2 @ xs), 7)
+        outcore_fallback = hsi.OUTCORE_FALLBACK
+        try:
+            hsi.OUTCORE_FALLBACK = False
+            with self.assertRaises (MemoryError):
+                op[1].gen_contract_op_si_hdiag (las, h1, h2, las.ci, nelec_frs,
+                                                smult_fr=smult_fr,
+                                                _HamS2Ovlp_class=HamS2OvlpOperators)
+        finally:
+            hsi.OUTCORE_FALLBACK = outcore_fallback
+
 
 if __name__ == "__main__":
     print("Full Tests for LASSI o1 4-fragment intermediates")
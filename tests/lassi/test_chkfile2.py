@@ -16,6 +16,7 @@
 import copy
 import unittest
 import tempfile
+import h5py
 import numpy as np
 from pyscf.tools import molden
 from pyscf import gto, scf, lib, mcscf
@@ -23,7 +24,7 @@ from mrh.my_pyscf.mcscf.lasscf_o0 import LASSCF
 from mrh.my_pyscf import lassi
 
 def setUpModule():
-    global mf, lsi, lsi2
+    global mf, las, lsi, lsi2
     xyz='''Li 0 0 0,
            H 2 0 0,
            Li 10 0 0,
@@ -44,9 +45,9 @@ def setUpModule():
         lsi2.load_chk_(chkfile=chkfile.name)
 
 def tearDownModule():
-    global mf, lsi, lsi2
+    global mf, las, lsi, lsi2
     mf.mol.stdout.close ()
-    del mf, lsi, lsi2
+    del mf, las, lsi, lsi2
 
 class KnownValues(unittest.TestCase):
     def test_config (self):
@@ -74,6 +75,49 @@ class KnownValues(unittest.TestCase):
             for j in range (lsi.nroots):
                 self.assertAlmostEqual (lib.fp (lsi.ci[i][j]), lib.fp (lsi2.ci[i][j]), 9)
 
+    def test_orth_cache (self):
+        orth_cache, orth_cache2 = lsi.sisolver.orth_cache, lsi2.sisolver.orth_cache
+        self.assertTrue (len (orth_cache) > 0)
+        self.assertListEqual (sorted (orth_cache.keys ()), sorted (orth_cache2.keys ()))
+        for key, xmat in orth_cache.items ():
+            if xmat is None:
+                self.assertIsNone (orth_cache2[key])
+            else:
+                self.assertAlmostEqual (lib.fp (xmat), lib.fp (orth_cache2[key]), 9)
+
+    def test_restart_si (self):
+        def make_lsi (max_cycle):
+            lsi3 = lassi.LASSIrq (las, r=2, q=2)
+            lsi3.sisolver.davidson_only = True
+            lsi3.sisolver.pspace_size = 3
+            lsi3.sisolver.nroots = 2
+            lsi3.sisolver.max_cycle = max_cycle
+            return lsi3
+        e_ref = make_lsi (100).kernel ()[0]
+        lsi3 = make_lsi (2)
+        lsi3.kernel ()
+        self.assertFalse (lsi3.converged_si)
+        with tempfile.NamedTemporaryFile() as chkfile:
+            lsi3 = make_lsi (3)
+            lsi3.kernel (chkfile_si=chkfile.name)
+            self.assertFalse (lsi3.converged_si)
+            with h5py.File (chkfile.name, 'r') as fh5:
+                blocks = list (fh5['lsi/sisolver'].values ())
+                self.assertEqual (len (blocks), 1)
+                for key in ('x', 'pspace_pw', 'pspace_pv', 'pspace_addr'):
+                    self.assertIn (key, blocks[0])
+            lsi3 = make_lsi (100)
+            lsi3.kernel (chkfile_si=chkfile.name, restart_si=True)
+            self.assertTrue (lsi3.converged_si)
+            for e, e3 in zip (e_ref, lsi3.e_roots):
+                self.assertAlmostEqual (e, e3, 7)
+            # Starting from the converged vectors, two cycles suffice, unlike a cold start
+            lsi3 = make_lsi (2)
+            lsi3.kernel (chkfile_si=chkfile.name, restart_si=True)
+            self.assertTrue (lsi3.converged_si)
+            for e, e3 in zip (e_ref, lsi3.e_roots):
+                self.assertAlmostEqual (e, e3, 7)
+
 if __name__ == "__main__":
     print("Full Tests for LASSCF chkfile")
     unittest.main()
@@ -1,5 +1,5 @@
 import numpy as np
-from pyscf import gto, scf, mcscf
+from pyscf import gto, scf, mcscf, lib
 from pyscf.fci import direct_spin1
 from mrh.my_pyscf.mcscf.lasscf_o0 import LASSCF
 from mrh.exploratory.unitary_cc import lasuccsd
@@ -66,7 +66,23 @@ class KnownValues(unittest.TestCase):
             chc = np.dot (c.conj (), hc)
             with self.subTest (from_='frag {} Hilbert-space dense effective Hamiltonian'.format (ifrag)):
                 self.assertAlmostEqual (chc, mc.e_tot, 9)
-            
+
+    def test_lasuccsd_fock_scratch (self):
+        mc = mcscf.CASCI (mf, 4, 4)
+        mc.mo_coeff = las.mo_coeff
+        mc.fcisolver = lasuccsd.FCISolver (mol)
+        mc.fcisolver.norb_f = [2,2]
+        mc.kernel ()
+        psi = mc.fcisolver.psi
+        h1, h0 = mc.get_h1eff ()
+        h = [h0, h1, mc.get_h2eff ()]
+        x = psi.x + 0.01 * np.cos (np.arange (psi.nvar))
+        e_ref, g_ref = psi.e_de (x, h)
+        mc.fcisolver.fock_scratch = True
+        self.assertIsInstance (psi.hc_x (x, h)[3], np.memmap)
+        e_test, g_test = psi.e_de (x, h)
+        self.assertAlmostEqual (e_test, e_ref, 12)
+        self.assertAlmostEqual (lib.fp (g_test), lib.fp (g_ref), 12)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import numpy as np
 from scipy import linalg
 from pyscf import lib
-from mrh.exploratory.unitary_cc import uccsd_sym1, lasuccsd
+from mrh.exploratory.unitary_cc import uccsd_sym0, uccsd_sym1, lasuccsd
 from itertools import product, combinations, combinations_with_replacement
 import unittest, math
 
@@ -67,6 +67,35 @@ class KnownValues(unittest.TestCase):
         self.assertEqual (uop.ngen, ngen)
         self.assertEqual (uop.ngen_uniq, ngen_uniq)
 
+    def test_uccsd_batched (self):
+        uop = lasuccsd.gen_uccsd_op (5, [3,2])
+        np.random.seed (0)
+        uop.set_uniq_amps_(np.random.rand (uop.ngen_uniq) - 0.5)
+        psi = np.random.rand (2**10)
+        uhupsi = np.random.rand (2**10)
+        for transpose in (False, True):
+            upsi_ref = psi.copy ()
+            for ix, aidx, iidx, amp in uop.gen_fac (reverse=transpose):
+                uccsd_sym0._op1u_(uop.norb, aidx, iidx, amp, upsi_ref, transpose=transpose)
+            self.assertAlmostEqual (lib.fp (uop (psi, transpose=transpose)), lib.fp (upsi_ref), 12)
+        grad_ref = [2*du.dot (uhu) for du, uhu in zip (uop.gen_deriv1 (psi, _full=False),
+                                                      uop.gen_partial (uhupsi))]
+        self.assertAlmostEqual (lib.fp (uop.get_grad (psi, uhupsi)), lib.fp (grad_ref), 9)
+
+    def test_uccsd_nthreads (self):
+        uop = lasuccsd.gen_uccsd_op (5, [3,2])
+        np.random.seed (1)
+        uop.set_uniq_amps_(np.random.rand (uop.ngen_uniq) - 0.5)
+        psi = np.random.rand (2**10)
+        uhupsi = np.random.rand (2**10)
+        results = []
+        for nthreads in (1, 3):
+            with lib.with_omp_threads (nthreads):
+                results.append ([uop (psi), uop.get_grad (psi, uhupsi),
+                                 uccsd_sym1.contract_s2 (psi, 5)])
+        for ref, test in zip (*results):
+            self.assertTrue (np.array_equal (ref, test))
+
 if __name__ == "__main__":
     print("Full Tests for UOP generation")
     unittest.main()
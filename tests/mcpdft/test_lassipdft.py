@@ -1,4 +1,6 @@
 import unittest
+import numpy as np
+from scipy import linalg
 from pyscf import lib, gto, scf
 from mrh.my_pyscf.mcscf.lasscf_o0 import LASSCF
 from mrh.my_pyscf.lassi import LASSI
@@ -42,6 +44,44 @@ class KnownValues(unittest.TestCase):
                 lsipdft.kernel()
                 self.assertAlmostEqual (lsipdft.e_tot[0], mc.e_tot, 7)
 
+    def test_otpd_direct (self):
+        xyz='''H 0 0 0
+               H 1 0 0
+               H 3 0 0
+               H 4 0 0'''
+        mol = gto.M (atom=xyz, basis='sto3g', symmetry=False, verbose=0, output='/dev/null')
+        mf = scf.RHF (mol).run ()
+        las = LASSCF (mf, (2,2), (2,2), spin_sub=(1,1))
+        las.lasci ()
+        las1 = all_single_excitations (las)
+        las1.lasci ()
+        lsi = LASSI (las1).run ()
+        from mrh.my_pyscf import mcpdft
+        kappa = np.zeros ((mol.nao, mol.nao))
+        kappa[1,2], kappa[0,3] = 0.1, -0.05
+        mo1 = lsi.mo_coeff @ linalg.expm (kappa - kappa.T)
+        for otxc in ('tPBE', 'ftPBE', 'tPBE0'):
+            lsipdft = mcpdft.LASSI (lsi, otxc, states=[0,1,2])
+            lsipdft.kernel ()
+            e_ref = lsipdft.e_tot
+            e1_ref = [lsipdft.energy_tot (mo_coeff=mo1, state=i)[0] for i in range (3)]
+            with self.subTest (otxc=otxc, batch=True):
+                # compute_pdft_energy_ evaluates all states on each grid block together
+                for i, e0 in enumerate (e_ref):
+                    self.assertAlmostEqual (lsipdft.energy_tot (state=i)[0], e0, 9)
+            with self.subTest (otxc=otxc, otpd_direct=True):
+                lsipdft = mcpdft.LASSI (lsi, otxc, states=[0,1,2])
+                lsipdft.otpd_direct = True
+                lsipdft.kernel ()
+                for i, (e1, e0) in enumerate (zip (lsipdft.e_tot, e_ref)):
+                    self.assertAlmostEqual (e1, e0, 9)
+                    self.assertAlmostEqual (lsipdft.energy_tot (state=i)[0], e0, 9)
+            with self.subTest (otxc=otxc, otpd_direct=True, mo_coeff='rotated'):
+                for i, e0 in enumerate (e1_ref):
+                    self.assertAlmostEqual (lsipdft.energy_tot (mo_coeff=mo1, state=i)[0], e0, 9)
+                for i, e0 in enumerate (e_ref):
+                    self.assertAlmostEqual (lsipdft.energy_tot (state=i)[0], e0, 9)
+
 if __name__ == "__main__":
     print("Full Tests for LASSI-PDFT")
     unittest.main()
@@ -1,13 +1,20 @@
 from scipy.sparse import linalg as sparse_linalg
 
 class CallbackLinearOperator (sparse_linalg.LinearOperator):
-    def __init__(self, parent, shape, dtype=None, matvec=None):
+    def __init__(self, parent, shape, dtype=None, matvec=None, matmat=None):
         self.parent = parent
         self.shape = shape 
         self.dtype = dtype   
         self._matvec_fn = matvec
+        self._matmat_fn = matmat
                              
     def _matvec (self, x):   
         # Just to shut up the stupid warning
         return self._matvec_fn (x)
 
+    def _matmat (self, x):
+        # Fall back to one column at a time only if no block callback is available
+        if self._matmat_fn is None:
+            return super()._matmat (x)
+        return self._matmat_fn (x)
+